@@ -76,6 +76,10 @@ if six.PY3:
 # Time the agent was first started.
 START_TIME = time.time()
 
+# Notifications arriving sooner than this after a poll are delayed, so a burst
+# of notifications does not turn into a burst of polls.
+MIN_NOTIFICATION_INTERVAL = 1
+
 
 class ResourcesImpl(resources.Resources):
     """Measure resource usage."""
@@ -529,15 +533,13 @@ class RekallAgent(common.AbstractAgentCommand):
                 # Switch to fast poll.
                 self.poll_wait = self._config.client.poll_min
             else:
-                # Slowly drift to slow poll
-                self.poll_wait += (self._config.client.poll_max -
-                                   self._config.client.poll_min) / 10
-                if self.poll_wait > self._config.client.poll_max:
-                    self.poll_wait = self._config.client.poll_max
+                # Back off exponentially while idle.
+                self.poll_wait = min(self.poll_wait * 2,
+                                     self._config.client.poll_max)
 
-                # Add a bit of randomness to stagger client polls.
-                self.poll_wait += random.randint(
-                    0, self._config.client.poll_min)
+            # Add a bit of randomness to stagger client polls.
+            wait = self.poll_wait + random.randint(
+                0, self._config.client.poll_min)
 
             # Wait a bit for the next poll. The wait may be interrupted by the
             # notifier.
@@ -549,18 +551,25 @@ class RekallAgent(common.AbstractAgentCommand):
             if not self._config.client.poll:
                 return []
 
-            while 1:
-                try:
-                    # If an event was sent by notifier, break immediately,
-                    # unless the event is too soon after the previous event.
-                    if (self._queue.get(block=True, timeout=self.poll_wait) and
-                        time.time() > now + 5):
-                        break
-
-                except Exception:
-                    # Wait at least as long as poll_wait.
-                    if time.time() > now + self.poll_wait:
-                        break
+            self._wait_for_jobs(now, wait)
+
+    def _wait_for_jobs(self, now, wait):
+        """Wait until the notifier tells us about new jobs or wait expires."""
+        deadline = now + wait
+        while 1:
+            try:
+                event = self._queue.get(
+                    block=True, timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                return
+
+            if event:
+                # Do not hit the server again too soon after the last poll.
+                holdoff = now + MIN_NOTIFICATION_INTERVAL - time.time()
+                if holdoff > 0:
+                    time.sleep(holdoff)
+
+                return
 
 
     def _Notify(self, event):
@@ -22,9 +22,21 @@
 
 __author__ = "Michael Cohen <scudette@google.com>"
 
-"""A local cache implementation."""
+"""A local cache implementation.
+
+The LocalDiskCache is content addressed: the data of every cached object is
+stored once as a blob named by its digest, and each path is materialized as a
+hard link to the blob (or a copy where hard links are not supported). The
+same binaries, profiles or collected files are therefore only stored once, and
+callers can check if a blob is already present before transferring it again
+(see has_blob() and store_blob_at_generation()).
+"""
+import collections
+import hashlib
 import os
 import shutil
+import tempfile
+import threading
 
 from rekall import cache
 from rekall import plugin
@@ -32,10 +44,21 @@ from rekall_agent import common
 from rekall_lib import serializer
 
 
+# Blobs are stored under this directory in the cache directory.
+BLOB_DIRECTORY = ".blobs"
+
+BUFFER_SIZE = 1024 * 1024
+
+
+def _is_generation(filename):
+    return filename.startswith("@") and filename.endswith("@")
+
+
 class Cache(common.AgentConfigMixin, serializer.SerializedObject):
     """Base cache which does nothing."""
 
-    def update_local_file_generation(self, path, generation, local_filename):
+    def update_local_file_generation(self, path, generation, local_filename,
+                                     digest=None):
         raise NotImplementedError()
 
     def get_generation(self, path):
@@ -48,16 +71,35 @@ class Cache(common.AgentConfigMixin, serializer.SerializedObject):
                             iterator=None):
         raise NotImplementedError()
 
+    def has_blob(self, digest):
+        return False
+
+    def store_blob_at_generation(self, path, generation, digest):
+        return None
+
 
 class LocalDiskCache(Cache):
     """Manages local copies of objects on the cloud.
 
-    Each object is stored in the cache with a generation number.
+    Each object is stored in the cache with a generation number. The data
+    itself is stored in a content addressed blob store, and the generation
+    file is a hard link to the blob. A sidecar file records the digest of each
+    generation.
+
+    A blob is deleted as soon as no generation refers to it any more. If
+    max_size is set, the least recently used blobs (and all the paths
+    referring to them) are evicted to keep the cache under that size. Blob
+    sizes, recency and references are then tracked in memory, so the cache
+    directory is only walked once.
     """
 
     schema = [
         dict(name="cache_directory",
              doc="Where to store the cached files."),
+
+        dict(name="max_size", type="int", default=0,
+             doc="Maximum total size of the cache in bytes (0 for no "
+             "limit)."),
     ]
 
     def __init__(self, *args, **kwargs):
@@ -70,35 +112,268 @@ class LocalDiskCache(Cache):
             self.cache_directory = os.path.join(
                 self.cache_directory, "rekall_agent")
 
-    def update_local_file_generation(self, path, generation, local_filename):
-        """Moves the file from local_filename into the correct place."""
-        # Where we need to write the file inside the cache.
-        destination = self.get_local_file(path, generation)
+        self._lock = threading.RLock()
 
-        # First make sure we remove any current generations of the path.
-        current_generation = self.get_generation(path)
-        if current_generation:
-            current_generation_path = self.get_local_file(
-                path, current_generation)
+        # When max_size is set: digest -> [size, set of generation paths],
+        # least recently used first.
+        self._blobs = None
+        self._total_size = 0
 
-            # The local_filename is actually the same as the
-            # current_generation_path so we can not remove it. It will be
-            # renamed below.
-            if current_generation_path != local_filename:
-                # Otherwise remove the old file.
-                self._session.logging.debug(
-                    "Expiring local cache %s", current_generation_path)
+    def _makedirs(self, path):
+        try:
+            os.makedirs(path)
+        except (OSError, IOError):
+            pass
+
+    def _blob_path(self, digest):
+        return os.path.join(self.cache_directory, BLOB_DIRECTORY,
+                            digest[:2], digest)
 
-                os.unlink(current_generation_path)
+    def _digest_path(self, generation_path):
+        return generation_path + ".sha1"
 
-        # Move the local_filename into the position it needs to be
-        # in. Ensure the output directory exists.
+    def _index(self):
+        """Returns the in memory blob index, loading it on first use.
+
+        Returns None if the cache size is not limited.
+        """
+        if not self.max_size:
+            return None
+
+        with self._lock:
+            if self._blobs is None:
+                self._load_index()
+
+            return self._blobs
+
+    def _load_index(self):
+        blob_directory = os.path.join(self.cache_directory, BLOB_DIRECTORY)
+        blobs = []
+        for root, _, files in os.walk(blob_directory):
+            if root == os.path.join(blob_directory, "tmp"):
+                continue
+
+            for digest in files:
+                try:
+                    s = os.lstat(os.path.join(root, digest))
+                except (IOError, OSError):
+                    continue
+
+                blobs.append((s.st_mtime, digest, s.st_size))
+
+        self._blobs = collections.OrderedDict()
+        self._total_size = 0
+        for _, digest, size in sorted(blobs):
+            self._blobs[digest] = [size, set()]
+            self._total_size += size
+
+        # Find the paths which refer to each blob.
+        for root, dirs, files in os.walk(self.cache_directory):
+            if (os.path.normpath(root) == os.path.normpath(
+                    self.cache_directory) and BLOB_DIRECTORY in dirs):
+                dirs.remove(BLOB_DIRECTORY)
+
+            for filename in files:
+                if not _is_generation(filename):
+                    continue
+
+                generation_path = os.path.join(root, filename)
+                digest = self._read_digest(generation_path)
+                if digest in self._blobs:
+                    self._blobs[digest][1].add(generation_path)
+
+    def _touch(self, digest):
+        """Mark the blob as the most recently used."""
+        index = self._index()
+        if index is None:
+            return
+
+        with self._lock:
+            entry = index.pop(digest, None)
+            if entry is None:
+                try:
+                    size = os.path.getsize(self._blob_path(digest))
+                except (IOError, OSError):
+                    return
+
+                entry = [size, set()]
+                self._total_size += size
+
+            index[digest] = entry
+
+    def _read_digest(self, generation_path):
         try:
-            os.makedirs(os.path.dirname(destination))
-        except (OSError, IOError):
+            with open(self._digest_path(generation_path), "rb") as fd:
+                return fd.read()
+        except (IOError, OSError):
             pass
 
-        shutil.move(local_filename, destination)
+    def _drop_blob(self, digest):
+        """Delete the blob unless a generation still links to it."""
+        blob_path = self._blob_path(digest)
+        try:
+            # Generations are hard links to the blob, so the blob is unused
+            # once it is the only link left.
+            if os.stat(blob_path).st_nlink > 1:
+                return
+
+            os.unlink(blob_path)
+        except (IOError, OSError):
+            return
+
+        self._session.logging.debug("Removed unused blob %s", digest)
+        with self._lock:
+            if self._blobs is not None:
+                entry = self._blobs.pop(digest, None)
+                if entry is not None:
+                    self._total_size -= entry[0]
+
+    def _release(self, generation_path, keep=None):
+        """Remove a generation and its blob if nothing else refers to it.
+
+        The blob with the digest keep is never removed.
+        """
+        digest = self._read_digest(generation_path)
+        for path in (generation_path, self._digest_path(generation_path)):
+            try:
+                os.unlink(path)
+            except (IOError, OSError):
+                pass
+
+        if digest:
+            with self._lock:
+                if self._blobs is not None and digest in self._blobs:
+                    self._blobs[digest][1].discard(generation_path)
+
+            if digest != keep:
+                self._drop_blob(digest)
+
+    def _clear_generations(self, containing_dir_path, keep=None):
+        """Remove all generations (and their digests) stored for a path."""
+        try:
+            filenames = os.listdir(containing_dir_path)
+        except (IOError, OSError):
+            return
+
+        generations = set()
+        for filename in filenames:
+            if filename.endswith(".sha1"):
+                filename = filename[:-len(".sha1")]
+
+            if _is_generation(filename):
+                generations.add(filename)
+
+        for filename in generations:
+            current_generation_path = os.path.join(
+                containing_dir_path, filename)
+
+            self._session.logging.debug(
+                "Expiring local cache %s", current_generation_path)
+            self._release(current_generation_path, keep=keep)
+
+    def _add_blob(self, local_filename, digest=None):
+        """Move local_filename into the blob store and return its digest."""
+        if digest is None:
+            sha1 = hashlib.sha1()
+            with open(local_filename, "rb") as fd:
+                while 1:
+                    data = fd.read(BUFFER_SIZE)
+                    if not data:
+                        break
+                    sha1.update(data)
+
+            digest = sha1.hexdigest()
+
+        blob_path = self._blob_path(digest)
+        if os.path.exists(blob_path):
+            # We already have this content.
+            os.unlink(local_filename)
+            os.utime(blob_path, None)
+        else:
+            self._makedirs(os.path.dirname(blob_path))
+            shutil.move(local_filename, blob_path)
+
+        self._touch(digest)
+        return digest
+
+    def _link_blob(self, digest, destination):
+        """Make destination a hard link (or a copy) of the blob."""
+        blob_path = self._blob_path(digest)
+        self._makedirs(os.path.dirname(destination))
+        try:
+            os.unlink(destination)
+        except (IOError, OSError):
+            pass
+
+        try:
+            os.link(blob_path, destination)
+        except (AttributeError, IOError, OSError):
+            # Hard links are not supported here.
+            shutil.copyfile(blob_path, destination)
+
+    def _materialize(self, digest, destination):
+        """Make destination refer to the blob."""
+        self._link_blob(digest, destination)
+        with open(self._digest_path(destination), "wb") as fd:
+            fd.write(digest)
+
+        index = self._index()
+        if index is not None:
+            with self._lock:
+                if digest in index:
+                    index[digest][1].add(destination)
+
+    def _temp_file(self):
+        """A temporary file on the same filesystem as the blobs."""
+        temp_dir = os.path.join(self.cache_directory, BLOB_DIRECTORY, "tmp")
+        self._makedirs(temp_dir)
+        return tempfile.mkstemp(dir=temp_dir)
+
+    def has_blob(self, digest):
+        """Is the content with this digest already in the cache?"""
+        blob_path = self._blob_path(digest)
+        try:
+            # Mark the blob as recently used.
+            os.utime(blob_path, None)
+        except (IOError, OSError):
+            return False
+
+        self._touch(digest)
+        return True
+
+    def get_digest(self, path, generation):
+        """Returns the digest of the data stored at path, or None."""
+        return self._read_digest(self.get_local_file(path, generation))
+
+    def store_blob_at_generation(self, path, generation, digest):
+        """Store an existing blob at the path without transferring it.
+
+        Returns the local file or None if we do not have the blob.
+        """
+        if not self.has_blob(digest):
+            return None
+
+        file_path = self.get_local_file(path, generation)
+        self._clear_generations(os.path.dirname(file_path), keep=digest)
+        self._materialize(digest, file_path)
+        return file_path
+
+    def update_local_file_generation(self, path, generation, local_filename,
+                                     digest=None):
+        """Moves the file from local_filename into the correct place.
+
+        If the sha1 digest of the file is already known it may be given to
+        avoid hashing it again.
+        """
+        # Where we need to write the file inside the cache.
+        destination = self.get_local_file(path, generation)
+
+        # The local_filename may be the current generation itself, so move it
+        # into the blob store before removing the old generations.
+        digest = self._add_blob(local_filename, digest)
+        self._clear_generations(os.path.dirname(destination), keep=digest)
+        self._materialize(digest, destination)
+        self._evict()
 
     def expire(self, path):
         current_generation = self.get_generation(path)
@@ -108,7 +383,7 @@ class LocalDiskCache(Cache):
 
             self._session.logging.debug(
                 "Expiring local cache %s", current_generation_path)
-            os.unlink(current_generation_path)
+            self._release(current_generation_path)
 
             # Trim empty directories.
             try:
@@ -125,7 +400,7 @@ class LocalDiskCache(Cache):
             self.cache_directory, path.lstrip(os.path.sep))
         try:
             for generation in os.listdir(containing_dir_path):
-                if generation.startswith("@") and generation.endswith("@"):
+                if _is_generation(generation):
                     return generation[1:-1]
         except (IOError, OSError):
             pass
@@ -145,53 +420,66 @@ class LocalDiskCache(Cache):
           fd: If specified we read from the fd and copy to the new file.
           iterator: An iterator that generates data to write.
         """
-        file_path = os.path.join(self.cache_directory, path.lstrip(os.path.sep),
-                                 "@" + generation + "@")
-        containing_dir_path = os.path.dirname(file_path)
-
-        # Clear the previous generations.
-        try:
-            for stored_generation in os.listdir(containing_dir_path):
-                if (stored_generation.startswith("@") and
-                    stored_generation.endswith("@")):
-                    current_generation_path = os.path.join(
-                        containing_dir_path, stored_generation)
-
-                    self._session.logging.debug(
-                        "Expiring local cache %s", current_generation_path)
-                    os.unlink(current_generation_path)
-        except (IOError, OSError):
-            pass
-
-        try:
-            os.makedirs(containing_dir_path)
-        except (IOError, OSError):
-            pass
+        file_path = self.get_local_file(path, generation)
 
+        # Write the data into a temp file, hashing it as we go.
+        sha1 = hashlib.sha1()
         count = 0
-        with open(file_path, "wb") as outfd:
+        temp_fd, temp_path = self._temp_file()
+        with os.fdopen(temp_fd, "wb") as outfd:
             if data:
+                sha1.update(data)
                 outfd.write(data)
             elif iterator:
                 for data in iterator:
                     count += len(data)
                     self._session.report_progress("Downloading %s", count)
+                    sha1.update(data)
                     outfd.write(data)
             else:
                 while 1:
-                    data = fd.read(1024*1024)
+                    data = fd.read(BUFFER_SIZE)
                     if not data:
                         break
 
                     count += len(data)
                     self._session.report_progress("Downloading %s", count)
+                    sha1.update(data)
                     outfd.write(data)
 
+        digest = self._add_blob(temp_path, sha1.hexdigest())
+
+        # Clear the previous generations.
+        self._clear_generations(os.path.dirname(file_path), keep=digest)
+        self._materialize(digest, file_path)
+
         self._session.logging.debug(
             "Creating cached file %s (%s bytes)", file_path, count)
 
+        self._evict()
         return file_path
 
+    def _evict(self):
+        """Evict least recently used blobs until we fit in max_size."""
+        index = self._index()
+        if index is None:
+            return
+
+        with self._lock:
+            while self._total_size > self.max_size and index:
+                digest, (size, references) = index.popitem(last=False)
+                self._total_size -= size
+                for path in list(references) + [self._blob_path(digest)]:
+                    try:
+                        os.unlink(path)
+                        if path in references:
+                            os.unlink(self._digest_path(path))
+                    except (IOError, OSError):
+                        pass
+
+                self._session.logging.debug(
+                    "Evicted blob %s from cache", digest)
+
     def stat(self, path):
         generation = self.get_generation(path)
         if generation:
@@ -209,9 +497,13 @@ class LocalDiskCache(Cache):
         containing_dir_path = os.path.join(
             self.cache_directory, path.lstrip(os.path.sep))
         try:
-            for root, _, files in os.walk(containing_dir_path):
+            for root, dirs, files in os.walk(containing_dir_path):
+                if (os.path.normpath(root) == os.path.normpath(
+                        self.cache_directory) and BLOB_DIRECTORY in dirs):
+                    dirs.remove(BLOB_DIRECTORY)
+
                 for filename in files:
-                    if filename.startswith("@") and filename.endswith("@"):
+                    if _is_generation(filename):
                         generation = filename[1:-1]
                         subpath = "/" + os.path.relpath(
                             root, self.cache_directory)
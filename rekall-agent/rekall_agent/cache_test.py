@@ -0,0 +1,104 @@
+#!/usr/bin/env python2
+
+# Rekall Memory Forensics
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Author: Michael Cohen scudette@google.com
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
+#
+
+__author__ = "Michael Cohen <scudette@google.com>"
+import hashlib
+import os
+import time
+
+from rekall import testlib
+from rekall_agent import cache
+
+
+class TestLocalDiskCache(testlib.RekallBaseUnitTestCase):
+    def setUp(self):
+        self.session = self.MakeUserSession()
+
+    def _make_cache(self, **kwargs):
+        return cache.LocalDiskCache.from_keywords(
+            session=self.session, cache_directory=self.temp_directory,
+            **kwargs)
+
+    def testDeduplication(self):
+        local_cache = self._make_cache()
+        first = local_cache.store_at_generation("/a/b", "1", data="hello")
+        second = local_cache.store_at_generation("/c", "2", data="hello")
+
+        # Both paths share the same data.
+        self.assertEqual(os.stat(first).st_ino, os.stat(second).st_ino)
+        self.assertEqual(local_cache.get_generation("/a/b"), "1")
+
+        digest = hashlib.sha1("hello").hexdigest()
+        self.assertEqual(local_cache.get_digest("/c", "2"), digest)
+        self.assertTrue(local_cache.has_blob(digest))
+
+        # Content we have can be stored without transferring it.
+        filename = local_cache.store_blob_at_generation("/d", "3", digest)
+        self.assertEqual(open(filename).read(), "hello")
+        self.assertEqual(local_cache.store_blob_at_generation(
+            "/d", "4", hashlib.sha1("other").hexdigest()), None)
+
+        # A new generation replaces the old one.
+        local_cache.store_at_generation("/c", "5", data="world")
+        self.assertEqual(local_cache.get_generation("/c"), "5")
+        self.assertEqual(
+            [x["path"] for x in local_cache.list_files("/")
+             if x["path"] == "/c"], ["/c"])
+
+    def testUnusedBlobsRemoved(self):
+        local_cache = self._make_cache()
+        local_cache.store_at_generation("/a", "1", data="hello")
+        local_cache.store_at_generation("/b", "1", data="hello")
+        hello = hashlib.sha1("hello").hexdigest()
+
+        # The blob is still used by /b.
+        local_cache.store_at_generation("/a", "2", data="world")
+        self.assertTrue(local_cache.has_blob(hello))
+
+        # Once the last reference is gone the blob is removed.
+        local_cache.expire("/b")
+        self.assertFalse(local_cache.has_blob(hello))
+
+        local_cache.store_at_generation("/a", "3", data="again")
+        self.assertFalse(local_cache.has_blob(
+            hashlib.sha1("world").hexdigest()))
+
+    def testEviction(self):
+        local_cache = self._make_cache(max_size=2500)
+        local_cache.store_at_generation("/a", "1", data="A" * 1000)
+        local_cache.store_at_generation("/b", "1", data="A" * 1000)
+
+        # Make sure the blobs have different access times.
+        time.sleep(1)
+        local_cache.store_at_generation("/c", "1", data="B" * 1000)
+        time.sleep(1)
+        local_cache.store_at_generation("/d", "1", data="C" * 1000)
+
+        # The least recently used blob is evicted with all its paths.
+        self.assertEqual(local_cache.get_generation("/a"), None)
+        self.assertEqual(local_cache.get_generation("/b"), None)
+        self.assertEqual(local_cache.get_generation("/c"), "1")
+        self.assertEqual(local_cache.get_generation("/d"), "1")
+
+
+if __name__ == "__main__":
+    testlib.main()
@@ -52,7 +52,8 @@ class CollectActionImpl(actions.CollectAction):
 
         # Open the collection for writing and upload it.
         with self.collection:
-            for row in self.collect():
-                self.collection.insert(row=row)
+            with self.collection.bulk_insert() as inserter:
+                for row in self.collect():
+                    inserter.insert(row=row)
 
         return [self.collection]
@@ -28,13 +28,10 @@ These client actions are designed to maintain the client's Virtual File System
 (VFS) view.
 """
 
-import re
-import os
-
-
 import psutil
 
 from rekall import kb
+from rekall.plugins.common.efilter_plugins import helpers
 from rekall.plugins.response import common
 
 from rekall_agent import action
@@ -98,6 +95,8 @@ class MountPointHook(kb.ParameterHook):
                 partition.device,
                 partition.fstype)
 
+        return devices
+
 
 def lookup_mount_point(devices, path):
     """Resolve the mount point that contains the path.
@@ -128,10 +127,10 @@ class ListDirectoryAction(action.ActionImpl):
 
     This essentially returns a big collection of the file's stats.
 
-    NOTE: We use the glob plugin to actually collect the files. We
-    could have just implemented this on the server using the EFilter
-    collection mechanism but this is currently too slow for so many
-    results.
+    NOTE: We use the shared DirectoryWalker to actually collect the
+    files. We could have just implemented this on the server using the
+    EFilter collection mechanism but this is currently too slow for so
+    many results.
 
     Maybe in future efilter will be faster and we can deprecates this
     action.
@@ -159,130 +158,75 @@ class ListDirectoryAction(action.ActionImpl):
              doc="The set of valid filesystems we may recurse into."),
     ]
 
+    def _stat_entry(self, result):
+        return dict(dirname=unicode(result.filename.dirname),
+                    filename=unicode(result.filename.basename),
+                    st_mode=result.st_mode,
+                    st_mode_str=result.st_mode,
+                    st_ino=result.st_ino,
+                    st_dev=result.st_dev,
+                    st_nlink=result.st_nlink,
+                    st_uid=result.st_uid.uid,
+                    st_gid=result.st_gid.gid,
+                    st_size=result.st_size,
+                    st_atime=int(result.st_atime),
+                    st_mtime=int(result.st_mtime),
+                    st_ctime=int(result.st_ctime))
+
     def collect(self):
         # Make a filespec for the root directory.
-        root = common.FileSpec(self.path, path_sep=self.path_sep)
-
-        # Now we just build a glob pattern for recursing into the
-        # directory.
-        glob = root.add("**%s" % self.depth)
-
-        glob_plugin = self._session.plugins.glob(
-            globs=[glob.name],
-            path_sep=glob.path_sep)
-
-        for row in glob_plugin.collect():
-            result = row["path"]
-            yield dict(dirname=unicode(result.filename.dirname),
-                       filename=unicode(result.filename.basename),
-                       st_mode=result.st_mode,
-                       st_mode_str=result.st_mode,
-                       st_ino=result.st_ino,
-                       st_dev=result.st_dev,
-                       st_nlink=result.st_nlink,
-                       st_uid=result.st_uid.uid,
-                       st_gid=result.st_gid.gid,
-                       st_size=result.st_size,
-                       st_atime=int(result.st_atime),
-                       st_mtime=int(result.st_mtime),
-                       st_ctime=int(result.st_ctime))
-
-    def normalize_path(self, path):
-        return path.replace("\\", "/")
-
-    drive_re = re.compile("/([a-zA-Z]:)(.*)")
-    def splitdrive(self, path):
-        m = self.drive_re.match(path)
-        if m:
-            return m.group(1), m.group(2) or "/"
-
-        return "", path or "/"
-
-    def listdir(self, root):
-        drive, path = self.splitdrive(root)
-        if not drive:
-            from rekall.plugins.response import windows
-
-            for drive in windows.get_drives():
-                yield drive + os.path.sep
-
-        else:
-            for x in os.listdir(path):
-                yield x
-
-    def _process_files(self, root, files):
-        drive, path = self.splitdrive(root)
-        if not drive:
-            from rekall.plugins.response import windows
-
-            for drive in windows.get_drives():
-                yield dict(filename=self.normalize_path(drive + os.path.sep),
-                           dirname="/", st_mode=0775)
-
+        root = common.FileFactory(
+            common.FileSpec(self.path, path_sep=self.path_sep),
+            session=self._session)
+        if not root:
             return
 
-        root = utils.normpath(root)
-        for f in files:
-            path = os.path.join(root, f)
-            result = dict(
-                filename=self.normalize_path(f),
-                dirname=self.normalize_path(root),
-                st_mode=0)
-
-            try:
-                s = os.lstat(path)
-                result["st_mode"] = s.st_mode
-                result["st_ino"] = s.st_ino
-                result["st_dev"] = s.st_dev
-                result["st_nlink"] = s.st_nlink
-                result["st_uid"] = s.st_uid
-                result["st_gid"] = s.st_gid
-                result["st_size"] = s.st_size
-                result["st_mtime"] = s.st_mtime
-                result["st_ctime"] = s.st_ctime
-                result["st_atime"] = s.st_atime
-            except Exception:
-                pass
-
-            self._session.report_progress("Processing %s", path)
-            yield result
-
-    def collect(self):
-        if self.recursive:
-            for root, directories, files in os.walk(self.path):
-                for x in helpers.ListFilter().filter(
-                        self.filter,
-                        self._process_files(root, files)):
-                    yield x
-
-                new_dirs = []
-                for x in helpers.ListFilter().filter(
-                        self.filter,
-                        self._process_files(root, directories)):
-                    yield x
-                    new_dirs.append(x["filename"])
-
-                # os.walk allows us to control recursion by mutating the
-                # data list.
-                directories[:] = new_dirs
-
-        else:
-            for x in helpers.ListFilter().filter(
-                    self.filter,
-                    self._process_files(self.path, self.listdir(self.path))):
-                yield x
-
+        # The root directory itself is part of the listing.
+        for row in helpers.ListFilter().filter(
+                self.filter, [self._stat_entry(root)]):
+            yield row
+
+        mount_tree = self._session.GetParameter("mount_points")
+
+        # Walk the tree, listing subdirectories concurrently.
+        walker = common.DirectoryWalker(session=self._session)
+        for _, children, subdirectories in walker.walk(
+                root, max_depth=self.depth):
+            # Like the rows, we only recurse into directories which pass the
+            # filter.
+            selected = set()
+            for row in helpers.ListFilter().filter(
+                    self.filter, [self._stat_entry(x) for x in children]):
+                selected.add(row["filename"])
+                yield row
+
+            subdirectories[:] = [
+                x for x in subdirectories
+                if unicode(x.filename.basename) in selected and
+                self._valid_filesystem(mount_tree, x)]
+
+    def _valid_filesystem(self, mount_tree, directory):
+        """Only recurse into directories on the valid_filesystems."""
+        if not mount_tree:
+            return True
+
+        mount_point = lookup_mount_point(mount_tree, directory.filename.name)
+        if mount_point is None:
+            return True
+
+        return mount_point[2] in self.valid_filesystems
 
     def run(self, flow_obj=None):
         if not self.is_active():
             return []
 
-        # Create a result colleciton and just dump the output of glob
-        # into it.
+        # Create a result colleciton and just dump the output of the
+        # walker into it.
         self._collection = StatEntryCollection(session=self._session)
         self._collection.location = self.vfs_location.copy()
         with self._collection.create_temp_file():
-            for row in self.collect():
-                self._collection.insert(**row)
+            with self._collection.bulk_insert() as inserter:
+                for row in self.collect():
+                    inserter.insert(row=row)
 
         return [self._collection]
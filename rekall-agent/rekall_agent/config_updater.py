@@ -35,6 +35,7 @@ from rekall_agent import crypto
 from rekall_agent.config import agent
 from rekall_agent.client_actions import interrogate
 from rekall_agent.locations import cloud
+from rekall_agent.locations import http_location
 from rekall_agent.policies import gcs
 from rekall_agent.servers import http_server
 
@@ -338,9 +339,12 @@ class AgentServerInitializeLocalHTTP(AgentServerInitialize):
             certificate=self.server_cert,
             private_key=self.server_private_key,
         )
-        config.client = http_location.HTTPClientPolicy.from_keywords(
+        config.client = http_server.HTTPClientPolicy.from_keywords(
             session=self.session,
-            manifest_location=config.server.manifest_for_client()
+            manifest_location=config.server.manifest_for_client(),
+            # Wait on the server for new jobs instead of polling quickly.
+            notifier=http_location.LongPollNotifier.from_keywords(
+                session=self.session, base=self.plugin_args.base_url),
         )
 
         super(AgentServerInitializeLocalHTTP, self)._build_config(config)
@@ -68,6 +68,12 @@ FlowStatus messages maintain the current state of each flow. The FlowStatus
 batch updates the client's flow collection to reflect the latest view of flow's
 activities.
 
+Tickets are coalesced before they are written: Each collection (the client's
+flow database or the hunt's database) is updated in a single transaction per
+batch, only the latest ticket of each flow is written, and each flow's post
+processing receives all of its tickets at once. Each collection is processed
+as its own task on the thread pool, so a collection is only ever updated by one
+worker.
 """
 import os
 import time
@@ -85,6 +91,18 @@ from rekall_agent.messages import resources
 from rekall_lib import serializer
 
 
+def group_tickets_by_flow(tickets):
+    """Group tickets by flow id, each group sorted by timestamp."""
+    result = {}
+    for ticket in tickets:
+        result.setdefault(ticket.flow_id, []).append(ticket)
+
+    for flow_tickets in result.itervalues():
+        flow_tickets.sort(key=lambda x: x.timestamp)
+
+    return result
+
+
 class FlowStatus(batch.BatchTicket):
     """Information about flow's progress.
 
@@ -155,6 +173,9 @@ class FlowStatus(batch.BatchTicket):
         for flow_data in common.THREADPOOL.map(
                 lambda f: config.server.flows_for_server(f).read_file(),
                 set(flow_ids)):
+            if not flow_data:
+                continue
+
             flow_obj = Flow.from_json(flow_data, session=session)
             flows[flow_obj.flow_id] = flow_obj
 
@@ -169,25 +190,29 @@ class FlowStatus(batch.BatchTicket):
     def _process_flows(_args):
         tickets, client_id, session, flows = _args
         config = session.GetParameter("agent_config_obj")
+        tickets_by_flow = group_tickets_by_flow(tickets)
 
-        def _update_flow_info(flow_collection, tickets):
+        def _update_flow_info(flow_collection):
             """Update the collection atomically."""
-            # Process all tickets for all flows in the same client.
-            for ticket in tickets:
-                flow_id = ticket.flow_id
-
+            # Tickets carry the flow's cumulative state, so only the latest
+            # ticket of each flow needs to be written.
+            for flow_id, flow_tickets in tickets_by_flow.iteritems():
+                ticket = flow_tickets[-1]
                 flow_collection.replace(
                     condition=dict(flow_id=flow_id),
                     status=ticket.status, ticket_data=ticket.to_json(),
                     last_active=ticket.timestamp,
                 )
 
-                flow_obj = flows.get(flow_id)
-                flow_obj.post_process([ticket])
-
         FlowStatsCollection.transaction(
             config.server.flow_db_for_server(client_id),
-            _update_flow_info, tickets, session=session)
+            _update_flow_info, session=session)
+
+        # Post process each flow once with all its tickets.
+        for flow_id, flow_tickets in tickets_by_flow.iteritems():
+            flow_obj = flows.get(flow_id)
+            if flow_obj:
+                flow_obj.post_process(flow_tickets)
 
 
 class HuntStatus(FlowStatus):
@@ -206,27 +231,32 @@ class HuntStatus(FlowStatus):
         tickets, flow_id, session, flows = _args
         config = session.GetParameter("agent_config_obj")
 
-        def _update_flow_info(flow_collection, tickets):
-            """Update the collection atomically."""
-            # Process all tickets in the same hunt (flow_id) from different
-            # clients.
-            for ticket in tickets:
-                # We only care about clients which are done.
-                if ticket.status in ["Done", "Error"]:
-                    flow_collection.insert(
-                        client_id=ticket.client_id,
-                        status=ticket.status,
-                        executed=ticket.timestamp,
-                        ticket_data=ticket.to_json(),
-                    )
+        # Only keep the final ticket from each client.
+        finished = {}
+        for ticket in sorted(tickets, key=lambda x: x.timestamp):
+            # We only care about clients which are done.
+            if ticket.status in ["Done", "Error"]:
+                finished[ticket.client_id] = ticket
 
-            flow_obj = flows.get(flow_id)
+        def _update_flow_info(flow_collection):
+            """Update the collection atomically."""
+            # Write all clients in the same hunt (flow_id) at once.
+            flow_collection.insert_many(
+                dict(client_id=ticket.client_id,
+                     status=ticket.status,
+                     executed=ticket.timestamp,
+                     ticket_data=ticket.to_json())
+                for ticket in finished.itervalues())
+
+        if finished:
+            HuntStatsCollection.transaction(
+                config.server.hunt_db_for_server(flow_id),
+                _update_flow_info, session=session)
+
+        flow_obj = flows.get(flow_id)
+        if flow_obj:
             flow_obj.post_process(tickets)
 
-        HuntStatsCollection.transaction(
-            config.server.hunt_db_for_server(flow_id),
-            _update_flow_info, tickets, session=session)
-
 
 class Flow(common.AgentConfigMixin, serializer.SerializedObject):
     """A Flow is a sequence of client actions.
@@ -30,6 +30,7 @@ import json
 import gzip
 import os
 import rfc822
+import shutil
 import StringIO
 import urllib
 import tempfile
@@ -435,6 +436,7 @@ class GCSLocation(location.Location):
 
             # Store the generation of this object in the cache.
             current_generation = json.loads(resp.headers["ETag"])
+
             filename = self._cache.store_at_generation(
                 base_url, current_generation,
                 iterator=resp.iter_content(chunk_size=1024*1024))
@@ -531,10 +533,17 @@ class GCSOAuth2BasedLocation(GCSLocation):
             current_generation = None
             try:
                 try:
-                    local_filename = self.get_local_filename()
+                    cached_filename = self.get_local_filename()
 
                     # The current generation in the cache.
                     current_generation = self._cache.get_generation(base_url)
+
+                    # The cached file may share its data with other cached
+                    # files so we must modify a copy of it.
+                    fd, local_filename = tempfile.mkstemp()
+                    os.close(fd)
+                    local_file_should_be_removed = True
+                    shutil.copyfile(cached_filename, local_filename)
                 except IOError:
                     # File does not exist on the server, make a tmpfile.
                     fd, local_filename = tempfile.mkstemp()
@@ -26,9 +26,13 @@ __author__ = "Michael Cohen <scudette@google.com>"
 """
 import io
 import hashlib
+import json
 import logging
+import os
+import threading
 import time
 import urllib
+from multiprocessing import pool
 from wsgiref import handlers
 
 import requests
@@ -45,6 +49,15 @@ import sseclient
 
 MAX_BUFF_SIZE = 10*1024*1024
 
+# Chunked uploads send this much data per request.
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# How many chunks may be uploading at the same time.
+UPLOAD_CHUNKS_IN_FLIGHT = 4
+
+# How many times we try to send each chunk.
+UPLOAD_CHUNK_RETRIES = 5
+
 
 class URLPolicy(serializer.SerializedObject):
     """Expresses the policy for managing URLs."""
@@ -71,6 +84,128 @@ def _join_url(base, *components):
     return base.rstrip("/") + "/" + utils.join_path(*components).lstrip("/")
 
 
+class ChunkedUploader(object):
+    """Upload a file in chunks, several chunks at a time.
+
+    Each chunk carries its own checksum and is retried with exponential back
+    off. Once all chunks are sent the upload is committed. Uploads are
+    identified by an upload id - if an upload fails it can be resumed by
+    uploading again with the same upload id, in which case only the chunks
+    the server does not already have are sent.
+
+    Since many chunks are in flight at once, throughput on high latency links
+    is not limited to one round trip per chunk.
+    """
+
+    def __init__(self, requests_session, url, sign=None, headers=None,
+                 chunk_size=UPLOAD_CHUNK_SIZE,
+                 in_flight=UPLOAD_CHUNKS_IN_FLIGHT,
+                 retries=UPLOAD_CHUNK_RETRIES, session=None):
+        self.requests_session = requests_session
+        self.url = url
+        self.sign = sign
+        self.headers = headers or {}
+        self.chunk_size = chunk_size
+        self.in_flight = in_flight
+        self.retries = retries
+        self.session = session
+        self._lock = threading.Lock()
+
+    def _request(self, method, params, data=""):
+        headers = self.headers.copy()
+        if data:
+            headers["x-rekall-chunk-sha1"] = hashlib.sha1(data).hexdigest()
+
+        if self.sign:
+            self.sign(data, self.url, headers)
+
+        return self.requests_session.request(
+            method, self.url, params=params, data=data, headers=headers)
+
+    def _read_chunk(self, fd, offset):
+        with self._lock:
+            fd.seek(offset)
+            return fd.read(self.chunk_size)
+
+    def _get_status(self, upload_id):
+        """Returns the chunks the server already has."""
+        try:
+            resp = self._request(
+                "GET", dict(action="upload_status", upload_id=upload_id))
+            if resp.ok:
+                return dict((int(k), v) for k, v in json.loads(
+                    resp.content).iteritems())
+        except (requests.RequestException, ValueError):
+            pass
+
+        return {}
+
+    def _upload_chunk(self, fd, upload_id, offset):
+        data = self._read_chunk(fd, offset)
+        backoff = 0.5
+        for _ in range(self.retries):
+            try:
+                resp = self._request(
+                    "PUT", dict(action="chunk", upload_id=upload_id,
+                                offset=offset), data=data)
+                if resp.ok:
+                    return
+
+                # The server rejected this chunk - no point retrying.
+                if 400 <= resp.status_code < 500:
+                    raise IOError("Chunk at %d rejected: %s" % (
+                        offset, resp.status_code))
+
+            except requests.RequestException:
+                pass
+
+            time.sleep(backoff)
+            backoff *= 2
+
+        raise IOError("Unable to upload chunk at offset %d" % offset)
+
+    def upload(self, fd, upload_id=None):
+        """Upload the file like object fd.
+
+        Raises IOError if the upload fails, in which case it may be resumed
+        by calling upload() again with the same upload_id.
+        """
+        if upload_id is None:
+            upload_id = os.urandom(16).encode("hex")
+
+        fd.seek(0, 2)
+        length = fd.tell()
+
+        # Skip chunks the server already has from a previous attempt.
+        received = self._get_status(upload_id)
+        offsets = []
+        for offset in range(0, length, self.chunk_size):
+            chunk = received.get(offset)
+            if chunk and chunk[1] == hashlib.sha1(
+                    self._read_chunk(fd, offset)).hexdigest():
+                continue
+
+            offsets.append(offset)
+
+        workers = pool.ThreadPool(self.in_flight)
+        try:
+            for i, _ in enumerate(workers.imap_unordered(
+                    lambda x: self._upload_chunk(fd, upload_id, x), offsets)):
+                if self.session:
+                    self.session.report_progress(
+                        "%s: Uploaded %s/%s chunks", self.url, i + 1,
+                        len(offsets))
+        finally:
+            workers.terminate()
+
+        resp = self._request(
+            "PUT", dict(action="commit", upload_id=upload_id, size=length))
+        if not resp.ok:
+            raise IOError("Unable to commit upload: %s" % resp.status_code)
+
+        return resp
+
+
 class HTTPLocationImpl(common.AgentConfigMixin, location.HTTPLocation):
     """A stand along HTTP server location."""
 
@@ -147,6 +282,61 @@ class HTTPLocationImpl(common.AgentConfigMixin, location.HTTPLocation):
 
         return ""
 
+    def upload_file_object(self, fd, upload_id=None, completion_routine=None,
+                           **kw):
+        """Upload the file like object fd in chunks.
+
+        If upload_id is not given, one is derived from the destination and
+        the content of the data. A failed upload of the same file resumes
+        where it left off, while concurrent uploads of different data to the
+        same destination do not share their chunks.
+        """
+        url_endpoint, _, headers, _ = self._get_parameters(**kw)
+        if upload_id is None:
+            digest = hashlib.sha1(utils.SmartStr(url_endpoint) + ":")
+            fd.seek(0)
+            while 1:
+                data = fd.read(UPLOAD_CHUNK_SIZE)
+                if not data:
+                    break
+
+                digest.update(data)
+
+            upload_id = digest.hexdigest()
+
+        uploader = ChunkedUploader(
+            self.get_requests_session(), url_endpoint,
+            sign=self.add_signature, headers=headers,
+            chunk_size=self._session.GetParameter(
+                "upload_chunk_size", UPLOAD_CHUNK_SIZE),
+            in_flight=self._session.GetParameter(
+                "upload_chunks_in_flight", UPLOAD_CHUNKS_IN_FLIGHT),
+            session=self._session)
+
+        try:
+            resp = uploader.upload(fd, upload_id=upload_id)
+        except IOError as e:
+            return self._report_error(completion_routine, message=str(e))
+
+        self._session.logging.debug("Uploaded file: %s (%s bytes)",
+                                    url_endpoint, fd.tell())
+
+        return self._report_error(completion_routine, resp)
+
+    def upload_local_file(self, local_filename=None, fd=None, delete=True,
+                          completion_routine=None, **kw):
+        if local_filename:
+            fd = open(local_filename, "rb")
+
+        try:
+            return self.upload_file_object(
+                fd, completion_routine=completion_routine, **kw)
+        finally:
+            if local_filename:
+                fd.close()
+                if delete:
+                    os.unlink(local_filename)
+
     def add_signature(self, data, url, headers):
         # Calculate the signature on the data.
         private_key = self._config.client.writeback.private_key
@@ -190,7 +380,7 @@ class HTTPLocationImpl(common.AgentConfigMixin, location.HTTPLocation):
             if completion_routine:
                 return completion_routine(status)
 
-            raise IOError(response.text)
+            raise IOError(message if response is None else response.text)
         else:
             if completion_routine:
                 completion_routine(status)
@@ -200,17 +390,38 @@ class HTTPLocationImpl(common.AgentConfigMixin, location.HTTPLocation):
 
 class BlobUploaderImpl(HTTPLocationImpl, location.BlobUploader):
 
-    def write_file(self, data, **kwargs):
+    def write_file(self, data, completion_routine=None, **kwargs):
+        return self.upload_file_object(
+            io.BytesIO(utils.SmartStr(data)),
+            completion_routine=completion_routine, **kwargs)
+
+    def upload_file_object(self, fd, completion_routine=None, **kwargs):
+        # Our own URL only gives the upload spec, the data goes to the blob
+        # endpoint it names.
         spec = location.BlobUploadSpecs.from_json(self.read_file(**kwargs))
 
-        # Upload the file to the blob endpoint.
+        fd.seek(0)
         resp = self.get_requests_session().post(
-            spec.url, files={spec.name: io.BytesIO(utils.SmartStr(data))})
+            spec.url, files={spec.name: fd})
 
         self._session.logging.debug("Uploaded file: %s (%s bytes)",
-                                    spec.url, len(data))
+                                    spec.url, fd.tell())
 
-        return self._report_error(None, resp)
+        return self._report_error(completion_routine, resp)
+
+    def upload_local_file(self, local_filename=None, fd=None, delete=True,
+                          completion_routine=None, **kwargs):
+        if local_filename:
+            fd = open(local_filename, "rb")
+
+        try:
+            return self.upload_file_object(
+                fd, completion_routine=completion_routine, **kwargs)
+        finally:
+            if local_filename:
+                fd.close()
+                if delete:
+                    os.unlink(local_filename)
 
 
 class Reader(object):
@@ -257,7 +468,8 @@ class Reader(object):
 
 class FileUploadLocationImpl(HTTPLocationImpl, location.FileUploadLocation):
 
-    def upload_file_object(self, fd, file_information=None, **kw):
+    def upload_file_object(self, fd, file_information=None,
+                           completion_routine=None, **kw):
         """Upload a local file.
 
         Read data from fd. If file_information is provided, then we use this to
@@ -308,6 +520,9 @@ class FileUploadLocationImpl(HTTPLocationImpl, location.FileUploadLocation):
                 self._session.logging.warn(
                     "Error uploading file: %s", resp.content)
 
+        if completion_routine:
+            return self._report_error(completion_routine, resp)
+
 
 class FirbaseNotifier(HTTPLocationImpl, location.NotificationLocation):
     """Read notifications from the server."""
@@ -333,3 +548,62 @@ class FirbaseNotifier(HTTPLocationImpl, location.NotificationLocation):
             self._session.logging.debug(
                 "Firebase connection reset, backing off.")
             time.sleep(60)
+
+
+class LongPollNotifier(HTTPLocationImpl, location.NotificationLocation):
+    """Block on the HTTP server until one of our job queues changes.
+
+    The server holds each request open until a job file changes or the
+    timeout expires, at which point we immediately ask again. This delivers
+    new jobs with very low latency without the agent having to poll quickly.
+    If the server is unreachable we back off exponentially.
+    """
+
+    schema = [
+        dict(name="timeout", type="int", default=60,
+             doc="How long the server should hold each request open."),
+    ]
+
+    def _wait(self, generations, timeout):
+        queues = self._config.client.get_jobs_queues()
+        paths = [x.path_prefix for x in queues]
+        params = dict(action="wait", timeout=timeout, path=paths,
+                      generation=[generations.get(x, "0") for x in paths])
+
+        resp = self.get_requests_session().get(
+            _join_url(self.base, "/"), params=params,
+            timeout=timeout + 30)
+
+        if resp.status_code == 304:
+            return {}
+
+        if not resp.ok:
+            raise IOError("Wait request failed: %s" % resp.status_code)
+
+        return json.loads(resp.content)
+
+    def Start(self, callback):
+        generations = {}
+        backoff = self._config.client.poll_min
+
+        # The first request just learns the current generations without
+        # waiting - the agent reads its job queues when it starts anyway.
+        timeout = 0
+        while 1:
+            try:
+                changed = self._wait(generations, timeout)
+            except (IOError, ValueError, requests.RequestException) as e:
+                self._session.logging.debug(
+                    "LongPollNotifier error %s, backing off %s seconds.",
+                    e, backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self._config.client.poll_max)
+                continue
+
+            backoff = self._config.client.poll_min
+            generations.update(changed)
+            if changed and timeout:
+                self._session.logging.debug("LongPollNotifier woke up.")
+                callback(changed)
+
+            timeout = self.timeout
@@ -7,7 +7,9 @@ import tempfile
 import threading
 import time
 
+import mock
 import portpicker
+import requests
 
 from rekall import session as rekall_session
 from rekall import testlib
@@ -15,6 +17,7 @@ from rekall_lib import crypto
 from rekall_lib import serializer
 from rekall_lib.rekall_types import agent
 from rekall_lib.rekall_types import location
+from rekall_agent import cache
 from rekall_agent.locations import http_location
 from rekall_agent.servers import http_server
 global VERBOSITY
@@ -223,6 +226,175 @@ class TestHTTPServer(testlib.RekallBaseUnitTestCase):
 
         self.assertEqual(location_obj.read_file(), "hello world")
 
+    def test_upload_ids(self):
+        location_obj = self.http_location_cls.from_keywords(
+            session=self.session, access=["WRITE", "READ"],
+            path_prefix=self.filename)
+
+        upload_ids = []
+        def upload(_, fd, upload_id=None):
+            upload_ids.append(upload_id)
+            raise IOError("Not uploading")
+
+        with mock.patch.object(http_location.ChunkedUploader, "upload",
+                               upload):
+            for data in ("hello", "world", "hello"):
+                location_obj.upload_file_object(io.BytesIO(data))
+
+        # Different data of the same size is not part of the same upload, but
+        # the same data resumes it.
+        self.assertNotEqual(upload_ids[0], upload_ids[1])
+        self.assertEqual(upload_ids[0], upload_ids[2])
+
+
+class TestChangeNotifier(testlib.RekallBaseUnitTestCase):
+
+    def test_max_waiters(self):
+        notifier = http_server.ChangeNotifier(max_waiters=1)
+        with notifier.watch(["a"]) as event:
+            # The only slot is taken.
+            with notifier.watch(["b"]) as other:
+                self.assertIsNone(other)
+
+            notifier.notify("a")
+            self.assertTrue(event.is_set())
+
+        # Once the first request is done the slot is free again.
+        with notifier.watch(["b"]) as event:
+            self.assertIsNotNone(event)
+
+
+class DroppingHandler(http_server.RekallHTTPServerHandler):
+    """Simulates a slow and unreliable link for chunked uploads.
+
+    Every request is delayed, and the first attempt to upload each chunk in
+    drop_offsets closes the connection without a response. If drop_always is
+    set, every attempt is dropped.
+    """
+    lock = threading.Lock()
+    latency = 0.05
+    drop_always = False
+    drop_offsets = set()
+    dropped = set()
+    chunk_requests = 0
+
+    def authenticate(self, access):
+        return True
+
+    def serve_upload_api(self):
+        time.sleep(self.latency)
+        if self.params["action"] == ["chunk"]:
+            offset = int(self.params["offset"][0])
+            with DroppingHandler.lock:
+                DroppingHandler.chunk_requests += 1
+                drop = (offset in self.drop_offsets and
+                        (self.drop_always or offset not in self.dropped))
+                if drop:
+                    DroppingHandler.dropped.add(offset)
+
+            if drop:
+                self.close_connection = 1
+                return
+
+        super(DroppingHandler, self).serve_upload_api()
+
+
+class TestChunkedUpload(testlib.RekallBaseUnitTestCase):
+    """Test chunked uploads over a lossy, high latency connection."""
+
+    CHUNK_SIZE = 64 * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        cls._session = rekall_session.InteractiveSession(
+            logging_level=10 if VERBOSITY else 0)
+        port = portpicker.PickUnusedPort()
+        cls.tempdir = tempfile.mkdtemp()
+        cls.config = agent.Configuration.from_keywords(
+            session=cls._session,
+            server=http_server.HTTPServerPolicy.from_keywords(
+                session=cls._session,
+                base_url="http://127.0.0.1:%s/" % port,
+                root_directory=cls.tempdir,
+                bind_port=port,
+            )
+        )
+
+        cls._session.SetParameter("agent_config_obj", cls.config)
+
+        cls.httpd = http_server.RekallHTTPServer(
+            ("127.0.0.1", port), DroppingHandler, session=cls._session)
+        cls.httpd_thread = threading.Thread(target=cls.httpd.serve_forever)
+        cls.httpd_thread.daemon = True
+        cls.httpd_thread.start()
+        cls.base_url = "http://%s:%s/" % cls.httpd.server_address
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.httpd.shutdown()
+        shutil.rmtree(cls.tempdir)
+
+    def setUp(self):
+        super(TestChunkedUpload, self).setUp()
+        self.session = self._session
+        self.filename = "%s.bin" % time.time()
+        DroppingHandler.drop_offsets = set()
+        DroppingHandler.dropped = set()
+        DroppingHandler.chunk_requests = 0
+
+    def _make_uploader(self, **kwargs):
+        return http_location.ChunkedUploader(
+            requests.Session(), self.base_url + self.filename,
+            chunk_size=self.CHUNK_SIZE, **kwargs)
+
+    def _make_file(self):
+        return io.BytesIO(os.urandom(self.CHUNK_SIZE * 20 + 1234))
+
+    def _read_uploaded(self):
+        with open(self.httpd_cache.get_local_file(
+                self.filename, self.httpd_cache.get_generation(
+                    self.filename)), "rb") as fd:
+            return fd.read()
+
+    @property
+    def httpd_cache(self):
+        return cache.LocalDiskCache.from_keywords(
+            session=self.session, cache_directory=self.tempdir)
+
+    def test_upload_with_dropped_chunks(self):
+        infd = self._make_file()
+        DroppingHandler.drop_offsets = set(
+            x * self.CHUNK_SIZE for x in (0, 3, 7, 20))
+
+        self._make_uploader(in_flight=8).upload(infd)
+        self.assertEqual(self._read_uploaded(), infd.getvalue())
+
+        # Each dropped chunk was sent again.
+        self.assertEqual(DroppingHandler.chunk_requests, 21 + 4)
+
+    def test_resume_upload(self):
+        infd = self._make_file()
+
+        # Chunks at these offsets never make it so the upload fails.
+        DroppingHandler.drop_offsets = set(
+            x * self.CHUNK_SIZE for x in (5, 6))
+        DroppingHandler.drop_always = True
+
+        try:
+            with self.assertRaises(IOError):
+                self._make_uploader(retries=2).upload(
+                    infd, upload_id="0123456789abcdef")
+        finally:
+            DroppingHandler.drop_always = False
+
+        # The link recovers and we resume the upload.
+        DroppingHandler.chunk_requests = 0
+        self._make_uploader().upload(infd, upload_id="0123456789abcdef")
+        self.assertEqual(self._read_uploaded(), infd.getvalue())
+
+        # Only the missing chunks were sent the second time.
+        self.assertEqual(DroppingHandler.chunk_requests, 2)
+
 
 if __name__ == "__main__":
     testlib.main()
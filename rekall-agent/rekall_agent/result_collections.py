@@ -32,6 +32,7 @@ Currently most collections are SQLite files, but other collection types may
 be possible.
 
 """
+import contextlib
 import re
 import os
 import tempfile
@@ -105,6 +106,19 @@ SQLITE_FACTORY = sqlite3.Connection
 SQLITE_CACHED_STATEMENTS = 20
 SQLITE_PAGE_SIZE = 1024
 
+# Number of rows buffered by bulk_insert() before they are written in a single
+# transaction.
+SQLITE_BULK_INSERT_BATCH = 10000
+
+# Pragmas applied while bulk loading. These trade durability for speed - if the
+# agent crashes during the load the partial collection is discarded anyway.
+# The previous values are restored when the load completes.
+SQLITE_BULK_LOAD_PRAGMAS = [
+    ("synchronous", "OFF"),
+    ("temp_store", "MEMORY"),
+    ("cache_size", "100000"),
+]
+
 
 def _coerce_timestamp(value):
     if isinstance(value, arrow.Arrow):
@@ -113,6 +127,26 @@ def _coerce_timestamp(value):
     return float(value)
 
 
+class BulkInserter(object):
+    """Buffers rows for GenericSQLiteCollection.bulk_insert()."""
+
+    def __init__(self, collection, table, batch_size):
+        self.collection = collection
+        self.table = table
+        self.batch_size = batch_size
+        self.rows = []
+
+    def insert(self, row=None, **kwargs):
+        self.rows.append(row or kwargs)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.collection.insert_many(self.rows, table=self.table)
+            self.rows = []
+
+
 class GenericSQLiteCollection(CollectionSpec):
     """A Collection based on SQLite files."""
 
@@ -277,10 +311,17 @@ class GenericSQLiteCollection(CollectionSpec):
             self._cursor.execute("CREATE TABLE IF NOT EXISTS tbl_%s (%s);" % (
                 table.name, ",".join(column_specs)))
 
-            for index in table.indexes:
-                self._cursor.execute(
-                    "create index if not exists idx_%s on tbl_%s (%s)" % (
-                        index, table.name, index))
+            self._create_indexes(table)
+
+    def _create_indexes(self, table):
+        for index in table.indexes:
+            self._cursor.execute(
+                "create index if not exists idx_%s on tbl_%s (%s)" % (
+                    index, table.name, index))
+
+    def _drop_indexes(self, table):
+        for index in table.indexes:
+            self._cursor.execute("drop index if exists idx_%s" % index)
 
     @classmethod
     def transaction(cls, collection_location, callback, *args, **kwargs):
@@ -373,6 +414,65 @@ class GenericSQLiteCollection(CollectionSpec):
                 self._queries[table.name],
                 [sanitized_row.get(x.name) for x in table.columns])
 
+    def insert_many(self, rows, table=None):
+        """Insert many rows in a single transaction."""
+        table = self._find_table(table)
+        values = []
+        for row in rows:
+            sanitized_row = self.sanitize_row(row, table=table.name)
+            values.append([sanitized_row.get(x.name) for x in table.columns])
+
+        with self._lock:
+            # Commit any pending statements so executemany() runs in its own
+            # transaction.
+            self._conn.commit()
+            try:
+                self._cursor.executemany(self._queries[table.name], values)
+            except Exception:
+                self._conn.rollback()
+                raise
+
+            self._conn.commit()
+
+    @contextlib.contextmanager
+    def bulk_insert(self, table=None, batch_size=SQLITE_BULK_INSERT_BATCH):
+        """Buffer inserted rows and write them in large transactions.
+
+        While the context is active, the table's indexes are dropped and
+        faster (less durable) pragmas are in effect. Indexes are rebuilt once
+        all rows are loaded. The on disk schema is unchanged.
+
+        with collection.bulk_insert() as inserter:
+            for row in rows:
+                inserter.insert(row=row)
+        """
+        table = self._find_table(table)
+        inserter = BulkInserter(self, table.name, batch_size)
+        saved_pragmas = []
+        with self._lock:
+            self._conn.commit()
+            for name, value in SQLITE_BULK_LOAD_PRAGMAS:
+                current = self._cursor.execute("PRAGMA %s" % name).fetchone()
+                saved_pragmas.append((name, current[0]))
+                self._cursor.execute("PRAGMA %s = %s" % (name, value))
+
+            self._drop_indexes(table)
+
+        try:
+            yield inserter
+        finally:
+            with self._lock:
+                try:
+                    # Write the rows still buffered, even if the body raised,
+                    # just like the batches which were already committed.
+                    inserter.flush()
+                finally:
+                    self._create_indexes(table)
+                    self._conn.commit()
+                    for name, value in saved_pragmas:
+                        self._cursor.execute(
+                            "PRAGMA %s = %s" % (name, value))
+
     def replace(self, table=None, condition=None, **kwargs):
         """Replace rows in the table with condition matching.
 
@@ -34,7 +34,7 @@ class TestResultCollection(testlib.RekallBaseUnitTestCase):
     def setUp(self):
         self.session = self.MakeUserSession()
 
-    def _make_collection(self):
+    def _make_collection(self, indexes=()):
         # The path where we want the collection to finally reside.
         final_path = os.path.join(self.temp_directory, "test.sqlite")
 
@@ -48,7 +48,8 @@ class TestResultCollection(testlib.RekallBaseUnitTestCase):
             tables=[dict(name="default",
                          columns=[dict(name="c1", type="int"),
                                   dict(name="c2", type="unicode"),
-                                  dict(name="c3", type="float")])],
+                                  dict(name="c3", type="float")],
+                         indexes=list(indexes))],
         )
 
         return collection, final_path
@@ -77,6 +78,46 @@ class TestResultCollection(testlib.RekallBaseUnitTestCase):
             self.assertEqual([tuple(x) for x in read_collection.query()],
                              [(5, "foobar", 1.1)])
 
+    def testBulkInsert(self):
+        collection, _ = self._make_collection(indexes=["c1"])
+
+        with collection.create_temp_file():
+            with collection.bulk_insert(batch_size=3) as inserter:
+                for i in range(10):
+                    inserter.insert(c1=i, c2="row %s" % i, c3=i * 0.5)
+
+                # Only complete batches are written until the end.
+                self.assertEqual(collection.table_count(), 9)
+
+            self.assertEqual(collection.table_count(), 10)
+            self.assertEqual(
+                [tuple(x) for x in collection.query(c1=7)],
+                [(7, "row 7", 3.5)])
+
+            # The index is rebuilt after loading.
+            indexes = [x["name"] for x in collection.query(
+                "select name from sqlite_master where type='index'")]
+            self.assertEqual(indexes, ["idx_c1"])
+
+    def testBulkInsertRestoresState(self):
+        collection, _ = self._make_collection()
+
+        with collection.create_temp_file():
+            synchronous = collection._cursor.execute(
+                "PRAGMA synchronous").fetchone()[0]
+
+            with self.assertRaises(RuntimeError):
+                with collection.bulk_insert(batch_size=3) as inserter:
+                    for i in range(5):
+                        inserter.insert(c1=i, c2="row %s" % i, c3=i * 0.5)
+
+                    raise RuntimeError("Failed")
+
+            # The buffered rows are written and the pragmas restored.
+            self.assertEqual(collection.table_count(), 5)
+            self.assertEqual(collection._cursor.execute(
+                "PRAGMA synchronous").fetchone()[0], synchronous)
+
 
 if __name__ == "__main__":
     testlib.main()
@@ -32,13 +32,17 @@ __author__ = "Michael Cohen <scudette@google.com>"
 """A standalone http server for users that do not want to use Google cloud."""
 import base64
 import cgi
+import contextlib
+import hashlib
 import json
 import http
 import socket
 import socketserver
 import os
+import re
 import urllib.parse
 import tempfile
+import threading
 import time
 import urllib.request, urllib.parse, urllib.error
 
@@ -56,6 +60,20 @@ from rekall_agent.locations import http_location
 from rekall_lib import utils
 
 
+# The longest time a client may hold a wait request open.
+MAX_WAIT_TIMEOUT = 300
+
+# The most wait requests held open at once. Each one holds a server thread
+# for up to MAX_WAIT_TIMEOUT, so further requests are turned away with 503 and
+# the clients back off.
+MAX_WAITERS = 200
+
+# The largest chunk we accept in a chunked upload.
+MAX_UPLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+
+UPLOAD_ID_REGEX = re.compile("^[0-9a-f]{8,64}$")
+
+
 class HTTPServerPolicy(agent.ServerPolicy):
     """A Stand along HTTP Server."""
     schema = [
@@ -474,6 +492,19 @@ class RekallHTTPServerHandler(http.server.BaseHTTPRequestHandler, object):
             self.end_headers()
             return
 
+        elif params["action"] == ["wait"]:
+            self.wait_for_change(params)
+            return
+
+        elif params["action"] == ["upload_status"]:
+            if not self.authenticate("WRITE"):
+                self.send_error(
+                    403, "You are not authorized to write this location.")
+                return
+
+            self.upload_status()
+            return
+
         elif params["action"] == ["manifest"]:
             # Ensure client has READ access to the manifest file.
             if not self.authenticate("READ"):
@@ -491,6 +522,60 @@ class RekallHTTPServerHandler(http.server.BaseHTTPRequestHandler, object):
         else:
             self.send_error(404, "Unknown API handler.")
 
+    def _changed_generations(self, paths, generations):
+        result = {}
+        for path, generation in zip(paths, generations):
+            current_generation = self._cache.get_generation(
+                utils.join_path(".public", path))
+            if current_generation and current_generation != generation:
+                result[path] = current_generation
+
+        return result
+
+    def wait_for_change(self, params):
+        """Long poll for changes to public files (e.g. job queues).
+
+        The client sends the generations it knows for each path. We reply as
+        soon as any path has a different generation, or with 304 once the
+        timeout expires. Only public files may be waited on, since their
+        generation is visible to anyone anyway.
+        """
+        paths = params.get("path", [])
+        generations = params.get("generation", [])
+        if len(paths) != len(generations):
+            self.send_error(400, "Each path must have a generation.")
+            return
+
+        try:
+            timeout = min(float(params.get("timeout", ["60"])[0]),
+                          MAX_WAIT_TIMEOUT)
+        except ValueError:
+            self.send_error(400, "Invalid timeout.")
+            return
+
+        # Register before checking so changes made in between are not lost.
+        with self.server.change_notifier.watch(
+                utils.join_path(".public", x) for x in paths) as event:
+            if event is None:
+                self.send_error(503, "Too many waiting requests.")
+                return
+
+            changed = self._changed_generations(paths, generations)
+            if not changed and event.wait(timeout):
+                changed = self._changed_generations(paths, generations)
+
+        if not changed:
+            self.send_response(304)
+            self.send_header("Content-Length", 0)
+            self.end_headers()
+            return
+
+        data = json.dumps(changed, sort_keys=True)
+        self.send_response(200)
+        self.send_header("Content-Length", len(data))
+        self.end_headers()
+        self.wfile.write(data)
+
     def serve_static(self, path):
         try:
             generation = self._cache.get_generation(path)
@@ -537,7 +622,9 @@ class RekallHTTPServerHandler(http.server.BaseHTTPRequestHandler, object):
 
         if self.authenticate("WRITE"):
             try:
-                if self.headers.get("Transfer-Encoding") == "chunked":
+                if "action" in self.params:
+                    self.serve_upload_api()
+                elif self.headers.get("Transfer-Encoding") == "chunked":
                     self._chunked_upload_file()
                 else:
                     self._direct_upload_file()
@@ -546,6 +633,143 @@ class RekallHTTPServerHandler(http.server.BaseHTTPRequestHandler, object):
         else:
             self.send_error(403)
 
+    def _get_upload_file(self):
+        """Returns the staging file for a chunked upload, or None.
+
+        The staging file depends on the path too, so an upload can only be
+        committed to the path it was started for.
+        """
+        upload_id = self.params.get("upload_id", [""])[0]
+        if not UPLOAD_ID_REGEX.match(upload_id):
+            return None
+
+        upload_directory = os.path.join(
+            self._config.server.root_directory, ".uploads")
+        try:
+            os.makedirs(upload_directory)
+        except (OSError, IOError):
+            pass
+
+        name = hashlib.sha1(utils.SmartStr(
+            self.base_path + ":" + upload_id)).hexdigest()
+
+        return os.path.join(upload_directory, name)
+
+    def _get_upload_chunks(self, upload_file):
+        """Returns the chunks received so far as {offset: [length, sha1]}."""
+        result = {}
+        try:
+            with open(upload_file + ".chunks") as fd:
+                for line in fd:
+                    offset, length, sha1 = json.loads(line)
+                    result[offset] = [length, sha1]
+        except (IOError, OSError, ValueError):
+            pass
+
+        return result
+
+    def _send_data(self, data):
+        self.send_response(200)
+        self.send_header("Content-Length", len(data))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def upload_status(self):
+        """Report the chunks received so an upload can be resumed."""
+        upload_file = self._get_upload_file()
+        if upload_file is None:
+            self.send_error(400, "Invalid upload id.")
+            return
+
+        self._send_data(json.dumps(self._get_upload_chunks(upload_file)))
+
+    def serve_upload_api(self):
+        """Chunked uploads.
+
+        Clients upload chunks of the file concurrently, each with its own
+        checksum, then commit the upload once all chunks are received. If the
+        upload fails, the client can query which chunks arrived and only
+        resend the others.
+        """
+        upload_file = self._get_upload_file()
+        if upload_file is None:
+            self.send_error(400, "Invalid upload id.")
+            return
+
+        if self.params["action"] == ["chunk"]:
+            self._upload_chunk(upload_file)
+
+        elif self.params["action"] == ["commit"]:
+            self._commit_upload(upload_file)
+
+        else:
+            self.send_error(404, "Unknown API handler.")
+
+    def _upload_chunk(self, upload_file):
+        try:
+            offset = int(self.params["offset"][0])
+            length = int(self.headers["content-length"])
+        except (KeyError, ValueError):
+            self.send_error(400, "Invalid chunk.")
+            return
+
+        if offset < 0 or length > MAX_UPLOAD_CHUNK_SIZE:
+            self.send_error(413, "Chunk too large.")
+            return
+
+        data = self.rfile.read(length)
+        sha1 = hashlib.sha1(data).hexdigest()
+        if (len(data) != length or
+                sha1 != self.headers.get("x-rekall-chunk-sha1")):
+            self.send_error(400, "Chunk checksum mismatch.")
+            return
+
+        fd = os.open(upload_file, os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            os.lseek(fd, offset, 0)
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+
+        # Only record the chunk once it is safely written.
+        with open(upload_file + ".chunks", "a") as fd:
+            fd.write(json.dumps([offset, length, sha1]) + "\n")
+
+        self.send_response(200)
+        self.send_header("Content-Length", 0)
+        self.end_headers()
+
+    def _commit_upload(self, upload_file):
+        try:
+            size = int(self.params["size"][0])
+        except (KeyError, ValueError):
+            self.send_error(400, "Invalid size.")
+            return
+
+        # Make sure we have the entire file.
+        covered = 0
+        for offset, (length, _) in sorted(
+                self._get_upload_chunks(upload_file).items()):
+            if offset > covered:
+                break
+            covered = max(covered, offset + length)
+
+        if covered < size:
+            self.send_error(400, "Missing chunks at offset %d." % covered)
+            return
+
+        with open(upload_file, "ab") as fd:
+            fd.truncate(size)
+
+        try:
+            os.unlink(upload_file + ".chunks")
+        except (IOError, OSError):
+            pass
+
+        self._move_file_into_place(upload_file)
+        self.session.logging.debug("Uploaded %s (%s)", self.base_path, size)
+
     def _get_generation_from_timestamp(self, timestamp):
         return str(int(timestamp * 1e6))
 
@@ -618,6 +842,7 @@ class RekallHTTPServerHandler(http.server.BaseHTTPRequestHandler, object):
 
         self._cache.update_local_file_generation(
             path, generation, local_filename)
+        self.server.change_notifier.notify(path)
 
         self.send_response(200)
         self.send_header("Content-Length", 0)
@@ -659,6 +884,60 @@ class RekallHTTPServerHandler(http.server.BaseHTTPRequestHandler, object):
             self.wfile.write(content)
 
 
+class ChangeNotifier(object):
+    """Wakes up requests waiting for a path to change.
+
+    Each waiting request registers an event under the paths it watches, so an
+    upload only wakes the requests interested in it. At most max_waiters
+    requests may wait at once.
+    """
+
+    def __init__(self, max_waiters=MAX_WAITERS):
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._count = 0
+        self.max_waiters = max_waiters
+
+    def notify(self, path):
+        with self._lock:
+            waiters = self._waiters.pop(utils.join_path(path), ())
+
+        for event in waiters:
+            event.set()
+
+    @contextlib.contextmanager
+    def watch(self, paths):
+        """Yields an event which is set when any of the paths change.
+
+        Yields None if max_waiters requests are already waiting.
+        """
+        event = threading.Event()
+        paths = [utils.join_path(x) for x in paths]
+        with self._lock:
+            if self._count >= self.max_waiters:
+                event = None
+            else:
+                self._count += 1
+                for path in paths:
+                    self._waiters.setdefault(path, set()).add(event)
+
+        if event is None:
+            yield None
+            return
+
+        try:
+            yield event
+        finally:
+            with self._lock:
+                self._count -= 1
+                for path in paths:
+                    waiters = self._waiters.get(path)
+                    if waiters is not None:
+                        waiters.discard(event)
+                        if not waiters:
+                            self._waiters.pop(path)
+
+
 class RekallHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
     """The HTTP frontend server."""
 
@@ -680,6 +959,7 @@ class RekallHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
         elif version == 6:
             self.address_family = socket.AF_INET6
 
+        self.change_notifier = ChangeNotifier()
         http.server.HTTPServer.__init__(
             self, server_address, handler, *args, **kwargs)
 
@@ -0,0 +1,84 @@
+"""Benchmark inserting rows into a GenericSQLiteCollection.
+
+Compares row at a time inserts with the bulk_insert() path. For example:
+
+python collection_benchmark.py --rows 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from rekall import session
+from rekall_agent import result_collections
+from rekall_agent.locations import files
+
+
+parser = argparse.ArgumentParser(description='Collection insert benchmark')
+parser.add_argument('--rows', default=100000, type=int,
+                    help='Number of rows to insert.')
+
+parser.add_argument('--batch_size', type=int,
+                    default=result_collections.SQLITE_BULK_INSERT_BATCH,
+                    help='Rows per transaction for bulk inserts.')
+
+
+def make_collection(rekall_session, path):
+    return result_collections.GenericSQLiteCollection.from_keywords(
+        session=rekall_session,
+        location=files.FileLocation.from_keywords(
+            session=rekall_session, path_prefix=path),
+        tables=[dict(name="default",
+                     columns=[dict(name="filename", type="unicode"),
+                              dict(name="st_size", type="int"),
+                              dict(name="st_mtime", type="epoch")],
+                     indexes=["filename"])],
+    )
+
+
+def generate_rows(count):
+    now = time.time()
+    for i in range(count):
+        yield dict(filename=u"/usr/lib/file%d.so" % i, st_size=i,
+                   st_mtime=now)
+
+
+def benchmark(name, rekall_session, path, insert_rows):
+    collection = make_collection(rekall_session, path)
+    start = time.time()
+    with collection.create_temp_file():
+        count = insert_rows(collection)
+
+    elapsed = time.time() - start
+    print("%-10s %10d rows in %8.2f sec: %10.0f rows/sec" % (
+        name, count, elapsed, count / elapsed))
+
+
+def main():
+    args = parser.parse_args()
+    rekall_session = session.Session()
+    temp_dir = tempfile.mkdtemp()
+
+    def _insert_single(collection):
+        count = 0
+        for row in generate_rows(args.rows):
+            collection.insert(**row)
+            count += 1
+        return count
+
+    def _insert_bulk(collection):
+        count = 0
+        with collection.bulk_insert(batch_size=args.batch_size) as inserter:
+            for row in generate_rows(args.rows):
+                inserter.insert(row=row)
+                count += 1
+        return count
+
+    benchmark("single", rekall_session,
+              os.path.join(temp_dir, "single.sqlite"), _insert_single)
+    benchmark("bulk", rekall_session,
+              os.path.join(temp_dir, "bulk.sqlite"), _insert_bulk)
+
+
+if __name__ == '__main__':
+    main()
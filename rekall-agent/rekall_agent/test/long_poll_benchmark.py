@@ -0,0 +1,198 @@
+"""Measure job dispatch latency and server load for many agents.
+
+Runs an in-process HTTP server and a number of simulated agents which wait
+for their jobs file to change, either by long polling the server (the
+default) or by polling the jobs file at a fixed interval. Jobs are published
+directly into the server's cache at random times and we report how long it
+took for each agent to see them, as well as how many requests the server had
+to handle.
+"""
+import argparse
+import logging
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import requests
+
+from rekall import session
+from rekall_agent import cache
+from rekall_agent.servers import http_server
+from rekall_lib import utils
+from rekall_lib.rekall_types import agent
+
+
+parser = argparse.ArgumentParser(description='Rekall Agent Long Poll Benchmark')
+
+parser.add_argument('--number', default=50, type=int,
+                    help='Total number of simulated agents to run.')
+
+parser.add_argument('--jobs', default=20, type=int,
+                    help='Number of jobs to publish.')
+
+parser.add_argument('--mode', default="wait", choices=["wait", "poll"],
+                    help='Long poll the server or poll at a fixed interval.')
+
+parser.add_argument('--poll_interval', default=5.0, type=float,
+                    help='Poll interval in poll mode.')
+
+parser.add_argument('--timeout', default=30, type=int,
+                    help='How long the server holds wait requests open.')
+
+parser.add_argument('--port', default=8500, type=int,
+                    help='Port to run the server on.')
+
+parser.add_argument('--verbose', action="store_true",
+                    help='Log server requests.')
+
+
+class CountingHandler(http_server.RekallHTTPServerHandler):
+    """Counts the requests the server handles."""
+    lock = threading.Lock()
+    requests = 0
+
+    def handle_one_request(self):
+        with CountingHandler.lock:
+            CountingHandler.requests += 1
+
+        super(CountingHandler, self).handle_one_request()
+
+
+class SimulatedAgent(threading.Thread):
+    def __init__(self, flags, base_url, agent_id, published):
+        super(SimulatedAgent, self).__init__()
+        self.daemon = True
+        self.flags = flags
+        self.base_url = base_url
+        self.path = utils.join_path("agent%s" % agent_id, "jobs")
+        self.published = published
+        self.generation = "0"
+        self.latencies = []
+        self.stop = False
+        self.requests_session = requests.Session()
+
+    def _seen(self, generation):
+        if generation != self.generation:
+            self.generation = generation
+            publish_time = self.published.get(generation)
+            if publish_time:
+                self.latencies.append(time.time() - publish_time)
+
+    def _wait(self):
+        resp = self.requests_session.get(
+            self.base_url, timeout=self.flags.timeout + 30,
+            params=dict(action="wait", timeout=self.flags.timeout,
+                        path=[self.path], generation=[self.generation]))
+        if resp.status_code == 200:
+            self._seen(resp.json()[self.path])
+
+    def _poll(self):
+        resp = self.requests_session.get(
+            self.base_url + self.path,
+            headers={"If-None-Match": self.generation})
+        if resp.status_code == 200:
+            self._seen(resp.headers["ETag"].strip('"'))
+
+        time.sleep(self.flags.poll_interval)
+
+    def run(self):
+        while not self.stop:
+            try:
+                if self.flags.mode == "wait":
+                    self._wait()
+                else:
+                    self._poll()
+            except requests.RequestException:
+                time.sleep(1)
+
+
+def publish(httpd, local_cache, paths, published):
+    """Write a new jobs file for all agents."""
+    generation = str(int(time.time() * 1e6))
+    published[generation] = time.time()
+    for path in paths:
+        public_path = utils.join_path(".public", path)
+        local_cache.store_at_generation(public_path, generation, data="{}")
+        httpd.change_notifier.notify(public_path)
+
+
+def main():
+    flags = parser.parse_args()
+    logging.getLogger().setLevel(10 if flags.verbose else 30)
+
+    root_directory = tempfile.mkdtemp()
+    rekall_session = session.Session()
+    config = agent.Configuration.from_keywords(
+        session=rekall_session,
+        server=http_server.HTTPServerPolicy.from_keywords(
+            session=rekall_session,
+            root_directory=root_directory,
+            bind_port=flags.port,
+            port_max=flags.port + 10))
+    rekall_session.SetParameter("agent_config_obj", config)
+
+    httpd = None
+    for port in range(flags.port, flags.port + 10):
+        try:
+            httpd = http_server.RekallHTTPServer(
+                ("127.0.0.1", port), CountingHandler, session=rekall_session)
+            break
+        except IOError:
+            continue
+
+    server_thread = threading.Thread(target=httpd.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    base_url = "http://127.0.0.1:%s/" % httpd.socket.getsockname()[1]
+    local_cache = cache.LocalDiskCache.from_keywords(
+        session=rekall_session, cache_directory=root_directory)
+
+    published = {}
+    agents = [SimulatedAgent(flags, base_url, i, published)
+              for i in range(flags.number)]
+    publish(httpd, local_cache, [x.path for x in agents], published)
+    for simulated_agent in agents:
+        simulated_agent.start()
+
+    # Let all agents catch up with the initial jobs file.
+    time.sleep(flags.poll_interval + 1)
+    for simulated_agent in agents:
+        simulated_agent.latencies = []
+
+    CountingHandler.requests = 0
+    start = time.time()
+    start_cpu = time.clock()
+
+    for _ in range(flags.jobs):
+        time.sleep(random.uniform(0.5, 2))
+        publish(httpd, local_cache, [x.path for x in agents], published)
+
+    # Give the agents a chance to see the last job.
+    time.sleep(flags.poll_interval + 1)
+    duration = time.time() - start
+    cpu = time.clock() - start_cpu
+
+    for simulated_agent in agents:
+        simulated_agent.stop = True
+
+    latencies = sorted(sum([x.latencies for x in agents], []))
+    if latencies:
+        print("Dispatch latency: mean %.3fs, median %.3fs, max %.3fs "
+              "(%d deliveries)" % (
+                  sum(latencies) / len(latencies),
+                  latencies[len(latencies) // 2],
+                  latencies[-1], len(latencies)))
+
+    print("Server handled %d requests in %.1fs (%.1f requests/s), "
+          "%.1fs CPU" % (CountingHandler.requests, duration,
+                         CountingHandler.requests / duration, cpu))
+
+    httpd.shutdown()
+    shutil.rmtree(root_directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Synthetic load generator for server side flow ticket processing.
+
+Generates FlowStatus tickets for many clients and flows at a fixed rate and
+feeds them through FlowStatus.end() in batches, just like the batch processor
+does, reporting the sustained ticket throughput. Collections are stored on
+the local filesystem. For example:
+
+python ticket_load.py --rate 5000 --seconds 10 --clients 1000
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from rekall import session
+from rekall_agent import flow
+from rekall_agent.locations import files
+
+
+parser = argparse.ArgumentParser(description='Flow ticket load generator')
+parser.add_argument('--rate', default=2000, type=int,
+                    help='Tickets generated per second.')
+
+parser.add_argument('--seconds', default=10, type=int,
+                    help='How long to generate tickets for.')
+
+parser.add_argument('--clients', default=500, type=int,
+                    help='Number of distinct clients.')
+
+parser.add_argument('--flows', default=5, type=int,
+                    help='Number of flows per client.')
+
+parser.add_argument('--unbatched', action="store_true",
+                    help='Process each ticket on its own for comparison.')
+
+
+class LoadServerPolicy(object):
+    """Stores all server side files under a local directory."""
+
+    def __init__(self, rekall_session, root):
+        self._session = rekall_session
+        self.root = root
+
+    def _location(self, *components):
+        return files.FileLocation.from_keywords(
+            session=self._session,
+            path_prefix=os.path.join(self.root, *components))
+
+    def flows_for_server(self, flow_id):
+        return self._location("flows", flow_id)
+
+    def flow_db_for_server(self, client_id=None, queue=None):
+        return self._location(client_id or queue, "flows.sqlite")
+
+    def hunt_db_for_server(self, hunt_id):
+        return self._location("hunts", hunt_id, "stats.sqlite")
+
+
+class LoadConfig(object):
+    def __init__(self, server):
+        self.server = server
+
+
+def make_flows(rekall_session, config, args):
+    """Write the flow objects the tickets refer to."""
+    flows = []
+    for client in range(args.clients):
+        client_id = "C.%016x" % client
+        for i in range(args.flows):
+            flow_obj = flow.Flow.from_keywords(
+                session=rekall_session,
+                client_id=client_id,
+                flow_id="F_%08x%02x" % (client, i),
+                created_time=time.time())
+            config.server.flows_for_server(flow_obj.flow_id).write_file(
+                flow_obj.to_json())
+            flows.append(flow_obj)
+
+    return flows
+
+
+def generate_tickets(rekall_session, flows, count):
+    for _ in range(count):
+        flow_obj = random.choice(flows)
+        yield flow.FlowStatus.from_keywords(
+            session=rekall_session,
+            client_id=flow_obj.client_id,
+            flow_id=flow_obj.flow_id,
+            timestamp=time.time(),
+            status=random.choice(["Started", "Started", "Done"]))
+
+
+def main():
+    args = parser.parse_args()
+    rekall_session = session.Session()
+    temp_dir = tempfile.mkdtemp()
+    try:
+        config = LoadConfig(LoadServerPolicy(rekall_session, temp_dir))
+        rekall_session.SetParameter("agent_config_obj", config)
+        flows = make_flows(rekall_session, config, args)
+
+        total = 0
+        busy = 0
+        for _ in range(args.seconds):
+            tick = time.time()
+            tickets = list(generate_tickets(rekall_session, flows, args.rate))
+
+            # Group by client id like FlowStatus.process() does.
+            contexts = []
+            if args.unbatched:
+                contexts = [{t.client_id: [t]} for t in tickets]
+            else:
+                context = {}
+                for ticket in tickets:
+                    context.setdefault(ticket.client_id, []).append(ticket)
+                contexts.append(context)
+
+            start = time.time()
+            for context in contexts:
+                flow.FlowStatus.end(context, session=rekall_session)
+
+            busy += time.time() - start
+            total += len(tickets)
+
+            # Keep to the requested rate if we are faster than it.
+            remaining = 1 - (time.time() - tick)
+            if remaining > 0:
+                time.sleep(remaining)
+
+        print("Processed %d tickets in %.2f sec of work: %.0f tickets/sec" % (
+            total, busy, total / busy))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
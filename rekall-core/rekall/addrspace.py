@@ -340,6 +340,25 @@ class BaseAddressSpace(with_metaclass(registry.MetaclassRegistry, object)):
         """Tell us if the address is valid """
         return True
 
+    def is_region_empty(self, start, end, chunk_size=1024 * 1024):
+        """Returns True if the range start-end holds no non-zero data.
+
+        Unmapped parts of the range are skipped entirely using the mapping
+        runs, and the mapped parts are read in large chunks. This means the
+        cost is proportional to the amount of resident data.
+        """
+        for run in self.get_address_ranges(start=start, end=end):
+            offset = max(run.start, start)
+            run_end = min(run.end, end)
+            while offset < run_end:
+                length = min(chunk_size, run_end - offset)
+                if self.read(offset, length).strip(b"\x00"):
+                    return False
+
+                offset += length
+
+        return True
+
     def write(self, addr, buf):
         """Write to the address space, if writable.
 
@@ -139,6 +139,23 @@ class RunBasedTest(testlib.RekallBaseUnitTestCase):
         self.assertEqual(run.start, 1020)
         self.assertEqual(run.end, 1030)
 
+    def testRegionEmpty(self):
+        test_as = CustomRunsAddressSpace(
+            session=self.session,
+            #      Voff, Poff, length
+            runs=[(1000, 0, 10),    # Zero filled.
+                  (2000, 10, 10)],  # This contains data.
+            data=b"\x00" * 10 + b"0123456789")
+
+        # Unmapped and zero filled ranges are empty.
+        self.assertTrue(test_as.is_region_empty(0, 1000))
+        self.assertTrue(test_as.is_region_empty(0, 2000))
+        self.assertTrue(test_as.is_region_empty(2020, 3000))
+
+        self.assertFalse(test_as.is_region_empty(0, 3000))
+        self.assertFalse(test_as.is_region_empty(2009, 2010))
+        self.assertFalse(test_as.is_region_empty(1000, 2010, chunk_size=3))
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
@@ -1768,7 +1768,8 @@ class Profile(with_metaclass(registry.MetaclassRegistry, object)):
         # A map from symbol names to the types at that symbol. Key: Symbol name,
         # Value: (target, target_args).
         self.constant_types = {}
-        self.constant_addresses = utils.SortedCollection(key=lambda x: x[0])
+        # A frozen sorted table of address -> constant name(s).
+        self.constant_addresses = utils.AddressTable()
         self.enums = {}
         self.reverse_enums = {}
         self.applied_modifications = set()
@@ -1889,26 +1890,50 @@ class Profile(with_metaclass(registry.MetaclassRegistry, object)):
 
     def add_constants(self, constants=None, constants_are_addresses=False, **_):
         """Add the kwargs as constants for this profile."""
+        if constants_are_addresses:
+            return self.add_constant_table(
+                list(constants.keys()), list(constants.values()))
+
         self.flush_cache()
 
         for k, v in six.iteritems(constants):
             k = utils.intern_str(k)
             self.constants[k] = v
-            if constants_are_addresses:
-                try:
-                    # We need to interpret the value as a pointer.
-                    address = Pointer.integer_to_address(v)
-                    existing_value = self.constant_addresses.get(address)
-                    if existing_value is None:
-                        self.constant_addresses[address] = k
-                    elif isinstance(existing_value, list):
-                        if k not in existing_value:
-                            existing_value.append(k)
-                    elif existing_value != k:
-                        self.constant_addresses[address] = [
-                            existing_value, k]
-                except ValueError:
-                    pass
+
+    def add_constant_table(self, names, addresses):
+        """Add constants which are addresses from parallel lists.
+
+        This is the bulk loading path for large symbol tables (profile
+        $CONSTANTS, kallsyms, System.map). The reverse address index is built
+        in a local dict and merged into constant_addresses in a single update
+        rather than one sorted insert per symbol.
+        """
+        self.flush_cache()
+
+        reverse = {}
+        for k, v in zip(names, addresses):
+            k = utils.intern_str(k)
+            self.constants[k] = v
+            try:
+                # We need to interpret the value as a pointer.
+                address = Pointer.integer_to_address(v)
+            except ValueError:
+                continue
+
+            existing_value = reverse.get(address)
+            if existing_value is None:
+                existing_value = self.constant_addresses.get(address)
+
+            if existing_value is None:
+                reverse[address] = k
+            elif isinstance(existing_value, list):
+                if k not in existing_value:
+                    existing_value.append(k)
+                reverse[address] = existing_value
+            elif existing_value != k:
+                reverse[address] = [existing_value, k]
+
+        self.constant_addresses.update(reverse)
 
     def add_reverse_enums(self, **kwargs):
         """Add the kwargs as a reverse enum for this profile."""
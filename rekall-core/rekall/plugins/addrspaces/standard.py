@@ -30,6 +30,7 @@ from builtins import object
 import io
 import struct
 import os
+import threading
 import weakref
 
 from rekall import addrspace
@@ -49,11 +50,15 @@ class FDAddressSpace(addrspace.BaseAddressSpace):
     # We should be first.
     order = 0
 
+    # Reads are serialized so this can be read from multiple threads.
+    __thread_safe = True
+
     def __init__(self, base=None, fhandle=None, **kwargs):
         self.as_assert(base == None, "Base passed to FDAddressSpace.")
         self.as_assert(fhandle is not None, 'file handle must be provided')
 
         self.fhandle = fhandle
+        self._lock = threading.Lock()
         try:
             self.fhandle.seek(0, 2)
             self.fsize = self.fhandle.tell()
@@ -73,8 +78,9 @@ class FDAddressSpace(addrspace.BaseAddressSpace):
         length = int(length)
         addr = int(addr)
         try:
-            self.fhandle.seek(addr)
-            data = self.fhandle.read(length)
+            with self._lock:
+                self.fhandle.seek(addr)
+                data = self.fhandle.read(length)
 
             return data + addrspace.ZEROER.GetZeros(length - len(data))
         except IOError:
@@ -124,6 +130,8 @@ class FileAddressSpace(FDAddressSpace):
     # This address space handles images.
     __image = True
 
+    __thread_safe = True
+
     def __init__(self, base=None, filename=None, session=None, **kwargs):
         self.as_assert(base == None, 'Must be first Address Space')
 
@@ -60,6 +60,113 @@ class Module(object):
         return u"%s: %s" % (self.__class__.__name__, self.name)
 
 
+class CachedSymbolTable(object):
+    """A merged symbol table of all resolved modules.
+
+    Each time a module is consulted for symbols we record its range and all
+    its symbols, shifted by the module's base address, into this table. The
+    table is kept as simple primitives so it can be stored in the session
+    cache (which is persisted per image fingerprint), and is lazily loaded as
+    a single sorted table. Later sessions on the same image can then format
+    addresses without enumerating modules or loading their profiles.
+    """
+
+    def __init__(self, data=None):
+        # modules: A list of [start, end, name].
+        # symbols: A dict of str(module start) -> list of [address, names].
+        # typed: A dict of str(module start) -> symbol names which have a
+        #   type in the profile (these need the profile to be formatted).
+        self.data = data or dict(modules=[], symbols={}, typed={})
+        self._ranges = None
+        self._table = None
+        self._typed = None
+
+    def _freeze(self):
+        if self._ranges is not None:
+            return
+
+        self._ranges = utils.RangedCollection()
+        self._typed = {}
+        table = {}
+        for start, end, name in self.data["modules"]:
+            key = str(start)
+            self._ranges.insert(start, end, name)
+            self._typed[start] = set(self.data["typed"].get(key, []))
+            for address, names in self.data["symbols"].get(key, []):
+                table[address] = names
+
+        self._table = utils.AddressTable(table)
+
+    def __contains__(self, module):
+        return str(module.start) in self.data["symbols"]
+
+    def add_module(self, module):
+        """Record all the symbols of the module."""
+        key = str(module.start)
+        symbols = []
+        typed = []
+        profile = module.profile
+        if profile != None:
+            # Profiles load their constants lazily.
+            profile.EnsureInitialized()
+
+            base = 0
+            if hasattr(profile, "GetImageBase"):
+                base = profile.GetImageBase()
+
+            for offset, names in profile.constant_addresses.items():
+                if not isinstance(names, list):
+                    names = [names]
+
+                symbols.append([offset + base, names])
+                typed.extend(x for x in names if x in profile.constant_types)
+
+        self.data["modules"].append([module.start, module.end, module.name])
+        self.data["symbols"][key] = symbols
+        self.data["typed"][key] = typed
+        self._ranges = self._table = self._typed = None
+
+    def get_nearest_constant_by_address(self, address, max_distance):
+        """Resolve the address from the table.
+
+        Returns None if the address can not be resolved from the table alone
+        (i.e. the module was never recorded or the symbol needs type
+        information from the profile).
+        """
+        self._freeze()
+        start, _, name = self._ranges.get_containing_range(address)
+        if name is None:
+            return
+
+        offset, symbols = self._table.get_value_smaller_than(address)
+        if offset is None or offset < start:
+            symbols = []
+
+        # Symbols not found at all, use module name.
+        if not symbols:
+            if address - start > max_distance:
+                return (-1, [])
+
+            if address == start:
+                return (start, [name])
+
+            return (start, ["%s+%#x" % (name, address - start)])
+
+        if address - offset > max_distance:
+            return (-1, [])
+
+        # Exact symbols found.
+        if offset == address:
+            return (offset, ["%s!%s" % (name, x) for x in symbols])
+
+        # The profile is needed to format the address within a type.
+        if self._typed[start].intersection(symbols):
+            return
+
+        return (offset, ["%s!%s+%#x" % (name, x, address - offset)
+                         for x in symbols])
+
+
 class AddressResolverMixin(object):
 
     """The basic building block for constructing an address resolver plugin.
@@ -137,8 +244,41 @@ class AddressResolverMixin(object):
         # A lookup between module names and the Module object itself.
         self._modules_by_name = {}
 
+        # The merged symbol table (see CachedSymbolTable).
+        self._symbol_table = None
+
         self._initialized = False
 
+    def _symbol_table_cache_key(self):
+        process_context = self.session.GetParameter("process_context")
+        return "address_resolver_symbols_%s" % (
+            process_context.obj_offset or "Kernel")
+
+    @utils.safe_property
+    def symbol_table(self):
+        """The merged symbol table, lazily loaded from the session cache."""
+        if self._symbol_table is None:
+            self._symbol_table = CachedSymbolTable(
+                self.session.cache.Get(self._symbol_table_cache_key()))
+
+        return self._symbol_table
+
+    def _record_module_symbols(self, module):
+        # A module whose profile could not be loaded has no symbols yet, but
+        # a later session might load its profile so it is not recorded.
+        if module.profile == None or module in self.symbol_table:
+            return
+
+        self.symbol_table.add_module(module)
+        self.session.SetCache(self._symbol_table_cache_key(),
+                              self.symbol_table.data)
+
+    def InvalidateSymbolTable(self):
+        """Drop the merged symbol table (e.g. when module profiles change)."""
+        self._symbol_table = CachedSymbolTable()
+        self.session.SetCache(self._symbol_table_cache_key(),
+                              self._symbol_table.data)
+
     def NormalizeModuleName(self, module_name):
         if module_name is not None:
             module_name = utils.SmartUnicode(module_name)
@@ -312,8 +452,6 @@ class AddressResolverMixin(object):
         address is not in a containing module if the nearest known symbol is
         farther than max_distance away.
         """
-        self._EnsureInitialized()
-
         _, symbols = self.get_nearest_constant_by_address(
             address, max_distance=max_distance)
 
@@ -324,14 +462,60 @@ class AddressResolverMixin(object):
 
         Returns a tuple (nearest_offset, list of symbol names).
         """
+        address = obj.Pointer.integer_to_address(address)
+
+        # Try to resolve from the merged table first - this does not need the
+        # modules to be enumerated or their profiles to be loaded.
+        result = self.symbol_table.get_nearest_constant_by_address(
+            address, max_distance)
+        if result is not None:
+            return result
+
         self._EnsureInitialized()
+        module = self.GetContainingModule(address)
 
-        address = obj.Pointer.integer_to_address(address)
+        return self._get_nearest_constant_in_module(
+            module, address, max_distance=max_distance)
+
+    def resolve_many(self, addresses, max_distance=0x1000000):
+        """Format a batch of addresses as symbol names.
+
+        This is equivalent to calling format_address() on each address but is
+        much faster for plugins which format a whole column (e.g. a syscall
+        table): Duplicate addresses are only resolved once, and addresses are
+        visited in sorted order so the containing module is only searched for
+        when leaving the previous module.
+
+        Returns a list of symbol name lists, one for each address.
+        """
+        addresses = [obj.Pointer.integer_to_address(x) for x in addresses]
+        resolved = {}
+        module = None
+        for address in sorted(set(addresses)):
+            result = self.symbol_table.get_nearest_constant_by_address(
+                address, max_distance)
+            if result is not None:
+                resolved[address] = sorted(result[1])
+                continue
+
+            self._EnsureInitialized()
+            if module is None or not module.start <= address < module.end:
+                module = self.GetContainingModule(address)
+
+            _, symbols = self._get_nearest_constant_in_module(
+                module, address, max_distance=max_distance)
+            resolved[address] = sorted(symbols)
+
+        return [resolved[x] for x in addresses]
+
+    def _get_nearest_constant_in_module(self, module, address,
+                                        max_distance=0x1000000):
         symbols = []
-        module = self.GetContainingModule(address)
         if not module or not module.name:
             return (-1, [])
 
+        self._record_module_symbols(module)
+
         if module.profile != None:
             offset, symbols = module.profile.get_nearest_constant_by_address(
                 address)
@@ -0,0 +1,111 @@
+"""Tests for the merged symbol table of the address resolver."""
+import json
+
+from rekall import obj
+from rekall import testlib
+from rekall.plugins.common import address_resolver
+
+
+class LazyTestProfile(obj.Profile):
+    """A profile which only has its constants once it is initialized."""
+
+    @classmethod
+    def Initialize(cls, profile):
+        super(LazyTestProfile, cls).Initialize(profile)
+        profile.add_constants(constants_are_addresses=True, constants=dict(
+            first=0x1000, second=0x1100))
+
+    def GetImageBase(self):
+        # Like the PE profiles, so looking this up does not initialize us.
+        return 0
+
+
+class TestResolver(address_resolver.AddressResolverMixin):
+    """A resolver over a fixed list of modules."""
+
+    def __init__(self, session, modules):
+        self.session = session
+        self.fixed_modules = modules
+        super(TestResolver, self).__init__()
+
+    def _EnsureInitialized(self):
+        if not self._initialized:
+            for module in self.fixed_modules:
+                self.AddModule(module)
+
+            self._initialized = True
+
+
+class TestCachedSymbolTable(testlib.RekallBaseUnitTestCase):
+
+    def _modules(self):
+        return [
+            address_resolver.Module(
+                name="lazy", start=0x1000, end=0x2000,
+                profile=LazyTestProfile(name="lazy", session=self.session)),
+            address_resolver.Module(
+                name="noprofile", start=0x3000, end=0x4000,
+                profile=obj.NoneObject()),
+        ]
+
+    def testAddModule(self):
+        table = address_resolver.CachedSymbolTable()
+        lazy, _ = self._modules()
+        table.add_module(lazy)
+        self.assertTrue(lazy in table)
+
+        # The profile was initialized to read its symbols.
+        self.assertEqual(
+            table.get_nearest_constant_by_address(0x1000, 0x1000),
+            (0x1000, ["lazy!first"]))
+        self.assertEqual(
+            table.get_nearest_constant_by_address(0x1104, 0x1000),
+            (0x1100, ["lazy!second+0x4"]))
+
+        # The table survives being stored as JSON in the session cache.
+        table = address_resolver.CachedSymbolTable(
+            json.loads(json.dumps(table.data)))
+        self.assertEqual(
+            table.get_nearest_constant_by_address(0x1104, 0x1000),
+            (0x1100, ["lazy!second+0x4"]))
+
+        # Addresses outside the recorded modules can not be answered.
+        self.assertEqual(
+            table.get_nearest_constant_by_address(0xfff, 0x1000), None)
+
+    def testBelowModuleStart(self):
+        table = address_resolver.CachedSymbolTable()
+        for start, name in ((0x1000, "a"), (0x2000, "b")):
+            profile = obj.Profile(name=name, session=self.session)
+            profile.add_constants(constants_are_addresses=True, constants={
+                "%s_func" % name: start + 0x100})
+            table.add_module(address_resolver.Module(
+                name=name, start=start, end=start + 0x1000, profile=profile))
+
+        # The nearest symbol belongs to module a, so we use b's name.
+        self.assertEqual(
+            table.get_nearest_constant_by_address(0x2010, 0x1000),
+            (0x2000, ["b+0x10"]))
+
+    def testResolveMany(self):
+        resolver = TestResolver(self.session, self._modules())
+        addresses = [0x1100, 0x1008, 0x1100, 0x3010, 0x500]
+        expected = [["lazy!second"], ["lazy!first+0x8"], ["lazy!second"],
+                    ["noprofile+0x10"], []]
+
+        self.assertEqual(resolver.resolve_many(addresses), expected)
+        self.assertEqual([resolver.format_address(x) for x in addresses],
+                         expected)
+
+        # Only the module with a profile was recorded, so the other is still
+        # resolved through its module.
+        table = resolver.symbol_table
+        self.assertEqual([x[2] for x in table.data["modules"]], ["lazy"])
+
+        # A new resolver answers from the cached table.
+        resolver = TestResolver(self.session, self._modules())
+        self.assertEqual(resolver.resolve_many(addresses), expected)
+
+
+if __name__ == "__main__":
+    testlib.main()
@@ -36,6 +36,7 @@ __author__ = (
     "Jordi Sanchez <nop@google.com>"
 )
 import binascii
+import collections
 import hashlib
 from rekall import obj
 from rekall_lib import utils
@@ -58,88 +59,209 @@ class Index(obj.Profile):
     PERFECT_MATCH = 1.0
     GOOD_MATCH = 0.75
 
+    # The compiled index (see _CompileIndex()).
+    _compiled_index = None
+
+    # The comparison points of each profile (see _ProfileSignatures()).
+    _signatures = None
+
+    # How often each profile was matched by IncrementalLookup().
+    hit_counts = None
+
     def LoadIndex(self, index):
         self.index = index
+        self._compiled_index = None
+        self._signatures = None
+        self.hit_counts = collections.Counter()
 
     def copy(self):
         result = super(Index, self).copy()
         result.index = self.index.copy()
+        result._compiled_index = self._compiled_index
+        result._signatures = self._signatures
+        result.hit_counts = self.hit_counts
 
         return result
 
-    def _TestSymbols(self, address_space, offset, possible_values):
-        """Match any of the possible_values at offset.
+    def _CompileIndex(self):
+        """Compile the index into a reverse lookup table.
 
-        Return True if there is a match.
+        The index maps each profile to a list of (offset, possible_values)
+        comparison points. Many profiles share the same offsets so we invert
+        the index into:
+
+        offset -> (read length, {expected bytes: [profiles]}, [profiles])
+
+        where the last list contains all profiles with a comparison point at
+        this offset. Each distinct offset can then be read only once.
         """
-        for value in possible_values:
-            value = binascii.unhexlify(value)
-            data = address_space.read(offset, len(value))
-            if value == data:
-                return data
+        if self._compiled_index is not None:
+            return self._compiled_index
 
-    def _TestProfile(self, address_space, image_base, profile, symbols,
-                     minimal_match=1):
-        """Match _all_ the symbols against this data."""
-        count_matched = 0
-        count_unmatched = 0
+        compiled = {}
+        for profile, symbols in six.iteritems(self.index):
+            for offset, possible_values in symbols:
+                # The possible_values can be a single string which means there
+                # is only one option. If it is a list, then any of the symbols
+                # may match at this offset to be considered a match.
+                if isinstance(possible_values, basestring):
+                    possible_values = [possible_values]
 
-        for offset, possible_values in symbols:
-            # The possible_values can be a single string which means there is
-            # only one option. If it is a list, then any of the symbols may
-            # match at this offset to be considered a match.
-            if isinstance(possible_values, basestring):
-                possible_values = [possible_values]
+                length, values, profiles = compiled.setdefault(
+                    offset, [0, {}, []])
 
-            # If the offset is not mapped in we can not compare it. Skip it.
-            offset_to_check = image_base + offset
-            if address_space.vtop(offset_to_check) == None:
-                continue
+                # A profile may list the same offset more than once. It must
+                # only be tested once there, otherwise its match ratio is
+                # skewed. Any of the listed values is then a match.
+                if not profiles or profiles[-1] != profile:
+                    profiles.append(profile)
 
-            match = self._TestSymbols(
-                address_space=address_space,
-                offset=offset_to_check,
-                possible_values=possible_values)
+                for value in possible_values:
+                    value = binascii.unhexlify(value)
+                    value_profiles = values.setdefault(value, [])
+                    if not value_profiles or value_profiles[-1] != profile:
+                        value_profiles.append(profile)
 
-            if match:
-                self.session.report_progress(
-                    "%s matched offset %#x+%#x=%#x (%s)",
-                    profile, offset, image_base, offset+image_base,
-                    utils.encode_string (match))
+                    length = max(length, len(value))
 
-                count_matched += 1
+                compiled[offset][0] = length
 
-            else:
-                # FIXME: We get here if the comparison point does not match -
-                # does it make sense to allow some points to not match? Should
-                # we consider these a failure to match?
-                count_unmatched += 1
+        self._compiled_index = compiled
+        return compiled
+
+    def _ProfileSignatures(self):
+        """Decode the index into profile -> [(offset, [expected bytes])]."""
+        if self._signatures is not None:
+            return self._signatures
+
+        signatures = {}
+        for profile, symbols in six.iteritems(self.index):
+            # Duplicate offsets are merged, just like in _CompileIndex().
+            points = {}
+            for offset, possible_values in symbols:
+                if isinstance(possible_values, basestring):
+                    possible_values = [possible_values]
+
+                values = points.setdefault(offset, [])
+                for value in possible_values:
+                    value = binascii.unhexlify(value)
+                    if value not in values:
+                        values.append(value)
+
+            signatures[profile] = sorted(points.items())
+
+        self._signatures = signatures
+        return signatures
+
+    def IncrementalLookup(self, image_base, threshold, address_space=None,
+                          minimal_match=1):
+        """Find profiles which match the image at least as well as threshold.
+
+        Unlike LookupIndex() we do not score all the profiles up front.
+        Profiles are tested one at a time, starting with those which matched
+        most often before, and a profile is abandoned as soon as it can no
+        longer reach the threshold. Each offset is read at most once, so the
+        caller can stop as soon as it finds a suitable profile.
+
+        Yields:
+          tuples of (profile, match ratio).
+        """
+        if address_space == None:
+            address_space = self.session.GetParameter("default_address_space")
 
-        # Require at least this many comparison points to be matched.
-        if count_matched < minimal_match:
-            return 0
+        reads = {}
 
-        if count_matched > 0:
-            self.session.report_progress(
-                "%s matches %d/%d comparison points",
-                profile, count_matched, count_matched + count_unmatched)
+        def _read(offset, length):
+            try:
+                return reads[offset]
+            except KeyError:
+                offset_to_check = image_base + offset
+                data = None
+                if address_space.vtop(offset_to_check) != None:
+                    data = address_space.read(offset_to_check, length)
 
-            return float(count_matched) / (count_matched + count_unmatched)
+                reads[offset] = data
+                return data
 
-        return 0
+        compiled = self._CompileIndex()
+        signatures = self._ProfileSignatures()
+        for profile in sorted(signatures,
+                              key=lambda x: (-self.hit_counts[x], x)):
+            points = signatures[profile]
+            matched = tested = 0
+            for i, (offset, values) in enumerate(points):
+                data = _read(offset, compiled[offset][0])
+                if data is None:
+                    continue
+
+                tested += 1
+                for value in values:
+                    if data[:len(value)] == value:
+                        matched += 1
+                        break
+
+                # The best this profile can do is to match all remaining
+                # points.
+                remaining = len(points) - i - 1
+                if matched + remaining < (tested + remaining) * threshold:
+                    break
+
+            else:
+                if matched < minimal_match or matched == 0:
+                    continue
+
+                match = float(matched) / tested
+                if match >= threshold:
+                    self.hit_counts[profile] += 1
+                    yield profile, match
 
     def IndexHits(self, image_base, address_space=None, minimal_match=1):
+        """Score all the profiles in the index against the image.
+
+        Rather than testing each profile in turn, each distinct offset in the
+        compiled index is read once and all profiles expecting the data found
+        there are credited with a match.
+
+        Yields:
+          tuples of (match ratio, profile) for all profiles in the index.
+        """
         if address_space == None:
             address_space = self.session.GetParameter("default_address_space")
-        for profile, symbols in six.iteritems(self.index):
-            match = self._TestProfile(
-                address_space=address_space,
-                image_base=image_base,
-                profile=profile,
-                minimal_match=minimal_match,
-                symbols=symbols)
-
-            yield match, profile
+
+        count_matched = dict((profile, 0) for profile in self.index)
+        count_tested = count_matched.copy()
+
+        for offset, (length, values, profiles) in six.iteritems(
+                self._CompileIndex()):
+            # If the offset is not mapped in we can not compare it. Skip it.
+            offset_to_check = image_base + offset
+            if address_space.vtop(offset_to_check) == None:
+                continue
+
+            for profile in profiles:
+                count_tested[profile] += 1
+
+            data = address_space.read(offset_to_check, length)
+            matched = set()
+            for value, value_profiles in six.iteritems(values):
+                if data[:len(value)] == value:
+                    matched.update(value_profiles)
+
+            if matched:
+                self.session.report_progress(
+                    "%d profiles matched offset %#x+%#x=%#x",
+                    len(matched), offset, image_base, offset_to_check)
+
+            for profile in matched:
+                count_matched[profile] += 1
+
+        for profile, matched in six.iteritems(count_matched):
+            # Require at least this many comparison points to be matched.
+            if matched < minimal_match or matched == 0:
+                yield 0, profile
+                continue
+
+            yield float(matched) / count_tested[profile], profile
 
     def LookupIndex(self, image_base, address_space=None, minimal_match=1):
         partial_matches = []
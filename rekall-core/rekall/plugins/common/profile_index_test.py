@@ -161,6 +161,84 @@ class SymbolOffsetIndexTest(testlib.RekallBaseUnitTestCase):
                              ["P1", "P3"])
 
 
+class FakeAddressSpace(object):
+    """An identity mapped address space over a string."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def vtop(self, address):
+        if address < len(self.data):
+            return address
+
+    def read(self, address, length):
+        return self.data[address:address + length]
+
+
+class IndexTest(testlib.RekallBaseUnitTestCase):
+    def setUp(self):
+        self.index = profile_index.Index.LoadProfileFromData({
+            "$METADATA": {
+                "ProfileClass": "Index",
+                "Type": "Index",
+            },
+            "$INDEX": {
+                "P1": [[0, "4142"], [4, "43"]],
+                "P2": [[0, "4142"], [4, ["44", "45"]]],
+                # This offset is not mapped.
+                "P3": [[8, "46"]],
+            }
+        }, session=session.Session())
+
+    def testIndexHits(self):
+        hits = dict((profile, match) for match, profile in self.index.IndexHits(
+            0, address_space=FakeAddressSpace(b"AB\x00\x00E")))
+
+        self.assertEqual(hits, dict(P1=0.5, P2=1.0, P3=0))
+
+    def testDuplicateOffsets(self):
+        index = profile_index.Index.LoadProfileFromData({
+            "$METADATA": {
+                "ProfileClass": "Index",
+                "Type": "Index",
+            },
+            "$INDEX": {
+                # The duplicated offset must only count once.
+                "P1": [[0, "4142"], [0, "4142"], [4, "46"]],
+            }
+        }, session=session.Session())
+
+        address_space = FakeAddressSpace(b"AB\x00\x00E")
+        self.assertEqual(list(index.IndexHits(0, address_space=address_space)),
+                         [(0.5, "P1")])
+
+        self.assertEqual(
+            list(index.IncrementalLookup(0, 0.5, address_space=address_space)),
+            [("P1", 0.5)])
+
+    def testLookupIndex(self):
+        self.assertEqual(
+            list(self.index.LookupIndex(
+                0, address_space=FakeAddressSpace(b"AB\x00\x00E"))),
+            [("P2", 1.0), ("P1", 0.5)])
+
+    def testIncrementalLookup(self):
+        address_space = FakeAddressSpace(b"AB\x00\x00E")
+        self.assertEqual(
+            list(self.index.IncrementalLookup(
+                0, 1.0, address_space=address_space)),
+            [("P2", 1.0)])
+
+        # P2 matched before so it is tried first.
+        self.assertEqual(
+            list(self.index.IncrementalLookup(
+                0, 0.5, address_space=address_space)),
+            [("P2", 1.0), ("P1", 0.5)])
+
+        self.assertEqual(self.index.hit_counts["P2"], 2)
+        self.assertEqual(self.index.hit_counts["P1"], 1)
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     unittest.main()
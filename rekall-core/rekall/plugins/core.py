@@ -334,6 +334,11 @@ class LoadAddressSpace(plugin.Command):
             DTB. For example: amd64@0x18700
 
         pid@pid_number: Use the process address space for the specified pid.
+
+        name: An address space class with this name, stacked on the kernel
+            address space. For example: compressor (on Darwin, which maps
+            each compressed page at a synthetic address derived from its
+            segment and slot, not at its virtual address).
         """
         if name is None:
             result = self.session.GetParameter("default_address_space")
@@ -369,6 +374,13 @@ class LoadAddressSpace(plugin.Command):
                 return as_cls(session=self.session, dtb=arg,
                               base=self.GetPhysicalAddressSpace())
 
+        for as_cls in addrspace.BaseAddressSpace.classes_by_name.get(name, []):
+            try:
+                return as_cls(session=self.session,
+                              base=self.ResolveAddressSpace("K"))
+            except addrspace.ASAssertionError:
+                continue
+
         raise AttributeError("Address space specification %r invalid.", name)
 
     def GetPhysicalAddressSpace(self):
@@ -34,6 +34,7 @@ from builtins import range
 from past.utils import old_div
 __author__ = "Andreas Moser <amoser@google.com>"
 
+import array
 import itertools
 import math
 import struct
@@ -291,6 +292,44 @@ def WKdm_decompress(src_buf):
 
     return _WKdm_decompress(src_buf, qpos_start, low_start, low_end, 16)
 
+# Translation tables which extract a bit field from every byte at once. These
+# let us unpack the tags and queue positions with bytes.translate() rather than
+# one value at a time.
+def _make_table(shift, mask):
+    return bytes(bytearray((i >> shift) & mask for i in range(256)))
+
+TWO_BIT_TABLES = [_make_table(shift, 0x3) for shift in (0, 2, 4, 6)]
+FOUR_BIT_TABLES = [_make_table(shift, 0xF) for shift in (0, 4)]
+
+
+def _unpack_planes(data, tables):
+    """A fast version of WK_unpack_2bits() and WK_unpack_4bits().
+
+    Each table extracts one field from all bytes. The resulting planes are
+    interleaved a 32 bit word at a time, which is the order the packing
+    routines use.
+    """
+    data = data[:len(data) - len(data) % 4]
+    planes = [array.array("I", data.translate(table)) for table in tables]
+    result = array.array("I", [0]) * (len(planes[0]) * len(planes))
+    for i, plane in enumerate(planes):
+        result[i::len(planes)] = plane
+
+    return bytearray(_array_to_bytes(result))
+
+
+def _array_to_bytes(value):
+    try:
+        return value.tobytes()
+    except AttributeError:
+        # Python 2 only has tostring().
+        return value.tostring()
+
+
+def _unpack_words(data):
+    return array.array("I", data[:len(data) - len(data) % 4])
+
+
 def _WKdm_decompress(src_buf, qpos_start, low_start, low_end, header_size):
 
     if max(qpos_start, low_start, low_end) > len(src_buf):
@@ -303,58 +342,63 @@ def _WKdm_decompress(src_buf, qpos_start, low_start, low_end, header_size):
     hashLookupTable = HASH_LOOKUP_TABLE_CONTENTS
 
     tags_str = src_buf[header_size : header_size + 256]
-    tags_array = WK_unpack_2bits(struct.unpack("B" * len(tags_str), tags_str))
+    tags_array = _unpack_planes(tags_str, TWO_BIT_TABLES)
 
     qpos_str = src_buf[qpos_start * 4:low_start * 4]
-    tempQPosArray = WK_unpack_4bits(
-        struct.unpack("B" * len(qpos_str), qpos_str))
+    tempQPosArray = _unpack_planes(qpos_str, FOUR_BIT_TABLES)
 
-    lowbits_str = src_buf[low_start * 4:low_end * 4]
-    num_lowbits_bytes = len(lowbits_str)
-    num_lowbits_words = old_div(num_lowbits_bytes, 4)
-    num_packed_lowbits = num_lowbits_words * 3
+    lowbits_words = _unpack_words(src_buf[low_start * 4:low_end * 4])
+    tempLowBitsArray = [0] * (len(lowbits_words) * 3)
+    tempLowBitsArray[0::3] = [x & LOW_BITS_MASK for x in lowbits_words]
+    tempLowBitsArray[1::3] = [(x >> 10) & LOW_BITS_MASK for x in lowbits_words]
+    tempLowBitsArray[2::3] = [(x >> 20) & LOW_BITS_MASK for x in lowbits_words]
 
-    rem = len(lowbits_str) % 16
-    if rem:
-        lowbits_str += "\x00" * (16 - rem)
+    full_patterns = _unpack_words(src_buf[256 + header_size:qpos_start * 4])
 
-    packed_lowbits = struct.unpack("I" * (old_div(len(lowbits_str), 4)), lowbits_str)
+    output = [0] * len(tags_array)
+    qpos = lowbits = patterns = 0
 
-    tempLowBitsArray = WK_unpack_3_tenbits(packed_lowbits)[:num_packed_lowbits]
+    # Local names are much faster than globals in this loop.
+    exact_tag = EXACT_TAG
+    partial_tag = PARTIAL_TAG
+    high_bits_mask = ~LOW_BITS_MASK
 
-    patterns_str = src_buf[256 + header_size:qpos_start * 4]
-    full_patterns = struct.unpack("I" * (old_div(len(patterns_str), 4)), patterns_str)
+    try:
+        for i, tag in enumerate(tags_array):
+            # Zero words are already in the output.
+            if not tag:
+                continue
 
-    p_tempQPosArray = iter(tempQPosArray)
-    p_tempLowBitsArray = iter(tempLowBitsArray)
-    p_full_patterns = iter(full_patterns)
+            elif tag == exact_tag:
+                output[i] = dictionary[tempQPosArray[qpos]]
+                qpos += 1
 
-    output = []
+            elif tag == partial_tag:
+                dict_idx = tempQPosArray[qpos]
+                qpos += 1
+
+                temp = ((dictionary[dict_idx] & high_bits_mask) |
+                        tempLowBitsArray[lowbits])
+                lowbits += 1
+
+                dictionary[dict_idx] = temp
+                output[i] = temp
+
+            else:
+                missed_word = full_patterns[patterns]
+                patterns += 1
+
+                dictionary[hashLookupTable[(missed_word >> 10) & 0xFF]] = (
+                    missed_word)
+                output[i] = missed_word
+
+    except IndexError:
+        # We ran out of data to decompress.
+        return None
+
+    if (any(tempQPosArray[qpos:]) or any(tempLowBitsArray[lowbits:]) or
+            any(full_patterns[patterns:])):
+        # Something went wrong, we have leftover data to decompress.
+        return None
 
-    for tag in tags_array:
-
-        if tag == ZERO_TAG:
-            output.append(0)
-        elif tag == EXACT_TAG:
-            output.append(dictionary[next(p_tempQPosArray)])
-        elif tag == PARTIAL_TAG:
-
-            dict_idx = next(p_tempQPosArray)
-            temp = ((old_div(dictionary[dict_idx], 1024)) * 1024)
-            temp += next(p_tempLowBitsArray)
-
-            dictionary[dict_idx] = temp
-            output.append(temp)
-        elif tag == MISS_TAG:
-            missed_word = next(p_full_patterns)
-            dict_idx = hashLookupTable[(old_div(missed_word, 1024)) % 256]
-            dictionary[dict_idx] = missed_word
-            output.append(missed_word)
-
-    for p in [p_tempQPosArray, p_tempLowBitsArray, p_full_patterns]:
-        for leftover in p:
-            if leftover != 0:
-                # Something went wrong, we have leftover data to decompress.
-                return None
-
-    return struct.pack("I" * len(output), *output)
+    return _array_to_bytes(array.array("I", output))
@@ -0,0 +1,63 @@
+import struct
+
+from rekall import testlib
+from rekall.plugins.darwin import WKdm
+
+
+class TestWKdm(testlib.RekallBaseUnitTestCase):
+    """Test the WKdm decompressor on hand assembled pages."""
+
+    # The page we expect: a missed word, the same word again (an exact match)
+    # and a word which only differs in the low bits (a partial match). The
+    # rest of the page is zero.
+    PAGE = (struct.pack("<III", 0x12345678, 0x12345678, 0x123456ff) +
+            b"\x00" * (4096 - 12))
+
+    def _compressed_page(self, header_size):
+        # Tags are packed 2 bits at a time: MISS, EXACT, PARTIAL, ZERO...
+        tags = b"\x02\x03\x01" + b"\x00" * 253
+
+        # The missed word is stored in full.
+        full_patterns = struct.pack("<I", 0x12345678)
+
+        # Both matches are at dictionary position 15 (the hash of the high
+        # bits), packed 4 bits at a time.
+        qpos = b"\x0f\x0f\x00\x00"
+
+        # The low 10 bits of the partial match, packed 3 per word.
+        low_bits = struct.pack("<I", 0x2ff)
+
+        # The header holds the word offsets of each area.
+        qpos_start = (header_size + len(tags) + len(full_patterns)) // 4
+        header = struct.pack("<III", qpos_start, qpos_start + 1,
+                             qpos_start + 2)
+        if header_size == 16:
+            header = b"\x00" * 4 + header
+
+        return header + tags + full_patterns + qpos + low_bits
+
+    def testDecompress(self):
+        self.assertEqual(WKdm.WKdm_decompress(self._compressed_page(16)),
+                         self.PAGE)
+
+    def testDecompressApple(self):
+        self.assertEqual(
+            WKdm.WKdm_decompress_apple(self._compressed_page(12)), self.PAGE)
+
+    def testZeroPage(self):
+        data = struct.pack("<IIII", 0, 68, 68, 68) + b"\x00" * 256
+        self.assertEqual(WKdm.WKdm_decompress(data), b"\x00" * 4096)
+
+    def testCorrupted(self):
+        data = self._compressed_page(16)
+
+        # The low bits area is missing.
+        self.assertEqual(WKdm.WKdm_decompress(data[:-4]), None)
+
+        # The partial match refers to low bits which are not there.
+        header = struct.pack("<IIII", 0, 69, 70, 70)
+        self.assertEqual(WKdm.WKdm_decompress(header + data[16:-4]), None)
+
+
+if __name__ == "__main__":
+    testlib.main()
@@ -90,10 +90,11 @@ class DarwinCheckSysCalls(common.AbstractDarwinCommand):
         )
 
         # Resolve which kernel module or symbol the entry point is to.
-        resolver = self.session.address_resolver
-        for entry in sysenter:
-            call = entry.sy_call.deref()
-            yield entry, call, resolver.format_address(call)
+        entries = list(sysenter)
+        calls = [entry.sy_call.deref() for entry in entries]
+        symbols = self.session.address_resolver.resolve_many(calls)
+        for entry, call, symbol in zip(entries, calls, symbols):
+            yield entry, call, symbol
 
     def render(self, renderer):
         renderer.table_header(
@@ -304,10 +305,11 @@ class CheckTrapTable(common.AbstractDarwinCommand):
             )
         )
 
-        resolver = self.session.address_resolver
-        for i, entry in enumerate(table):
-            call = entry.mach_trap_function.deref()
-            yield i, entry, call, resolver.format_address(call)
+        entries = list(table)
+        calls = [entry.mach_trap_function.deref() for entry in entries]
+        symbols = self.session.address_resolver.resolve_many(calls)
+        for i, (entry, call, symbol) in enumerate(zip(entries, calls, symbols)):
+            yield i, entry, call, symbol
 
     def render(self, renderer):
         renderer.table_header([
@@ -15,124 +15,290 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
-"""Enumerate and dump all compressed memory pages on Darwin."""
+"""Enumerate and dump all compressed memory pages on Darwin.
+
+The compressor address space exposes the compressed pages by segment and
+slot. Compressed PTEs are not resolved, so the Darwin process and kernel
+address spaces still read compressed pages as unavailable.
+"""
 from __future__ import division
 
 from builtins import str
 from builtins import range
-from past.utils import old_div
+from builtins import object
 __author__ = "Andreas Moser <amoser@google.com>"
 
 import os
 
+from rekall import addrspace
 from rekall.plugins import core
 from rekall.plugins.darwin import common
 from rekall.plugins.darwin import WKdm
+from rekall_lib import utils
 
 
-class DarwinDumpCompressedPages(core.DirectoryDumperMixin, common.AbstractDarwinCommand):
-    """Dumps all compressed pages."""
+class CompressorSegments(object):
+    """Reads the segments of the memory compressor.
 
-    __name = "dumpcompressedmemory"
+    Each segment's data buffer and each array of slot descriptors is read
+    with a single read, rather than one object at a time.
+    """
 
     SLOT_ARRAY_SIZE = 64
     PAGE_SIZE = 4096
 
-    def UnpackCSize(self, c_slot):
+    def __init__(self, session, profile=None, address_space=None):
+        self.session = session
+        self.profile = profile or session.profile
+        self.address_space = address_space or session.kernel_address_space
+
+        self.count = int(self.profile.get_constant_object(
+            "_c_segment_count", "int", vm=self.address_space))
+
+        p_segu = self.profile.get_constant_object(
+            "_c_segments", "Pointer", vm=self.address_space)
 
+        # Read the entire segment table at once.
+        segu_size = self.profile.get_obj_size("c_segu")
+        cached_vm = addrspace.BufferAddressSpace(
+            data=self.address_space.read(p_segu.v(), self.count * segu_size),
+            base_offset=p_segu.v(), session=self.session)
+
+        self.segu_array = self.profile.Array(
+            offset=p_segu.v(), vm=cached_vm, target="c_segu",
+            count=self.count)
+
+    def UnpackCSize(self, c_slot):
         size = c_slot.c_size
         if size == self.PAGE_SIZE - 1:
             return self.PAGE_SIZE
         else:
             return size
 
-    def render(self, renderer):
+    def _read_slot_array(self, pointer):
+        slot_size = self.profile.get_obj_size("c_slot")
+        cached_vm = addrspace.BufferAddressSpace(
+            data=self.address_space.read(
+                pointer, self.SLOT_ARRAY_SIZE * slot_size),
+            base_offset=pointer, session=self.session)
+
+        return self.profile.Array(
+            offset=pointer, vm=cached_vm, target="c_slot",
+            count=self.SLOT_ARRAY_SIZE)
+
+    def read_segment(self, index):
+        """Returns the compressed data of all slots in a segment.
+
+        Returns:
+          A list of (slot number, data) tuples, sorted by slot number.
+        """
+        result = []
+        if not 0 <= index < self.count:
+            return result
+
+        c_seg = self.segu_array[index].c_seg.dereference(
+            vm=self.address_space)
+
+        if (not c_seg or c_seg.c_ondisk or
+                c_seg.c_on_swappedout_q or
+                c_seg.c_on_swappedout_sparse_q):
+            # Data swapped out.
+            return result
+
+        c_buffer = c_seg.c_store.c_buffer
+        if c_buffer == 0:
+            # No data in this segment.
+            return result
+
+        seg_buffer = self.address_space.read(
+            c_buffer.v(), c_seg.c_nextoffset * 4)
+
+        c_slot_arrays = []
+        for slot_nr in range(c_seg.c_nextslot):
+            array_nr = slot_nr // self.SLOT_ARRAY_SIZE
+            if array_nr >= len(c_slot_arrays):
+                c_slot_arrays.append(self._read_slot_array(
+                    c_seg.c_slots[array_nr].v()))
+
+            c_slot = c_slot_arrays[array_nr][slot_nr % self.SLOT_ARRAY_SIZE]
+            c_offset = c_slot.c_offset * 4
+            if not (c_offset and c_slot.c_size):
+                continue
 
-        pages = self.profile.get_constant_object("_c_segment_count", "int")
+            c_size = self.UnpackCSize(c_slot)
 
-        renderer.format("Going to dump {0} segments.\n", pages)
+            # This should never happen.
+            if c_offset + c_size >= len(seg_buffer):
+                continue
 
-        p_segu = self.profile.get_constant_object(
-            "_c_segments", "Pointer", target_args={
-                "target": "Array",
-                "target_args": {
-                    "target": "c_segu",
-                    "count": int(pages),
-                }})
+            result.append((slot_nr, seg_buffer[c_offset:c_offset + c_size]))
 
-        segu_array = p_segu.deref()
+        return result
 
-        for i, segu in enumerate(segu_array):
-            renderer.RenderProgress("Segment: %d" % i)
+    def __iter__(self):
+        """Yields (segment number, slot number, data) for all slots."""
+        for index in range(self.count):
+            for slot_nr, data in self.read_segment(index):
+                yield index, slot_nr, data
 
-            c_seg = segu.c_seg
+    def is_compressed(self, data):
+        """Pages which were not compressible are stored as they are."""
+        offset_alignment_mask = 0x3
 
-            if (c_seg.c_ondisk or
-                    c_seg.c_on_swappedout_q or
-                    c_seg.c_on_swappedout_sparse_q):
-                # Data swapped out.
-                continue
+        c_rounded_size = (len(data) + offset_alignment_mask)
+        c_rounded_size &= ~offset_alignment_mask
 
-            c_buffer = c_seg.c_store.c_buffer
-            if c_buffer == 0:
-                # No data in this segment.
-                continue
+        return c_rounded_size != self.PAGE_SIZE
 
-            seg_buffer = c_buffer.obj_vm.read(c_buffer.v(),
-                                              c_seg.c_nextoffset * 4)
+    def decompress(self, data):
+        if not self.is_compressed(data):
+            return data
 
-            c_slot_arrays = []
-            for slot in c_seg.c_slots:
-                c_slot_arrays.append(
-                    slot.dereference_as(
-                        target="Array", target_args=dict(target="c_slot")))
+        return WKdm.WKdm_decompress_apple(data)
 
-            for slot_nr in range(c_seg.c_nextslot):
-                c_slot_array = c_slot_arrays[old_div(slot_nr, self.SLOT_ARRAY_SIZE)]
-                c_slot = c_slot_array[slot_nr % self.SLOT_ARRAY_SIZE]
 
-                if not (c_slot.c_offset and c_slot.c_size):
-                    continue
+class DarwinCompressorAddressSpace(addrspace.BaseAddressSpace):
+    """An address space of the pages held by the memory compressor.
+
+    This is not a transparent view of compressed memory: compressed PTEs are
+    not resolved, so a page can not be read at the virtual address it was
+    swapped out from. Instead, the page in slot s of segment n is exposed at
+    the synthetic address ((n << SLOT_BITS) | s) * PAGE_SIZE. Pages are
+    decompressed when they are read and the most recently used are kept in a
+    bounded cache.
+
+    Use it with --address_space compressor, e.g. to scan compressed pages.
+    """
 
-                c_size = self.UnpackCSize(c_slot)
+    name = "compressor"
 
-                # This should never happen.
-                if c_slot.c_offset * 4 + c_size >= len(seg_buffer):
+    SLOT_BITS = 16
+    PAGE_SIZE = 4096
+
+    # The number of decompressed pages and segments to keep around.
+    PAGE_CACHE_SIZE = 1000
+    SEGMENT_CACHE_SIZE = 10
+
+    def __init__(self, **kwargs):
+        super(DarwinCompressorAddressSpace, self).__init__(**kwargs)
+        self.as_assert(self.base is not None, "No base address space")
+
+        self.profile = self.profile or self.session.profile
+        self.as_assert(self.profile and
+                       self.profile.get_constant("_c_segments"),
+                       "Profile has no compressor segments.")
+
+        self.segments = CompressorSegments(
+            self.session, profile=self.profile, address_space=self.base)
+
+        self._page_cache = utils.FastStore(self.PAGE_CACHE_SIZE)
+        self._segment_cache = utils.FastStore(self.SEGMENT_CACHE_SIZE)
+
+    def _get_slots(self, index):
+        try:
+            return self._segment_cache.Get(index)
+        except KeyError:
+            result = dict(self.segments.read_segment(index))
+            self._segment_cache.Put(index, result)
+
+            return result
+
+    def _get_page(self, page):
+        try:
+            return self._page_cache.Get(page)
+        except KeyError:
+            pass
+
+        data = self._get_slots(page >> self.SLOT_BITS).get(
+            page & ((1 << self.SLOT_BITS) - 1))
+
+        result = None
+        if data:
+            try:
+                result = self.segments.decompress(data)
+            except Exception as e:
+                self.session.logging.debug(
+                    "Unable to decompress page %#x: %s", page, e)
+
+        self._page_cache.Put(page, result)
+        return result
+
+    def read(self, addr, length):
+        result = []
+        while length > 0:
+            page_offset = addr % self.PAGE_SIZE
+            to_read = min(length, self.PAGE_SIZE - page_offset)
+
+            data = self._get_page(addr // self.PAGE_SIZE)
+            data = (data or b"")[page_offset:page_offset + to_read]
+            result.append(data + addrspace.ZEROER.GetZeros(
+                to_read - len(data)))
+
+            addr += to_read
+            length -= to_read
+
+        return b"".join(result)
+
+    def get_mappings(self, start=0, end=2**64):
+        first_segment = (start // self.PAGE_SIZE) >> self.SLOT_BITS
+        for index in range(first_segment, self.segments.count):
+            for slot_nr in sorted(self._get_slots(index)):
+                page_start = (
+                    (index << self.SLOT_BITS) | slot_nr) * self.PAGE_SIZE
+
+                if page_start >= end:
+                    return
+
+                if page_start + self.PAGE_SIZE <= start:
                     continue
 
-                data = seg_buffer[c_slot.c_offset * 4:
-                                  c_slot.c_offset * 4 + c_size]
+                yield addrspace.Run(start=page_start,
+                                    end=page_start + self.PAGE_SIZE,
+                                    file_offset=page_start,
+                                    address_space=self)
+
+
+class DarwinDumpCompressedPages(core.DirectoryDumperMixin, common.AbstractDarwinCommand):
+    """Dumps all compressed pages."""
+
+    __name = "dumpcompressedmemory"
 
-                offset_alignment_mask = 0x3
+    def render(self, renderer):
+        segments = CompressorSegments(self.session, profile=self.profile)
 
-                c_rounded_size = (c_size + offset_alignment_mask)
-                c_rounded_size &= ~offset_alignment_mask
+        renderer.format("Going to dump {0} segments.\n", segments.count)
 
-                if (c_rounded_size == self.PAGE_SIZE):
-                    # Page was not compressible.
-                    # Copy anyways?
+        last_segment = None
+        for i, slot_nr, data in segments:
+            if i != last_segment:
+                renderer.RenderProgress("Segment: %d" % i)
+                last_segment = i
 
-                    # with renderer.open(
-                    #         directory=self.dump_dir,
-                    #         filename="seg%d_slot%d.dat" % (i, slot_nr),
-                    #         mode="wb") as fd:
-                    #     fd.write(data)
-                    continue
+            if not segments.is_compressed(data):
+                # Page was not compressible.
+                # Copy anyways?
+
+                # with renderer.open(
+                #         directory=self.dump_dir,
+                #         filename="seg%d_slot%d.dat" % (i, slot_nr),
+                #         mode="wb") as fd:
+                #     fd.write(data)
+                continue
 
-                try:
-                    decompressed = WKdm.WKdm_decompress_apple(data)
-                    if decompressed:
-                        dirname = os.path.join(self.dump_dir, "segment%d" % i)
-                        try:
-                            os.mkdir(dirname)
-                        except OSError:
-                            pass
-
-                        with renderer.open(
-                                directory=dirname,
-                                filename="slot%d.dmp" % slot_nr,
-                                mode="wb") as fd:
-                            fd.write(decompressed)
-
-                except Exception as e:
-                    renderer.report_error(str(e))
+            try:
+                decompressed = WKdm.WKdm_decompress_apple(data)
+                if decompressed:
+                    dirname = os.path.join(self.dump_dir, "segment%d" % i)
+                    try:
+                        os.mkdir(dirname)
+                    except OSError:
+                        pass
+
+                    with renderer.open(
+                            directory=dirname,
+                            filename="slot%d.dmp" % slot_nr,
+                            mode="wb") as fd:
+                        fd.write(decompressed)
+
+            except Exception as e:
+                renderer.report_error(str(e))
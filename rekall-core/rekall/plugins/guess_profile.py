@@ -21,15 +21,22 @@
 
 from builtins import str
 from builtins import object
+from builtins import range
+from future import standard_library
 from future.utils import with_metaclass
+standard_library.install_aliases()
 __author__ = "Michael Cohen <scudette@gmail.com>"
 
 # pylint: disable=protected-access
+import queue
 import re
+import threading
+import time
 
 from rekall import addrspace
 from rekall import cache
 from rekall import config
+from rekall import constants
 from rekall import kb
 from rekall import obj
 from rekall import scan
@@ -140,6 +147,13 @@ config.DeclareOption("autodetect_scan_length", default=2**64,
                      help="How much of physical memory to scan before failing",
                      type="IntParser")
 
+config.DeclareOption("autodetect_scan_workers", default=4,
+                     group="Autodetection Overrides",
+                     help="Number of threads scanning for autodetection "
+                     "keywords (only used if the image supports concurrent "
+                     "reads).",
+                     type="IntParser")
+
 
 class WindowsIndexDetector(DetectionMethod):
     """Apply the windows index to detect the profile."""
@@ -196,47 +210,28 @@ class WindowsIndexDetector(DetectionMethod):
 
     def DetectWindowsDTB(self, filename_offset, address_space):
         """Checks the possible filename hit for a valid DTB address."""
-        for dtb_rel_offset, arch in self.eprocess_index.filename_to_dtb:
+        for possible_dtb, arch, signature in self.eprocess_index.PossibleDTBs(
+                filename_offset, address_space):
             # We only apply indexes to 64 bit images.
             if arch == "AMD64":
-                possible_dtb = self.eprocess_index.Object(
-                    "unsigned long", offset=filename_offset - dtb_rel_offset,
-                    vm=address_space).v()
-
-                # Discard impossible DTB values immediately. On 64 bit
-                # architectures, the DTB must be page aligned.
-                if not possible_dtb or possible_dtb & 0xFFF:
-                    continue
-
                 test_as = amd64.AMD64PagedMemory(
                     session=self.session, base=address_space, dtb=possible_dtb)
                 if self.VerifyAMD64DTB(test_as):
+                    self.eprocess_index.RecordHit(signature)
                     yield test_as
 
             elif arch == "I386":
-                possible_dtb = self.eprocess_index.Object(
-                    "unsigned long", offset=filename_offset - dtb_rel_offset,
-                    vm=address_space).v()
-
-                # Discard impossible DTB values immediately. On 32 bit
-                # architectures, the DTB must be aligned to 0x20 (with PAE).
-                if not possible_dtb or possible_dtb & 0x1F:
-                    continue
-
                 # Only support PAE - we dont really see non PAE images any more.
                 test_as = intel.IA32PagedMemoryPae(
                     session=self.session, base=address_space, dtb=possible_dtb)
                 if self.VerifyI386DTB(test_as):
+                    self.eprocess_index.RecordHit(signature)
                     yield test_as
 
     def _match_profile_for_kernel_base(self, kernel_base, test_as):
         threshold = self.session.GetParameter("autodetect_threshold")
-        for profile, match in self.nt_index.LookupIndex(
-                kernel_base, address_space=test_as):
-
-            if match < threshold:
-                break
-
+        for profile, _ in self.nt_index.IncrementalLookup(
+                kernel_base, threshold, address_space=test_as):
             profile_obj = self.session.LoadProfile(profile)
             if profile_obj:
                 return profile_obj
@@ -461,11 +456,7 @@ class LinuxIndexDetector(DetectionMethod):
 
         # We create a dictionary of symbol:offset skipping symbols from
         # exported modules.
-        symbol_dict = {}
-        for offset, symbol, _, module in kaslr_reader.ObtainSymbols():
-            # Ignore symbols in modules we only care about the kernel.
-            if not module:
-                symbol_dict[symbol] = offset
+        symbol_dict = kaslr_reader.ObtainSymbolTable().kernel_symbols()
 
         if not symbol_dict:
             return
@@ -659,41 +650,56 @@ class ProfileHook(kb.ParameterHook):
                 needles.append(keyword)
                 needle_lookup.setdefault(keyword, []).append(method)
 
-            for offset in method.Offsets():
-                self.session.logging.debug("Trying method %s, offset %d",
-                                           method.name, offset)
-                profile = method.DetectFromHit(None, offset, address_space)
-                if profile:
-                    self.session.logging.info(
-                        "Detection method %s yielded profile %s",
-                        method.name, profile)
-                    return profile
+            now = time.time()
+            try:
+                for offset in method.Offsets():
+                    self.session.logging.debug("Trying method %s, offset %d",
+                                               method.name, offset)
+                    profile = method.DetectFromHit(None, offset, address_space)
+                    if profile:
+                        self.session.logging.info(
+                            "Detection method %s yielded profile %s",
+                            method.name, profile)
+                        return profile
+            finally:
+                self.session.logging.debug(
+                    "Detection method %s offsets took %.2f sec",
+                    method.name, time.time() - now)
 
         # 10 GB by default.
         autodetect_scan_length = self.session.GetParameter(
             "autodetect_scan_length", 10*1024*1024*1024)
 
-        # Build and configure the scanner.
-        scanner = scan.MultiStringScanner(
-            profile=obj.NoneObject(),
-            address_space=address_space, needles=needles,
-            session=self.session)
-        scanner.progress_message = "Autodetecting profile: %(offset)#08x"
-        for offset, hit in scanner.scan(maxlen=autodetect_scan_length):
-            self.session.render_progress(
-                "guess_profile: autodetection hit @ %x - %s", offset, hit)
-
-            for method in needle_lookup[hit]:
-                profile = method.DetectFromHit(hit, offset, address_space)
-                if profile:
-                    self.session.logging.debug(
-                        "Detection method %s worked at offset %#x",
-                        method.name, offset)
-                    return profile
-
-            if best_match == 1.0:
-                # If we have an exact match we can stop scanning.
-                break
+        # Total time each method spent verifying hits.
+        timings = dict((method.name, 0) for method in methods)
+        cancelled = threading.Event()
+        try:
+            for offset, hit in self._ScanKeywords(
+                    address_space, needles, autodetect_scan_length,
+                    cancelled):
+                self.session.render_progress(
+                    "guess_profile: autodetection hit @ %x - %s", offset, hit)
+
+                for method in needle_lookup[hit]:
+                    now = time.time()
+                    profile = method.DetectFromHit(hit, offset, address_space)
+                    timings[method.name] += time.time() - now
+                    if profile:
+                        self.session.logging.debug(
+                            "Detection method %s worked at offset %#x",
+                            method.name, offset)
+                        return profile
+
+                if best_match == 1.0:
+                    # If we have an exact match we can stop scanning.
+                    break
+        finally:
+            # Stop any outstanding scanning.
+            cancelled.set()
+            for name, elapsed in sorted(timings.items()):
+                self.session.logging.debug(
+                    "Detection method %s verified hits in %.2f sec",
+                    name, elapsed)
 
         threshold = self.session.GetParameter("autodetect_threshold")
         if best_match == 0:
@@ -721,6 +727,113 @@ class ProfileHook(kb.ParameterHook):
 
             return best_profile
 
+    def _ScanKeywords(self, address_space, needles, maxlen, cancelled):
+        """Yields (offset, hit) for all the needles in the address space.
+
+        If the address space supports concurrent reads, the range is split into
+        chunks which are scanned by a pool of threads. Each chunk's hits are
+        buffered and released in offset order, so the first verified hit (and
+        hence the detected profile) does not depend on thread scheduling.
+        Verification of early chunks still proceeds while the later chunks are
+        being scanned. Setting the cancelled event stops all the scanning
+        threads.
+
+        Note that hits are verified and progress is reported on the calling
+        thread since both call into the session.
+        """
+        workers = self.session.GetParameter("autodetect_scan_workers", 1)
+        end = min(maxlen, address_space.end())
+        chunk_size = constants.SCAN_BLOCKSIZE * 10
+
+        if (workers <= 1 or end <= chunk_size or
+                not address_space.metadata("thread_safe")):
+            scanner = scan.MultiStringScanner(
+                profile=obj.NoneObject(),
+                address_space=address_space, needles=needles,
+                session=self.session)
+            scanner.progress_message = "Autodetecting profile: %(offset)#08x"
+            for offset, hit in scanner.scan(maxlen=maxlen):
+                yield offset, hit
+
+            return
+
+        # Scan a little past the end of each chunk so needles crossing the
+        # chunk boundary are found (but only reported by one chunk).
+        overlap = max(len(x) for x in needles)
+        starts = list(range(0, end, chunk_size))
+        chunks = queue.Queue()
+        for index, start in enumerate(starts):
+            chunks.put((index, start))
+
+        # Receives (chunk index, hits) for each completed chunk, and None when
+        # a thread exits.
+        results = queue.Queue()
+
+        def _ScanChunks():
+            scanner = scan.MultiStringScanner(
+                profile=obj.NoneObject(),
+                address_space=address_space, needles=needles,
+                session=self.session)
+
+            # Progress is reported by the calling thread.
+            scanner.report_progress = False
+            try:
+                while not cancelled.is_set():
+                    try:
+                        index, start = chunks.get_nowait()
+                    except queue.Empty:
+                        break
+
+                    chunk_end = min(start + chunk_size, end)
+                    chunk_hits = []
+                    for offset, hit in scanner.scan(
+                            offset=start, end=min(chunk_end + overlap, end)):
+                        if cancelled.is_set():
+                            return
+
+                        if offset < chunk_end:
+                            chunk_hits.append((offset, hit))
+
+                    results.put((index, chunk_hits))
+            finally:
+                results.put(None)
+
+        threads = [threading.Thread(target=_ScanChunks)
+                   for _ in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            # Chunks which completed ahead of an earlier chunk.
+            pending = {}
+            next_index = 0
+            finished = 0
+            while finished < len(threads):
+                item = results.get()
+                if item is None:
+                    finished += 1
+                    continue
+
+                index, chunk_hits = item
+                pending[index] = chunk_hits
+                while next_index in pending:
+                    self.session.report_progress(
+                        "Autodetecting profile: %#08x", starts[next_index])
+
+                    for hit in pending.pop(next_index):
+                        yield hit
+
+                    next_index += 1
+
+            # A chunk was lost (e.g. a scanning thread failed). Still release
+            # the later chunks in order.
+            for index in sorted(pending):
+                for hit in pending[index]:
+                    yield hit
+        finally:
+            cancelled.set()
+
     def calculate(self):
         """Try to find the correct profile by scanning for PDB files."""
         # Clear the profile for the duration of the scan.
@@ -24,69 +24,213 @@
 """
 from builtins import str
 from builtins import object
-import os
-import re
+from builtins import range
+from builtins import zip
+import binascii
+import hashlib
+import struct
 
 from rekall import addrspace
 from rekall import kb
 from rekall import plugin
-from rekall import obj
 from rekall_lib import utils
 
 from rekall.plugins.addrspaces import elfcore
 from rekall.plugins import core
 
 
+# Parsed symbol tables keyed by the sha1 of the raw symbols buffer.
+SYMBOL_TABLE_CACHE = utils.FastStore(5, lock=True)
+
+
+class SymbolTable(object):
+    """A compact, address sorted table of kernel symbols.
+
+    A /proc/kallsyms or System.map file contains about 150k symbols. Rather than
+    keeping a tuple per symbol we store parallel arrays which are built in a
+    single pass over the buffer.
+    """
+
+    def __init__(self, addresses=None, names=None, types=None, modules=None,
+                 file_order=None):
+        # All arrays are sorted by address.
+        self.addresses = addresses or []
+        self.names = names or []
+
+        # A string with one type character per symbol.
+        self.types = types or ""
+
+        # The module name (e.g. "[ext4]") or None for kernel symbols.
+        self.modules = modules or []
+
+        # The index into the sorted arrays of each symbol in the order it
+        # appeared in the file. Used so that when a name is duplicated the
+        # last one in the file wins, as it always did.
+        if file_order is None:
+            file_order = list(range(len(self.addresses)))
+
+        self.file_order = file_order
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __iter__(self):
+        """Yields tuples of offset, symbol_name, type, module."""
+        return zip(self.addresses, self.names, self.types, self.modules)
+
+    @staticmethod
+    def _DecodeAddresses(hex_addresses):
+        """Converts a list of hex encoded addresses into integers.
+
+        When all addresses have the same width (the usual case for both
+        kallsyms and System.map) they are decoded in one unhexlify call.
+        """
+        widths = set(len(x) for x in hex_addresses)
+        if len(widths) == 1:
+            width = widths.pop()
+            fmt = {8: "I", 16: "Q"}.get(width)
+            if fmt:
+                try:
+                    raw = binascii.unhexlify(b"".join(hex_addresses))
+                    return struct.unpack(
+                        ">%d%s" % (len(hex_addresses), fmt), raw)
+                except (TypeError, ValueError, binascii.Error):
+                    pass
+
+        return [int(x, 16) for x in hex_addresses]
+
+    @classmethod
+    def FromBuffer(cls, data, max_failures=50, max_fields=4):
+        """Parses a symbols file buffer.
+
+        The format is the output of nm:
+
+        0000000000 t linux_proc_banner
+        0000000010 s other_symbol	[module]
+
+        Lines with more than max_fields fields are invalid.
+        """
+        data = utils.SmartStr(data)
+        hex_addresses = []
+        names = []
+        types = []
+        modules = []
+        failures = 0
+        for line in data.split(b"\n"):
+            fields = line.split()
+            if not 3 <= len(fields) <= max_fields or len(fields[1]) != 1:
+                if line.strip():
+                    failures += 1
+                    if failures >= max_failures:
+                        break
+                continue
+
+            hex_addresses.append(fields[0])
+            types.append(fields[1])
+            names.append(fields[2])
+            modules.append(fields[3] if len(fields) > 3 else b"")
+
+        try:
+            addresses = cls._DecodeAddresses(hex_addresses)
+        except ValueError:
+            # Some addresses are not valid hex - drop those lines.
+            valid = []
+            for i, address in enumerate(hex_addresses):
+                try:
+                    int(address, 16)
+                    valid.append(i)
+                except ValueError:
+                    pass
+
+            hex_addresses = [hex_addresses[i] for i in valid]
+            types = [types[i] for i in valid]
+            names = [names[i] for i in valid]
+            modules = [modules[i] for i in valid]
+            addresses = cls._DecodeAddresses(hex_addresses)
+
+        mask = 0xffffffffffff
+        addresses = [x & mask for x in addresses]
+
+        # Decode all the strings in one go.
+        names = b"\n".join(names).decode("utf8", "replace").split(u"\n")
+        modules = [x or None for x in b"\n".join(modules).decode(
+            "utf8", "replace").split(u"\n")]
+        types = b"".join(types).decode("ascii", "replace")
+
+        # Kallsyms lists module symbols after the kernel so we need to sort.
+        order = sorted(range(len(addresses)), key=addresses.__getitem__)
+        file_order = [0] * len(order)
+        for i, line_number in enumerate(order):
+            file_order[line_number] = i
+
+        return cls(addresses=[addresses[i] for i in order],
+                   names=[names[i] for i in order],
+                   types=u"".join(types[i] for i in order),
+                   modules=[modules[i] for i in order],
+                   file_order=file_order)
+
+    def kernel_symbols(self):
+        """Returns a dict of symbol:offset skipping symbols from modules."""
+        return dict((self.names[i], self.addresses[i])
+                    for i in self.file_order if not self.modules[i])
+
+    def as_dict(self):
+        """Returns a dict of symbol:offset for all symbols."""
+        return dict((self.names[i], self.addresses[i])
+                    for i in self.file_order)
+
+
 class KAllSyms(object):
     """A parser for KAllSyms files."""
     # Location of the kallsyms file. We use it to do instant, accurate detection
     # of the profile.
     KALLSYMS_FILE = "/proc/kallsyms"
 
-    # The regular expression to parse the kallsyms file.
-    KALLSYMS_REGEXP = (r"(?P<offset>[0-9a-fA-F]+) "
-                       r"(?P<type>[a-zA-Z]) "
-                       r"(?P<symbol>[^ \t]+)"
-                       r"(\t(?P<module>[^ ]+))?$")
-
     def __init__(self, session):
         self.session = session
         self.physical_address_space = session.physical_address_space
 
-    def _ParseKallsym(self, line):
-        """Parses a single symbol line from a symbols file.
+    def _ReadSymbolsFile(self):
+        kallsyms_as = self._OpenLiveSymbolsFile(
+            self.physical_address_space)
 
-        This is the result of obtaining symbols from nm:
+        if not kallsyms_as:
+            return b""
 
-        0000000000 t linux_proc_banner
-        0000000010 s other_symbol [module]
+        # Proc files do not have a stat and the address space shows it as being
+        # of zero length.
+        if kallsyms_as.end() != 0:
+            return kallsyms_as.read(0, kallsyms_as.end())
 
-        Yields:
-          Tuple of offset, symbol_name, type, module
-        """
+        # Try to fully read the file
+        read_length = 1*1024*1024
+        data = kallsyms_as.read(0, read_length).strip(b"\x00")
+        while len(data) == read_length and read_length < 2**30:
+            read_length *= 2
+            data = kallsyms_as.read(0, read_length).strip(b"\x00")
 
-        matches = None
-        if line:
-            matches = re.match(self.KALLSYMS_REGEXP, line.rstrip("\n"))
+        return data
 
-        if not matches:
-            raise ValueError("Invalid line: %s", line)
+    def ObtainSymbolTable(self):
+        """Obtain the SymbolTable for a live machine.
 
-        # Obtain all fields from the kallsyms entry
-        offset = matches.group("offset")
-        symbol_type = matches.group("type")
-        symbol = matches.group("symbol")
-        try:
-            module = matches.group("module")
-        except IndexError:
-            module = None
+        The parsed table is cached by the hash of the kallsyms data so repeated
+        calls (e.g. profile detection followed by the kernel slide hook) only
+        parse the file once.
+        """
+        data = self._ReadSymbolsFile()
+        if not data:
+            return SymbolTable()
 
+        digest = hashlib.sha1(data).hexdigest()
         try:
-            offset = obj.Pointer.integer_to_address(int(offset, 16))
-        except ValueError:
+            return SYMBOL_TABLE_CACHE.Get(digest)
+        except KeyError:
             pass
 
-        return offset, symbol, symbol_type, module
+        result = self.parse_data(data)
+        SYMBOL_TABLE_CACHE.Put(digest, result)
+        return result
 
     def ObtainSymbols(self):
         """Obtain symbol names and values for a live machine.
@@ -94,40 +238,13 @@ class KAllSyms(object):
         Yields:
           Tuples of offset, symbol_name, type, module
         """
-        kallsyms_as = self._OpenLiveSymbolsFile(
-            self.physical_address_space)
-
-        if not kallsyms_as:
-            return []
-
-        # Proc files do not have a stat and the address space shows it as being
-        # of zero length.
-        if kallsyms_as.end() != 0:
-            data = kallsyms_as.read(0, kallsyms_as.end())
-        else:
-            # Try to fully read the file
-            read_length = 1*1024*1024
-            data = kallsyms_as.read(0, read_length).strip(b"\x00")
-            while len(data) == read_length and read_length < 2**30:
-                read_length *= 2
-                data = kallsyms_as.read(0, read_length).strip(b"\x00")
-
-        return self.parse_data(utils.SmartUnicode(data))
+        return iter(self.ObtainSymbolTable())
 
     def parse_data(self, data):
         self.session.logging.debug(
             "Found %s of size: %d", self.KALLSYMS_FILE, len(data))
 
-        match_failures = 0
-        for line in data.split(os.linesep):
-            if match_failures >= 50:
-                break
-
-            try:
-                yield self._ParseKallsym(line)
-            except ValueError:
-                match_failures += 1
-                continue
+        return SymbolTable.FromBuffer(data)
 
     def _OpenLiveSymbolsFile(self, physical_address_space):
         """Opens the live symbols file to parse."""
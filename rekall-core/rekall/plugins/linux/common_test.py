@@ -0,0 +1,59 @@
+"""Tests for the kernel symbol table parser."""
+
+from rekall import testlib
+from rekall.plugins.linux import common
+
+
+class TestSymbolTable(testlib.RekallBaseUnitTestCase):
+
+    KALLSYMS = (
+        b"ffffffff81000000 T _text\n"
+        b"ffffffff81000100 t dup\n"
+        b"ffffffffa0000010 t ext4_init\t[ext4]\n"
+        b"ffffffff81000200 D dup\n"
+        b"this line is not a symbol at all\n"
+        b"\n"
+        b"ffffffffa0000000 t dup\t[ext4]\n")
+
+    def testFromBuffer(self):
+        table = common.SymbolTable.FromBuffer(self.KALLSYMS)
+
+        # Symbols are sorted by address and masked to 48 bits.
+        self.assertEqual(list(table), [
+            (0xffff81000000, u"_text", u"T", None),
+            (0xffff81000100, u"dup", u"t", None),
+            (0xffff81000200, u"dup", u"D", None),
+            (0xffffa0000000, u"dup", u"t", u"[ext4]"),
+            (0xffffa0000010, u"ext4_init", u"t", u"[ext4]")])
+
+    def testDuplicateSymbols(self):
+        table = common.SymbolTable.FromBuffer(self.KALLSYMS)
+
+        # The last kernel symbol in the file wins, even though module symbols
+        # sort after it.
+        self.assertEqual(table.kernel_symbols(), {
+            u"_text": 0xffff81000000, u"dup": 0xffff81000200})
+
+        # Including the module symbols, the module's dup is the last.
+        self.assertEqual(table.as_dict()[u"dup"], 0xffffa0000000)
+
+    def testMixedWidths(self):
+        table = common.SymbolTable.FromBuffer(
+            b"c1000000 T start\n"
+            b"00000000c0000000 T low\n"
+            b"zzzzzzzz T bad\n")
+
+        # Invalid addresses are dropped, the rest are still parsed.
+        self.assertEqual([(x[0], x[1]) for x in table],
+                         [(0xc0000000, u"low"), (0xc1000000, u"start")])
+
+    def testMaxFailures(self):
+        data = b"garbage\n" * 3 + b"ffffffff81000000 T _text\n"
+        self.assertEqual(
+            len(common.SymbolTable.FromBuffer(data, max_failures=3)), 0)
+        self.assertEqual(
+            len(common.SymbolTable.FromBuffer(data, max_failures=4)), 1)
+
+
+if __name__ == "__main__":
+    testlib.main()
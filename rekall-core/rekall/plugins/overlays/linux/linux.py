@@ -1006,10 +1006,11 @@ class Linux(basic.RelativeOffsetMixin, basic.BasicClasses):
 
         # Autoguessing for old profiles that don't provide an arch.
         if not profile.metadata("arch"):
-            try:
-                profile.constant_addresses.find_gt(2**32)
+            offset, _ = profile.constant_addresses.get_value_larger_than(
+                2**32 + 1)
+            if offset is not None:
                 profile.set_metadata("arch", "AMD64")
-            except ValueError:
+            else:
                 profile.set_metadata("arch", "I386")
 
         if profile.metadata("arch") == "I386":
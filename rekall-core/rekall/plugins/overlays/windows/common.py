@@ -1077,19 +1077,30 @@ class _HANDLE_TABLE(obj.Struct):
         """Returns the OBJECT_HEADER of the associated handle. The parent
         is the _HANDLE_TABLE_ENTRY so that an object can be linked to its
         GrantedAccess.
+
+        The entry may live in a cached copy of the table page, so the object
+        header is always instantiated in our own address space.
         """
-        return entry.Object.dereference_as("_OBJECT_HEADER", parent=entry)
+        return entry.Object.dereference_as(
+            "_OBJECT_HEADER", parent=entry, vm=self.obj_vm)
 
     def _make_handle_array(self, table_offset, level):
         """ Returns an array of _HANDLE_TABLE_ENTRY rooted at offset,
         and iterates over them.
         """
+        # Each table is exactly one page. Read it in one go and decode the
+        # entries from the copy rather than reading each one separately.
+        cached_vm = addrspace.BufferAddressSpace(
+            data=self.obj_vm.read(table_offset, 0x1000),
+            base_offset=table_offset, session=self.obj_session)
+
         # level == 0 means we are at the bottom level and this is a table of
         # _HANDLE_TABLE_ENTRY, otherwise, it means we are a table of pointers to
         # lower tables.
         if level == 0:
             table = self.obj_profile.Array(
                 offset=table_offset,
+                vm=cached_vm,
                 target="_HANDLE_TABLE_ENTRY",
                 size=0x1000)
 
@@ -1098,11 +1109,11 @@ class _HANDLE_TABLE(obj.Struct):
 
         else:
             table = self.obj_profile.PointerArray(
-                offset=table_offset, size=0x1000)
+                offset=table_offset, vm=cached_vm, size=0x1000)
 
             for entry in table:
                 if entry:
-                    for item in self._make_handle_array(entry, level-1):
+                    for item in self._make_handle_array(entry.v(), level-1):
                         yield item
 
     def handles(self):
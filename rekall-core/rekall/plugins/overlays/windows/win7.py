@@ -178,8 +178,8 @@ class _OBJECT_HEADER(common._OBJECT_HEADER):
 
     def get_object_type(self, vm=None):
         """Return the object's type as a string."""
-        return self.obj_session.GetParameter("ObjectTypeMap")[
-            self.TypeIndex].Name.v()
+        return self.obj_session.GetParameter("ObjectTypeNames")[
+            self.TypeIndex]
 
     @utils.safe_property
     def TypeIndex(self):
@@ -423,6 +423,26 @@ class ObjectTypeMapHook(kb.ParameterHook):
             )
 
 
+class ObjectTypeNamesHook(kb.ParameterHook):
+    """The names of all the object types, indexed by TypeIndex.
+
+    Resolving the name of an object type needs two dereferences, which adds up
+    when it is done for every handle, so we resolve the whole table once.
+    """
+    name = "ObjectTypeNames"
+
+    def calculate(self):
+        type_map = self.session.GetParameter("ObjectTypeMap")
+
+        # TypeIndex is a single byte.
+        result = []
+        for i in range(0x100):
+            object_type = type_map[i].deref()
+            result.append(object_type.Name.v() if object_type else None)
+
+        return result
+
+
 def InitializeWindows7Profile(profile):
     profile.add_overlay(win7_overlays)
     profile.add_classes(
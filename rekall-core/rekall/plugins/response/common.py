@@ -31,6 +31,9 @@ import platform
 import os
 import stat
 
+from multiprocessing import pool
+from six.moves import queue
+
 import arrow
 
 from efilter.protocols import associative
@@ -47,6 +50,14 @@ from rekall_lib import utils
 IRProcessAddressSpace = None
 IRProfile = None
 
+# os.scandir() is only available on Python 3.5 - older interpreters may have
+# the scandir backport installed. Otherwise we fall back to listdir and lstat.
+scandir = getattr(os, "scandir", None) or getattr(
+    utils.ConditionalImport("scandir"), "scandir", None)
+
+# Number of threads used to list directories concurrently.
+DIRECTORY_WALKER_THREADS = 8
+
 
 class APIDummyPhysicalAddressSpace(addrspace.BaseAddressSpace):
     __image = True
@@ -234,7 +245,6 @@ class FileInformation(utils.SlottedObject):
     @classmethod
     def from_stat(cls, filespec, session=None):
         filespec = FileSpec(filespec)
-        result = FileInformation(filename=filespec, session=session)
 
         try:
             path = filespec.os_path()
@@ -242,6 +252,12 @@ class FileInformation(utils.SlottedObject):
         except (IOError, OSError) as e:
             return obj.NoneObject("Unable to stat %s", e)
 
+        return cls.from_stat_result(filespec, s, session=session)
+
+    @classmethod
+    def from_stat_result(cls, filespec, s, session=None):
+        """Build a FileInformation from an existing os.stat_result."""
+        result = cls(filename=filespec, session=session)
         result.st_mode = Permissions(s.st_mode)
         result.st_ino = s.st_ino
         result.st_size = s.st_size
@@ -284,6 +300,13 @@ class FileInformation(utils.SlottedObject):
         except (OSError, IOError):
             return []
 
+    def list_entries(self):
+        """Returns a list of FileInformation for all the children."""
+        if not self.st_mode.is_dir():
+            return []
+
+        return list_directory(self.filename, session=self.session)
+
     def list(self):
         """If this is a directory return a list of children."""
         if not self.st_mode.is_dir():
@@ -359,6 +382,9 @@ class Permissions(with_metaclass(registry.UniqueObjectIdMetaclass, object)):
     def is_link(self):
         return stat.S_ISLNK(self.value)
 
+    def is_regular(self):
+        return stat.S_ISREG(self.value)
+
 
 class AbstractIRCommandPlugin(plugin.TypedProfileCommand,
                               plugin.ProfileCommand):
@@ -390,6 +416,167 @@ class AbstractAPICommandPlugin(plugin.TypedProfileCommand,
 FILE_SPEC_DISPATCHER = dict(API=FileInformation)
 
 
+def list_directory(filespec, session=None):
+    """Lists a directory returning a FileInformation for each child.
+
+    When scandir is available we take the stat information from the directory
+    entries: On Windows this comes for free with the listing and elsewhere we
+    avoid resolving the full path of every child again.
+    """
+    filespec = FileSpec(filespec)
+
+    # Adding the separator forces listing as a directory.
+    path = filespec.os_path() + os.path.sep
+    result = []
+
+    if scandir is None:
+        try:
+            names = os.listdir(path)
+        except (OSError, IOError):
+            return result
+
+        for name in names:
+            child = FileInformation.from_stat(filespec.add(name),
+                                              session=session)
+            if child:
+                result.append(child)
+
+        return result
+
+    try:
+        entries = list(scandir(path))
+    except (OSError, IOError):
+        return result
+
+    for entry in entries:
+        try:
+            s = entry.stat(follow_symlinks=False)
+        except (OSError, IOError):
+            continue
+
+        result.append(FileInformation.from_stat_result(
+            filespec.add(entry.name), s, session=session))
+
+    return result
+
+
+class DirectoryWalker(object):
+    """Walks a directory tree, listing directories on a pool of threads.
+
+    Walking a large tree is dominated by the latency of the listing system
+    calls so we list several directories concurrently. Much like os.walk(),
+    walk() yields a tuple (directory, children, subdirectories) where
+    subdirectories are those children which will be walked next. The caller
+    may remove entries from subdirectories to prune the walk.
+
+    If ordered is set, children are sorted by name and directories are yielded
+    in a deterministic depth first order. Otherwise directories are yielded as
+    soon as their listing completes.
+    """
+
+    def __init__(self, session=None, threads=DIRECTORY_WALKER_THREADS,
+                 ordered=True):
+        self.session = session
+        self.threads = threads
+        self.ordered = ordered
+
+    def _list(self, directory):
+        children = list_directory(directory.filename, session=self.session)
+        if self.ordered:
+            children.sort(key=lambda x: x.filename.basename)
+
+        return children
+
+    def _subdirectories(self, children, depth, max_depth):
+        if max_depth is not None and depth >= max_depth:
+            return []
+
+        # Never follow symlinks.
+        return [x for x in children
+                if x.st_mode.is_dir() and not x.st_mode.is_link()]
+
+    def walk(self, root, max_depth=None):
+        """Walk the tree below root.
+
+        Args:
+          root: A FileInformation, FileSpec or path of the top directory.
+          max_depth: The number of directory levels to list (1 lists only
+             root). If None there is no limit.
+        """
+        if not isinstance(root, FileInformation):
+            root = FileFactory(root, session=self.session)
+
+        if not root or not root.st_mode.is_dir():
+            return
+
+        workers = pool.ThreadPool(self.threads)
+        try:
+            if self.ordered:
+                walker = self._walk_ordered(workers, root, max_depth)
+            else:
+                walker = self._walk_unordered(workers, root, max_depth)
+
+            for result in walker:
+                yield result
+        finally:
+            workers.terminate()
+
+    def _walk_ordered(self, workers, root, max_depth):
+        # A stack of [directory, depth, pending listing]. The directories
+        # which will be popped next are submitted to the pool ahead of time,
+        # so by the time we pop them their listing is usually ready. At most
+        # self.threads listings are outstanding so a wide tree is not queued
+        # all at once.
+        stack = [[root, 1, None]]
+        outstanding = 0
+        while stack:
+            for item in reversed(stack):
+                if outstanding >= self.threads:
+                    break
+
+                if item[2] is None:
+                    item[2] = workers.apply_async(self._list, (item[0],))
+                    outstanding += 1
+
+            directory, depth, pending = stack.pop()
+            outstanding -= 1
+            children = pending.get()
+            if self.session:
+                self.session.report_progress("Listing %s", directory.filename)
+
+            subdirectories = self._subdirectories(children, depth, max_depth)
+            yield directory, children, subdirectories
+
+            stack.extend([x, depth + 1, None] for x in reversed(subdirectories))
+
+    def _walk_unordered(self, workers, root, max_depth):
+        results = queue.Queue()
+
+        def _list(directory, depth):
+            try:
+                results.put((directory, depth, self._list(directory), None))
+            except Exception as e:  # pylint: disable=broad-except
+                results.put((directory, depth, None, e))
+
+        workers.apply_async(_list, (root, 1))
+        outstanding = 1
+        while outstanding:
+            directory, depth, children, error = results.get()
+            outstanding -= 1
+            if error is not None:
+                raise error
+
+            if self.session:
+                self.session.report_progress("Listing %s", directory.filename)
+
+            subdirectories = self._subdirectories(children, depth, max_depth)
+            yield directory, children, subdirectories
+
+            for subdirectory in subdirectories:
+                workers.apply_async(_list, (subdirectory, depth + 1))
+                outstanding += 1
+
+
 def FileFactory(filename, session=None):
     """Return the correct FileInformation class from the filename.
 
@@ -32,8 +32,9 @@ import hashlib
 import itertools
 import platform
 import re
-import os
-import six
+import threading
+
+from multiprocessing import pool
 
 from rekall import plugin
 from rekall.plugins.response import common
@@ -42,6 +43,15 @@ from rekall_lib import utils
 
 BUFFER_SIZE = 10 * 1024 * 1024
 
+# Number of files hashed concurrently.
+HASH_THREADS = 4
+
+# Chunks smaller than this are not worth farming out to the digest threads.
+PARALLEL_DIGEST_THRESHOLD = 64 * 1024
+
+# Hashes of previously seen files keyed by (path, device, inode, size, mtime).
+HASH_CACHE = utils.FastStore(10000, lock=True)
+
 
 class IRFind(common.AbstractIRCommandPlugin):
     """List files recursively from a root path."""
@@ -59,14 +69,12 @@ class IRFind(common.AbstractIRCommandPlugin):
     ]
 
     def collect(self):
-        for root, dirs, files in os.walk(self.plugin_args.root):
-            for d in dirs + files:
-                full_path = os.path.join(root, d)
-                result = common.FileFactory(full_path, session=self.session)
-                if result:
-                    yield dict(Perms=result.st_mode,
-                               Size=result.st_size,
-                               Path=result)
+        walker = common.DirectoryWalker(session=self.session)
+        for _, children, _ in walker.walk(self.plugin_args.root):
+            for result in children:
+                yield dict(Perms=result.st_mode,
+                           Size=result.st_size,
+                           Path=result)
 
 
 class IRStat(common.AbstractIRCommandPlugin):
@@ -101,6 +109,98 @@ class Hash(object):
         return u"%s:%s" % (self.type, binascii.hexlify(self.value))
 
 
+class FileHasher(object):
+    """Calculates several digests over many files concurrently.
+
+    Files are hashed on a pool of threads so reading one file overlaps with
+    hashing others. Each thread reads into its own reused buffer, and when
+    more than one digest is requested the digests of a large chunk are
+    updated in parallel - hashlib releases the GIL while hashing so this
+    scales with the available cores.
+    """
+
+    def __init__(self, hashes, threads=HASH_THREADS, buffer_size=BUFFER_SIZE,
+                 cache=None):
+        self.hashes = list(hashes)
+        self.threads = threads
+        self.buffer_size = buffer_size
+        self.cache = cache
+        self._buffers = threading.local()
+        self._digest_pool = None
+        if len(self.hashes) > 1:
+            self._digest_pool = pool.ThreadPool(len(self.hashes))
+
+    def close(self):
+        if self._digest_pool:
+            self._digest_pool.terminate()
+            self._digest_pool = None
+
+    def _get_buffer(self):
+        try:
+            return self._buffers.buffer
+        except AttributeError:
+            self._buffers.buffer = bytearray(self.buffer_size)
+            return self._buffers.buffer
+
+    def _cache_key(self, file_info):
+        # The path is needed because scandir() reports a zero inode and
+        # device on Windows.
+        return (file_info.filename.os_path(), file_info.st_dev,
+                file_info.st_ino, file_info.st_size, file_info.st_mtime,
+                tuple(self.hashes))
+
+    def _update(self, hashers, data):
+        if self._digest_pool is None or len(data) < PARALLEL_DIGEST_THRESHOLD:
+            for hasher in hashers:
+                hasher.update(data)
+        else:
+            self._digest_pool.map(lambda hasher: hasher.update(data), hashers)
+
+    def hash_file(self, file_info):
+        """Returns a dict of hex digests for the file."""
+        if self.cache is not None:
+            key = self._cache_key(file_info)
+            try:
+                return dict(self.cache.Get(key))
+            except KeyError:
+                pass
+
+        hashers = dict((name, getattr(hashlib, name)()) for name in self.hashes)
+        fd = file_info.open()
+        if not fd:
+            return {}
+
+        buf = self._get_buffer()
+        view = memoryview(buf)
+        try:
+            while 1:
+                length = fd.readinto(buf)
+                if not length:
+                    break
+
+                self._update(list(hashers.values()), view[:length])
+        finally:
+            fd.close()
+
+        for key in list(hashers):
+            hashers[key] = hashers[key].hexdigest()
+
+        if self.cache is not None:
+            self.cache.Put(self._cache_key(file_info), dict(hashers))
+
+        return hashers
+
+    def hash_files(self, file_infos):
+        """Hash many files, yielding (file_info, hashes) in order."""
+        workers = pool.ThreadPool(self.threads)
+        try:
+            for result in workers.imap(
+                    lambda x: (x, self.hash_file(x)), file_infos):
+                yield result
+        finally:
+            workers.terminate()
+
+
 class IRHash(common.AbstractIRCommandPlugin):
     name = "hash"
 
@@ -109,7 +209,14 @@ class IRHash(common.AbstractIRCommandPlugin):
              help="Paths to hash."),
         dict(name="hash", type="ChoiceArray", default=["sha1"],
              choices=["md5", "sha1", "sha256"],
-             help="One or more hashes to calculate.")
+             help="One or more hashes to calculate."),
+        dict(name="recursive", type="Bool", default=False,
+             help="Hash all the files below any directories given."),
+        dict(name="threads", type="IntParser", default=HASH_THREADS,
+             help="Number of files to hash concurrently."),
+        dict(name="cache", type="Bool", default=False,
+             help="Do not rehash files with the same inode, size and mtime "
+             "as previously hashed files."),
     ]
 
     table_header = [
@@ -118,46 +225,47 @@ class IRHash(common.AbstractIRCommandPlugin):
     ]
 
     def calculate_hashes(self, hashes, file_info):
-        hashers = dict((name, getattr(hashlib, name)()) for name in hashes)
-        fd = file_info.open()
-        while 1:
-            data = fd.read(BUFFER_SIZE)
-            if not data:
-                break
+        hasher = FileHasher(hashes)
+        try:
+            return hasher.hash_file(file_info)
+        finally:
+            hasher.close()
 
-            for hasher in hashers.values():
-                hasher.update(data)
+    def _files_to_hash(self):
+        walker = common.DirectoryWalker(session=self.session)
+        for path in self.plugin_args.paths:
+            file_info = common.FileFactory(path, session=self.session)
+            if not file_info:
+                continue
 
-        for key in list(hashers):
-            hashers[key] = hashers[key].hexdigest()
+            if not file_info.st_mode.is_dir():
+                yield file_info
 
-        return hashers
+            elif self.plugin_args.recursive:
+                for _, children, _ in walker.walk(file_info):
+                    for child in children:
+                        if child.st_mode.is_regular():
+                            yield child
 
     def collect(self):
-        for path in self.plugin_args.paths:
-            file_info = common.FileFactory(path)
-            if not file_info.st_mode.is_dir():
-                yield dict(
-                    Hashes=self.calculate_hashes(
-                        self.plugin_args.hash, file_info),
-                    Path=file_info)
+        hasher = FileHasher(
+            self.plugin_args.hash, threads=self.plugin_args.threads,
+            cache=HASH_CACHE if self.plugin_args.cache else None)
+        try:
+            for file_info, hashes in hasher.hash_files(self._files_to_hash()):
+                yield dict(Hashes=hashes, Path=file_info)
+        finally:
+            hasher.close()
 
 
 class Component(object):
-    def __init__(self, session, component=None, cache=None):
+    def __init__(self, session, component=None):
         self.session = session
         self.component = component
-        self.component_cache = cache
-
-    def stat(self, path):
-        key = utils.SmartUnicode(path)
-        try:
-            return self.component_cache[key]
-        except KeyError:
-            stat = common.FileFactory(path)
-            self.component_cache.Put(key, stat)
 
-            return stat
+    def match(self, basename):
+        """Does this component match the name of a directory entry?"""
+        raise NotImplementedError()
 
     def __eq__(self, other):
         return str(self) == utils.SmartUnicode(other)
@@ -171,35 +279,8 @@ class Component(object):
 
 class LiteralComponent(Component):
 
-    def case_insensitive_filesystem(self):
-        if platform.system() == "Windows":
-            return True
-
-        return False
-
-    def filter(self, path):
-        # For case insensitive filesystems we can just try to open the
-        # component.
-        if self.case_insensitive_filesystem():
-            result_pathspec = path.add(self.component)
-            stat = self.stat(result_pathspec)
-            if stat:
-                return [stat.filename]
-            else:
-                return []
-
-        # Since we must match a case insensitve filename we need to
-        # list all the files and find the best match.
-        stat = common.FileFactory(path)
-        if not stat:
-            return []
-
-        children = {}
-        for x in stat.list_names():
-            children.setdefault(x.lower(), []).append(x)
-
-        return [stat.filename.add(x)
-                for x in children.get(self.component.lower(), [])]
+    def match(self, basename):
+        return basename.lower() == self.component.lower()
 
 
 class RegexComponent(Component):
@@ -207,16 +288,8 @@ class RegexComponent(Component):
         super(RegexComponent, self).__init__(*args, **kwargs)
         self.component_re = re.compile(self.component, re.I)
 
-    def filter(self, path):
-        stat = self.stat(path)
-        if not stat:
-            return
-
-        if stat.st_mode.is_dir() and not stat.st_mode.is_link():
-            self.session.report_progress("Searching %s", path)
-            for basename in stat.list_names():
-                if self.component_re.match(basename):
-                    yield stat.filename.add(basename)
+    def match(self, basename):
+        return self.component_re.match(basename) is not None
 
 
 class RecursiveComponent(RegexComponent):
@@ -224,32 +297,208 @@ class RecursiveComponent(RegexComponent):
         super(RecursiveComponent, self).__init__(**kwargs)
         self.depth = depth
 
-    def filter(self, path, depth=0):
-        self.session.report_progress("Recursing into %s", path)
 
-        # TODO: Deal with cross devices.
-        if depth >= self.depth:
+class GlobState(object):
+    """A state of the glob automaton.
+
+    Each state is a set of positions (glob index, component index, remaining
+    recursion depth) in the globs which a path may be at. For each distinct
+    component we precompute the positions it leads to, so matching an entry
+    checks every literal with a single lookup and each distinct regex once,
+    regardless of how many globs share it.
+    """
+
+    def __init__(self, matcher, positions):
+        self.positions = positions
+        self.terminal = False
+
+        # Maps lower case literals to their original name and the next
+        # positions.
+        self.literals = {}
+
+        # A list of (component, next positions).
+        self.regexes = []
+
+        regexes = {}
+        for glob, index, remaining in positions:
+            components = matcher.globs[glob]
+            if index == len(components):
+                self.terminal = True
+                continue
+
+            component = components[index]
+            if isinstance(component, RecursiveComponent):
+                # Recursion may not go deeper than this.
+                if remaining <= 0:
+                    continue
+                next_position = (glob, index, remaining - 1)
+            else:
+                next_position = (glob, index + 1, None)
+
+            if isinstance(component, LiteralComponent):
+                _, next_positions = self.literals.setdefault(
+                    component.component.lower(),
+                    (component.component, set()))
+                next_positions.add(next_position)
+            else:
+                regexes.setdefault(component, set()).add(next_position)
+
+        self.regexes = list(regexes.items())
+
+        # If we only need to match literals we do not need to list the
+        # directory on case insensitive filesystems.
+        self.literal_only = not self.regexes
+        self.final = not self.regexes and not self.literals
+
+        self._matcher = matcher
+        self._transitions = {}
+
+    def next_state(self, basename):
+        """Returns the state after matching the entry, or None."""
+        positions = set()
+        literal = self.literals.get(basename.lower())
+        if literal:
+            positions.update(literal[1])
+
+        for component, next_positions in self.regexes:
+            if component.match(basename):
+                positions.update(next_positions)
+
+        if positions:
+            return self._matcher.get_state(positions)
+
+
+class GlobMatcher(object):
+    """Matches a set of globs in a single pass over the filesystem.
+
+    The globs are compiled into an automaton whose states are built lazily as
+    they are reached. Each directory is listed at most once no matter how
+    many globs refer to it, and recursive components are just states which
+    loop on themselves, so their subtrees are never walked again. The
+    directories are listed on the pool of a DirectoryWalker, which is pruned
+    to the directories the automaton may still match in.
+    """
+
+    def __init__(self, session, globs):
+        """Args:
+          globs: A list of lists of components, one per glob.
+        """
+        self.session = session
+        self.globs = [x for x in globs if x]
+        self.case_insensitive = platform.system() == "Windows"
+        self._states = {}
+
+        # The paths whose listing (or existence) decided the matches. If
+        # none of these change, matching again gives the same result.
+        self.dependencies = set()
+
+    def _closure(self, positions):
+        """Add the positions reachable without matching anything.
+
+        A recursive component also matches the directory it starts from, so
+        the next component may be matched right away.
+        """
+        result = set()
+        pending = list(positions)
+        while pending:
+            glob, index, remaining = pending.pop()
+            components = self.globs[glob]
+            if (index < len(components) and
+                    isinstance(components[index], RecursiveComponent)):
+                if remaining is None:
+                    remaining = components[index].depth
+                    if remaining <= 0:
+                        continue
+
+                pending.append((glob, index + 1, None))
+
+            position = (glob, index, remaining)
+            if position not in result:
+                result.add(position)
+
+        return frozenset(result)
+
+    def get_state(self, positions):
+        positions = self._closure(positions)
+        try:
+            return self._states[positions]
+        except KeyError:
+            result = self._states[positions] = GlobState(self, positions)
+            return result
+
+    def match(self, root):
+        """Yields FileInformation for all paths below root that match."""
+        if not self.globs:
             return
 
-        stat = self.stat(path)
+        self.dependencies.add(root.os_path())
+        stat = common.FileFactory(root, session=self.session)
         if not stat:
             return
 
-        # Do not follow symlinks.
-        if stat.st_mode.is_dir() and not stat.st_mode.is_link():
-            # The top level counts as a hit, so that e.g. /**/*.txt
-            # matches /foo.txt as well.
-            if depth == 0:
-                yield stat.filename
+        state = self.get_state(
+            [(i, 0, None) for i in range(len(self.globs))])
+        if state.terminal:
+            yield stat
+
+        if state.final:
+            return
+
+        walker = _GlobWalker(self)
+        walker.states[stat.filename.os_path()] = state
+        for directory, children, subdirectories in walker.walk(stat):
+            state = walker.states.pop(directory.filename.os_path())
+            next_states = {}
+            for child in children:
+                child_state = state.next_state(child.filename.basename)
+                if child_state:
+                    if child_state.terminal:
+                        yield child
 
-            for basename in stat.list_names():
-                if (self.component_re.match(basename) and
-                    not stat.st_mode.is_link()):
-                    subdir = stat.filename.add(basename)
-                    yield subdir
+                    next_states[id(child)] = child_state
+
+            # Only walk into the directories which may still match.
+            pruned = []
+            for subdirectory in subdirectories:
+                child_state = next_states.get(id(subdirectory))
+                if child_state and not child_state.final:
+                    walker.states[subdirectory.filename.os_path()] = (
+                        child_state)
+                    pruned.append(subdirectory)
+
+            subdirectories[:] = pruned
+
+
+class _GlobWalker(common.DirectoryWalker):
+    """Walks the directories a GlobMatcher needs on the walker's pool.
+
+    The matcher records the state each directory is reached in before the
+    walker lists it, so the listing can skip what the state does not need.
+    """
 
-                    for subitem in self.filter(subdir, depth+1):
-                        yield subitem
+    def __init__(self, matcher):
+        super(_GlobWalker, self).__init__(session=matcher.session)
+        self.matcher = matcher
+
+        # Maps the os path of the directories to walk to their GlobState.
+        self.states = {}
+
+    def _list(self, directory):
+        state = self.states[directory.filename.os_path()]
+        if state.literal_only and self.matcher.case_insensitive:
+            # Just try to open each literal.
+            children = []
+            for name, _ in state.literals.values():
+                child_path = directory.filename.add(name)
+                self.matcher.dependencies.add(child_path.os_path())
+                child = common.FileFactory(child_path, session=self.session)
+                if child:
+                    children.append(child)
+
+            return sorted(children, key=lambda x: x.filename.basename)
+
+        self.matcher.dependencies.add(directory.filename.os_path())
+        return super(_GlobWalker, self)._list(directory)
 
 
 class IRGlob(common.AbstractIRCommandPlugin):
@@ -292,7 +541,6 @@ class IRGlob(common.AbstractIRCommandPlugin):
 
     def __init__(self, *args, **kwargs):
         super(IRGlob, self).__init__(*args, **kwargs)
-        self.component_cache = utils.FastStore(50)
 
         # Default path seperator is platform dependent.
         if not self.plugin_args.path_sep:
@@ -303,6 +551,9 @@ class IRGlob(common.AbstractIRCommandPlugin):
         if self.plugin_args.root is None:
             self.plugin_args.root = self.plugin_args.path_sep
 
+        # The paths the last glob depended on (see GlobMatcher).
+        self.dependencies = set()
+
     def _interpolate_grouping(self, pattern):
         # Take the pattern and split it into components around grouping
         # patterns. Expand each grouping pattern to a set.
@@ -394,75 +645,45 @@ class IRGlob(common.AbstractIRCommandPlugin):
                 component = RecursiveComponent(
                     session=self.session,
                     component=fnmatch.translate(path_component),
-                    cache=self.component_cache,
                     depth=depth)
 
             elif self.GLOB_MAGIC_CHECK.search(path_component):
                 component = RegexComponent(
                     session=self.session,
-                    cache=self.component_cache,
                     component=fnmatch.translate(path_component))
 
             else:
                 component = LiteralComponent(
                     session=self.session,
-                    cache=self.component_cache,
                     component=path_component)
 
             components.append(component)
 
         return components
 
-    def _filter(self, node, path):
-        """Path is the pathspec of the path we begin evaluation with."""
-        self.session.report_progress("Checking %s", path)
-        for component, child_node in six.iteritems(node):
-            # Terminal node - yield the result.
-            if not child_node:
-                for subpath in component.filter(path):
-                    yield subpath
-
-            else:
-                # Non - terminal node, walk the subnode recursively.
-                for matching_path in component.filter(path):
-                    for subpath in self._filter(child_node, matching_path):
-                        yield subpath
-
-    def make_component_tree(self, globs):
+    def make_matcher(self, globs):
+        """Compile all the globs into a single matcher."""
         expanded_globs = []
         for glob in globs:
             expanded_globs.extend(self._interpolate_grouping(glob))
 
-        component_tree = {}
-        for glob in expanded_globs:
-            node = component_tree
-            for component in self.convert_glob_into_path_components(glob):
-                node = node.setdefault(component, {})
-
-        return component_tree
+        return GlobMatcher(self.session, [
+            self.convert_glob_into_path_components(glob)
+            for glob in expanded_globs])
 
     def collect_globs(self, globs):
-        component_tree = self.make_component_tree(globs)
+        matcher = self.make_matcher(globs)
+        self.dependencies = matcher.dependencies
         root = common.FileSpec(self.plugin_args.root,
                                path_sep=self.plugin_args.path_sep)
-        for path in self._filter(component_tree, root):
-            yield common.FileFactory(path, session=self.session)
+        for stat in matcher.match(root):
+            yield stat
 
     def collect(self):
         for x in self.collect_globs(self.plugin_args.globs):
             yield dict(path=x)
 
 
-def print_component_tree(tree, depth=""):
-    """This is used for debugging the component_tree."""
-    if not tree:
-        return
-
-    for k, v in tree.items():
-        print("%s %s:" % (depth, k))
-        print_component_tree(v, depth + " ")
-
-
 
 class IRDump(IRGlob):
     """Hexdump files from disk."""
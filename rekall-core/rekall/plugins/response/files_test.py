@@ -1,5 +1,8 @@
 from builtins import str
+import fnmatch
+import hashlib
 import os
+import tempfile
 import mock
 
 from rekall import testlib
@@ -33,57 +36,169 @@ class TestGlob(testlib.RekallBaseUnitTestCase):
                               "RegexComponent:.*\\.exe\\Z(?ms)"])
 
     def testComponents(self):
-        self.component_cache = utils.FastStore(50)
         literal = files.LiteralComponent(session=self.session,
-                                         cache=self.component_cache,
                                          component="passwd")
-
-        path_spec = common.FileSpec("/etc")
-        result = list(literal.filter(path_spec))
-        self.assertTrue("/etc/passwd" in [utils.SmartUnicode(x) for x in result])
+        self.assertTrue(literal.match("passwd"))
+        self.assertTrue(literal.match("PASSWD"))
+        self.assertFalse(literal.match("passwd-"))
 
         regex = files.RegexComponent(session=self.session,
-                                     cache=self.component_cache,
-                                     component="pass.+")
-
-        result = list(regex.filter(path_spec))
-        self.assertTrue("/etc/passwd" in [str(x) for x in result])
+                                     component=fnmatch.translate("pass*"))
+        self.assertTrue(regex.match("passwd"))
+        self.assertFalse(regex.match("shadow"))
 
-        recursive = files.RecursiveComponent(session=self.session,
-                                             cache=self.component_cache,
-                                             component=".+")
-
-        result = list(recursive.filter(path_spec))
-        self.assertTrue("/etc/ssh/ssh_config" in [str(x) for x in result])
+        recursive = files.RecursiveComponent(
+            session=self.session, component=fnmatch.translate("*"), depth=2)
+        self.assertTrue(recursive.match("ssh"))
+        self.assertEqual(recursive.depth, 2)
 
     def _touch(self, path):
         with open(path, "wb") as fd:
-            fd.write("")
+            fd.write(b"")
 
     def _make_temp_directory(self):
-        self._touch(os.path.join(self.temp_directory, "boo.txt"))
-        os.makedirs(os.path.join(self.temp_directory, "foo"))
-        self._touch(os.path.join(self.temp_directory, "foo/boo2.txt"))
+        """Returns a new directory with some files for this test."""
+        # The class shares temp_directory, so each test uses its own tree.
+        temp_directory = tempfile.mkdtemp(dir=self.temp_directory)
+        self._touch(os.path.join(temp_directory, "boo.txt"))
+        os.makedirs(os.path.join(temp_directory, "foo"))
+        self._touch(os.path.join(temp_directory, "foo/boo2.txt"))
 
         # Drop a symlink to / - if we follow links this will crash.
-        os.symlink("/", os.path.join(self.temp_directory, "link"))
+        os.symlink("/", os.path.join(temp_directory, "link"))
+
+        return temp_directory
 
     def testGlob(self):
-        self._make_temp_directory()
+        temp_directory = self._make_temp_directory()
         glob_plugin = files.IRGlob(session=self.session, globs=[
-            self.temp_directory + "/*.txt"])
+            temp_directory + "/*.txt"])
         result = list(glob_plugin.collect())
         self.assertTrue("boo.txt" in [os.path.basename(str(x["path"].filename))
                                       for x in result])
         self.assertEqual(len(result), 1)
 
         glob_plugin = files.IRGlob(session=self.session, globs=[
-            self.temp_directory + "/**/*.txt"])
+            temp_directory + "/**/*.txt"])
         result = list(glob_plugin.collect())
         paths = [os.path.basename(str(x["path"].filename))
                  for x in result]
         self.assertEqual(["boo.txt", "boo2.txt"], paths)
 
+    def testGlobMatcher(self):
+        temp_directory = self._make_temp_directory()
+        glob_plugin = files.IRGlob(session=self.session, globs=[
+            temp_directory + "/**/*.txt",
+            temp_directory + "/foo/*",
+            temp_directory + "/*/boo2.txt"])
+
+        with mock.patch.object(common, "list_directory",
+                               wraps=common.list_directory) as listing:
+            paths = [str(x["path"].filename)[len(temp_directory):]
+                     for x in glob_plugin.collect()]
+
+        # Every match is reported once.
+        self.assertEqual(paths, ["/boo.txt", "/foo/boo2.txt"])
+
+        # Each directory is only listed once for all the globs.
+        listed = [str(x[0][0]) for x in listing.call_args_list]
+        self.assertEqual(len(listed), len(set(listed)))
+
+    def testDirectoryWalker(self):
+        temp_directory = self._make_temp_directory()
+        walker = common.DirectoryWalker(session=self.session)
+        result = [(os.path.basename(str(directory.filename)),
+                   [x.filename.basename for x in children],
+                   [x.filename.basename for x in subdirectories])
+                  for directory, children, subdirectories in walker.walk(
+                      temp_directory)]
+
+        # Symlinks are never followed.
+        self.assertEqual(result, [
+            (os.path.basename(temp_directory),
+             ["boo.txt", "foo", "link"], ["foo"]),
+            ("foo", ["boo2.txt"], [])])
+
+        # Only the root is listed.
+        result = list(walker.walk(temp_directory, max_depth=1))
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0][2], [])
+
+    def testDirectoryWalkerPrefetch(self):
+        temp_directory = tempfile.mkdtemp(dir=self.temp_directory)
+        for i in range(20):
+            os.makedirs(os.path.join(temp_directory, "dir%02d" % i))
+
+        walker = common.DirectoryWalker(session=self.session, threads=2)
+        with mock.patch.object(walker, "_list", wraps=walker._list) as listing:
+            walk = walker.walk(temp_directory)
+            next(walk)
+            next(walk)
+
+            # Only a few listings are submitted ahead of the walk.
+            self.assertLessEqual(listing.call_count, 1 + walker.threads)
+
+            # But the walk still visits everything.
+            self.assertEqual(len(list(walk)), 19)
+
+
+    def testFileHasher(self):
+        path = os.path.join(self.temp_directory, "data.bin")
+        data = b"hello world" * 100000
+        with open(path, "wb") as fd:
+            fd.write(data)
+
+        cache = utils.FastStore(10)
+        hasher = files.FileHasher(["md5", "sha1"], buffer_size=4096,
+                                  cache=cache)
+        try:
+            file_info = common.FileFactory(path)
+            for _ in range(2):
+                hashes = hasher.hash_file(file_info)
+                self.assertEqual(hashes["md5"], hashlib.md5(data).hexdigest())
+                self.assertEqual(hashes["sha1"],
+                                 hashlib.sha1(data).hexdigest())
+
+            # The second call was served from the cache.
+            self.assertEqual(cache.hits, 1)
+        finally:
+            hasher.close()
+
+        # Chunks above PARALLEL_DIGEST_THRESHOLD update the digests on the
+        # digest pool.
+        hasher = files.FileHasher(
+            ["md5", "sha1", "sha256"],
+            buffer_size=files.PARALLEL_DIGEST_THRESHOLD * 4)
+        try:
+            hashes = hasher.hash_file(common.FileFactory(path))
+            self.assertEqual(hashes["md5"], hashlib.md5(data).hexdigest())
+            self.assertEqual(hashes["sha1"], hashlib.sha1(data).hexdigest())
+            self.assertEqual(hashes["sha256"],
+                             hashlib.sha256(data).hexdigest())
+        finally:
+            hasher.close()
+
+    def testFileHasherCacheKey(self):
+        temp_directory = tempfile.mkdtemp(dir=self.temp_directory)
+        for name, data in (("a", b"aaaa"), ("b", b"bbbb")):
+            with open(os.path.join(temp_directory, name), "wb") as fd:
+                fd.write(data)
+
+        # scandir() on Windows gives no inode or device.
+        file_infos = [common.FileFactory(os.path.join(temp_directory, x))
+                      for x in ("a", "b")]
+        for file_info in file_infos:
+            file_info.st_ino = file_info.st_dev = 0
+            file_info.st_mtime = 0
+
+        hasher = files.FileHasher(["md5"], cache=utils.FastStore(10))
+        try:
+            self.assertEqual(
+                [hasher.hash_file(x)["md5"] for x in file_infos],
+                [hashlib.md5(b"aaaa").hexdigest(),
+                 hashlib.md5(b"bbbb").hexdigest()])
+        finally:
+            hasher.close()
 
 if __name__ == "__main__":
     testlib.main()
@@ -37,6 +37,8 @@ import io
 import sys
 import zipfile
 
+from multiprocessing import pool
+
 import yaml
 
 from artifacts import definitions
@@ -70,12 +72,28 @@ class ArtifactResult(object):
     def merge(self, other):
         self.results.extend(other)
 
+    def copy(self, artifact_name=None):
+        """A copy of this result, sharing the same rows."""
+        result = ArtifactResult(
+            artifact_name=artifact_name or self.artifact_name,
+            result_type=self.result_type, fields=self.fields)
+        result.results = self.results
+        return result
+
     def as_dict(self):
         return dict(fields=self.fields,
                     results=self.results,
                     artifact_name=self.artifact_name,
                     result_type=self.result_type)
 
+    @classmethod
+    def from_dict(cls, data):
+        result = cls(artifact_name=data.get("artifact_name"),
+                     result_type=data.get("result_type"),
+                     fields=data.get("fields"))
+        result.results = data.get("results", [])
+        return result
+
 
 
 class BaseArtifactResultWriter(with_metaclass(registry.MetaclassRegistry, object)):
@@ -324,6 +342,9 @@ class SourceType(_FieldDefinitionValidator):
              default=list(definitions.SUPPORTED_OS)),
     ]
 
+    # Can this source be applied concurrently with other sources?
+    thread_safe = False
+
     def __init__(self, source_definition, artifact=None):
         attributes = source_definition["attributes"]
         # The artifact that owns us.
@@ -337,6 +358,23 @@ class SourceType(_FieldDefinitionValidator):
         """Indicates if the source is applicable to the environment."""
         return True
 
+    def cache_key(self):
+        """A key identifying what this source collects.
+
+        Sources in different artifacts with the same key produce the same
+        results, so they only need to be applied once.
+        """
+        return u"%s:%s" % (self.type_indicator, json.dumps(
+            self.source_definition.get("attributes"), sort_keys=True))
+
+    def get_dependencies(self, results):
+        """Returns the files the results depend on.
+
+        If the results can be reused as long as these files do not change,
+        return a list of paths, otherwise None.
+        """
+        return None
+
     def apply(self, artifact_name=None, fields=None, result_type=None, **_):
         """Generate ArtifactResult instances."""
         return ArtifactResult(artifact_name=artifact_name,
@@ -455,13 +493,29 @@ class FileSourceType(LiveModeSourceMixin, SourceType):
         dict(name="filename", type="unicode"),
     ]
 
+    thread_safe = True
+
+    # The paths the glob listed or looked up in the last apply().
+    listed_paths = ()
+
+    def get_dependencies(self, results):
+        """The results depend on the matched files and every directory the
+        glob listed, so new matches anywhere are noticed.
+        """
+        dependencies = set(self.listed_paths)
+        for result in results:
+            for row in result.results:
+                dependencies.add(row["filename"])
+
+        return sorted(dependencies)
+
     def apply(self, session=None, **kwargs):
         result = super(FileSourceType, self).apply(
             fields=self._FIELDS, result_type="file_information", **kwargs)
 
-        for hits in session.plugins.glob(
-                self.paths, path_sep=self.separator,
-                root=self.separator).collect():
+        glob_plugin = session.plugins.glob(
+            self.paths, path_sep=self.separator, root=self.separator)
+        for hits in glob_plugin.collect():
             # Hits are FileInformation objects, and we just pick some of the
             # important fields to report.
             info = hits["path"]
@@ -473,6 +527,9 @@ class FileSourceType(LiveModeSourceMixin, SourceType):
 
             result.add_result(**row)
 
+        # The glob only knows what it listed once it is done.
+        self.listed_paths = glob_plugin.dependencies
+
         yield result
 
 
@@ -483,6 +540,10 @@ class ArtifactGroupSourceType(SourceType):
              default=definitions.SUPPORTED_OS),
     ]
 
+    def cache_key(self):
+        # Groups are expanded into their artifacts rather than applied.
+        return None
+
     def apply(self, collector=None, **_):
         for name in self.names:
             for result in collector.collect_artifact(name):
@@ -562,6 +623,8 @@ class RegistryKeySourceType(LiveModeSourceMixin, SourceType):
         dict(name="value_type", type="str"),
     ]
 
+    thread_safe = True
+
     def apply(self, session=None, **kwargs):
         result = super(RegistryKeySourceType, self).apply(
             fields=self._FIELDS, result_type="registry_key", **kwargs)
@@ -613,6 +676,8 @@ class RegistryValueSourceType(LiveModeSourceMixin, SourceType):
         dict(name="value", type="str"),
     ]
 
+    thread_safe = True
+
     def apply(self, session=None, **kwargs):
         result = super(RegistryValueSourceType, self).apply(
             fields=self._FIELDS, result_type="registry_value", **kwargs)
@@ -796,6 +861,145 @@ class ArtifactProfile(obj.Profile):
                 pass
 
 
+class CollectionPlanner(object):
+    """Plans the collection of many artifacts together.
+
+    Many artifacts share the same sources (e.g. the same globs or registry
+    keys). The planner expands the selected artifacts into a list of steps,
+    applies each distinct source only once and starts all thread safe sources
+    concurrently. Results are then produced in the same order as collecting
+    the artifacts one at a time.
+
+    If results from a previous run are given, sources whose dependent files
+    have not changed (size and mtime) are not applied again.
+    """
+
+    def __init__(self, collector, threads=1, previous_results=None):
+        self.collector = collector
+        self.session = collector.session
+        self.previous_results = previous_results or {}
+
+        # Maps cache keys to the results of this run.
+        self.results = {}
+        self._pending = {}
+        self._pool = None
+        if threads > 1:
+            self._pool = pool.ThreadPool(threads)
+
+    def plan(self, artifact_names):
+        """Expand the artifacts into a list of steps.
+
+        Each step is a tuple of (definition, source) where source is None for
+        the start of a new artifact.
+        """
+        steps = []
+        for artifact_name in artifact_names:
+            self._plan_artifact(artifact_name, steps)
+
+        return steps
+
+    def _plan_artifact(self, artifact_name, steps):
+        definition = self.collector.get_definition(artifact_name)
+        if definition is None:
+            return
+
+        steps.append((definition, None))
+        for source in definition.sources:
+            # This source is not for us.
+            if not source.is_active(session=self.session):
+                continue
+
+            if isinstance(source, ArtifactGroupSourceType):
+                for name in source.names:
+                    self._plan_artifact(name, steps)
+            else:
+                steps.append((definition, source))
+
+    def _file_state(self, paths):
+        result = {}
+        for path in paths:
+            try:
+                s = os.stat(path)
+                result[path] = [s.st_size, s.st_mtime]
+            except (IOError, OSError):
+                result[path] = None
+
+        return result
+
+    def _apply_source(self, key, source):
+        """Apply the source, or reuse the results from a previous run."""
+        # Results without any dependencies can not be checked, so they are
+        # never reused.
+        previous = self.previous_results.get(key)
+        if previous and previous["state"] and self._file_state(
+                previous["state"]) == previous["state"]:
+            self.session.logging.debug("Reusing results for %s", key)
+            self.results[key] = previous
+            return [ArtifactResult.from_dict(x) for x in previous["results"]]
+
+        results = list(source.apply(
+            session=self.session, collector=self.collector))
+
+        # Only ArtifactResults can be stored in the cache file.
+        dependencies = None
+        if all(isinstance(x, ArtifactResult) for x in results):
+            dependencies = source.get_dependencies(results)
+
+        if dependencies is not None:
+            self.results[key] = dict(
+                results=[x.as_dict() for x in results],
+                state=self._file_state(dependencies))
+
+        return results
+
+    def _start(self, source):
+        key = source.cache_key()
+        if key not in self._pending:
+            if self._pool and source.thread_safe:
+                self._pending[key] = self._pool.apply_async(
+                    self._apply_source, (key, source))
+            else:
+                self._pending[key] = None
+
+    def _get_results(self, source):
+        key = source.cache_key()
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._apply_source(key, source)
+            self._pending[key] = pending
+
+        elif isinstance(pending, pool.AsyncResult):
+            pending = pending.get()
+            self._pending[key] = pending
+
+        return pending
+
+    def execute(self, steps):
+        """Yield the rows for the planned steps."""
+        for _, source in steps:
+            if source is not None:
+                self._start(source)
+
+        for definition, source in steps:
+            if source is None:
+                yield dict(divider="Artifact: %s" % definition.name)
+                continue
+
+            for result in self._get_results(source):
+                # Results may be shared by several artifacts.
+                if isinstance(result, ArtifactResult):
+                    yield dict(
+                        result=result.copy(artifact_name=definition.name))
+                elif isinstance(result, dict):
+                    yield result
+                else:
+                    yield dict(result=result)
+
+    def close(self):
+        if self._pool:
+            self._pool.terminate()
+
+
 class ArtifactsCollector(plugin.TypedProfileCommand,
                          plugin.Command):
     """Collects artifacts."""
@@ -827,6 +1031,13 @@ class ArtifactsCollector(plugin.TypedProfileCommand,
 
         dict(name="output_path",
              help="Path suitable for dumping files."),
+
+        dict(name="threads", type="IntParser", default=4,
+             help="Number of sources to collect concurrently."),
+
+        dict(name="cache_file",
+             help="Reuse unchanged results from a previous run stored in "
+             "this file, and store the results of this run in it."),
     ]
 
     table_header = [
@@ -894,7 +1105,12 @@ class ArtifactsCollector(plugin.TypedProfileCommand,
         # True always.
         return True
 
-    def collect_artifact(self, artifact_name):
+    def get_definition(self, artifact_name):
+        """Returns the definition of an artifact we need to collect.
+
+        Returns None if the artifact was already collected or does not apply
+        to us.
+        """
         if artifact_name in self.seen:
             return
 
@@ -918,6 +1134,13 @@ class ArtifactsCollector(plugin.TypedProfileCommand,
         if not self._evaluate_conditions(definition.conditions):
             return
 
+        return definition
+
+    def collect_artifact(self, artifact_name):
+        definition = self.get_definition(artifact_name)
+        if definition is None:
+            return
+
         yield dict(divider="Artifact: %s" % definition.name)
 
         for source in definition.sources:
@@ -957,12 +1180,34 @@ class ArtifactsCollector(plugin.TypedProfileCommand,
             for x in self._collect():
                 yield x
 
+    def _load_previous_results(self):
+        try:
+            with open(self.plugin_args.cache_file) as fd:
+                return json.loads(fd.read())
+        except (IOError, OSError, ValueError):
+            return {}
+
     def _collect(self, writer=None):
-        for artifact_name in self.plugin_args.artifacts:
-            for hit in self.collect_artifact(artifact_name):
+        previous_results = {}
+        if self.plugin_args.cache_file:
+            previous_results = self._load_previous_results()
+
+        planner = CollectionPlanner(
+            self, threads=self.plugin_args.threads,
+            previous_results=previous_results)
+        try:
+            for hit in planner.execute(
+                    planner.plan(self.plugin_args.artifacts)):
                 if "result" in hit and writer:
                     writer.write_result(hit["result"])
                 yield hit
+        finally:
+            planner.close()
+
+        if self.plugin_args.cache_file:
+            previous_results.update(planner.results)
+            with open(self.plugin_args.cache_file, "w") as fd:
+                fd.write(json.dumps(previous_results, sort_keys=True))
 
 class ArtifactsView(plugin.TypedProfileCommand,
                     plugin.Command):
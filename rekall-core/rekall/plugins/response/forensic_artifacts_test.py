@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+
+from rekall import testlib
+from rekall.plugins.response import files
+from rekall.plugins.response import forensic_artifacts
+
+
+class _GlobSession(object):
+    """A session whose glob plugin works without live mode."""
+
+    def __init__(self, session):
+        self.session = session
+        self.logging = session.logging
+        self.plugins = self
+
+    def glob(self, globs, **kwargs):
+        return files.IRGlob(session=self.session, globs=globs, **kwargs)
+
+
+class _Collector(object):
+    def __init__(self, session):
+        self.session = session
+
+
+class TestCollectionPlanner(testlib.RekallBaseUnitTestCase):
+    """Test reusing the results of a previous collection."""
+
+    def setUp(self):
+        super(TestCollectionPlanner, self).setUp()
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "a"))
+        self._touch(os.path.join(self.root, "a", "foo.txt"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(TestCollectionPlanner, self).tearDown()
+
+    def _touch(self, path):
+        with open(path, "wb") as fd:
+            fd.write(b"")
+
+    def _collect(self, previous_results=None):
+        source = forensic_artifacts.FileSourceType(dict(
+            type="FILE", attributes=dict(
+                paths=[self.root + "/*/*.txt"])))
+        planner = forensic_artifacts.CollectionPlanner(
+            _Collector(_GlobSession(self.session)),
+            previous_results=previous_results)
+
+        results = planner._apply_source(source.cache_key(), source)
+        filenames = sorted(os.path.basename(row["filename"])
+                           for result in results
+                           for row in result.results)
+
+        return filenames, planner.results
+
+    def testNewMatchInvalidatesCache(self):
+        filenames, cache = self._collect()
+        self.assertEqual(filenames, ["foo.txt"])
+
+        # Every directory the glob listed is a dependency.
+        state = list(cache.values())[0]["state"]
+        self.assertTrue(os.path.join(self.root, "a") in state)
+
+        # Nothing changed so the previous results are reused.
+        filenames, _ = self._collect(previous_results=cache)
+        self.assertEqual(filenames, ["foo.txt"])
+
+        # A new matching file changes the directory it is in.
+        directory = os.path.join(self.root, "a")
+        self._touch(os.path.join(directory, "bar.txt"))
+        mtime = os.stat(directory).st_mtime + 10
+        os.utime(directory, (mtime, mtime))
+
+        filenames, _ = self._collect(previous_results=cache)
+        self.assertEqual(filenames, ["bar.txt", "foo.txt"])
+
+
+if __name__ == "__main__":
+    testlib.main()
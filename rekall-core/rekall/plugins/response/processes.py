@@ -1,6 +1,11 @@
 """Rekall plugins for displaying processes in live triaging."""
+import threading
+import time
+
+from multiprocessing import pool
 
 import psutil
+from six.moves import queue
 from efilter.protocols import structured
 
 from rekall_lib import utils
@@ -239,10 +244,129 @@ class APISetProcessContext(core.SetProcessContextMixin,
 
 
 class APIProcessScanner(APIProcessFilter):
-    """Scanner for scanning processes using the ReadProcessMemory() API."""
+    """Scanner for scanning processes using the ReadProcessMemory() API.
+
+    With more than one thread, processes are scanned concurrently. Each worker
+    opens its own process address space and holds a single scan buffer at a
+    time (a new buffer is read for each block, there is no shared buffer
+    pool), so memory use grows with the number of threads. The workers only
+    scan: progress and log messages are passed to the consuming thread.
+    """
 
     __abstract = True
 
+    __args = [
+        dict(name="threads", default=1, type="IntParser",
+             help="Number of processes to scan concurrently."),
+
+        dict(name="process_timeout", default=0, type="IntParser",
+             help="Stop scanning a process after this many seconds "
+             "(0 for no limit)."),
+    ]
+
+    # Sentinel placed on the results queue when a worker is done.
+    _DONE = object()
+
+    # Marks log messages on the results queue.
+    _LOG = object()
+
+    def _put(self, results, item, stop):
+        """Put the item on the queue unless we are asked to stop."""
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _log(self, results, stop, level, message, *args):
+        """Have the consuming thread log the message."""
+        return self._put(results, (self._LOG, level, message, args), stop)
+
+    def _scan_process(self, task, scan_run, results, stop):
+        """Scan all the memory of a process in a worker thread."""
+        deadline = None
+        if self.plugin_args.process_timeout:
+            deadline = time.time() + self.plugin_args.process_timeout
+
+        comment = "%s (%s)" % (task.name, task.pid)
+        try:
+            process_address_space = task.get_process_address_space()
+            for _, _, run in process_address_space.runs:
+                if deadline is not None and time.time() > deadline:
+                    self._log(results, stop, "warn",
+                              "Timed out scanning %s (%s)",
+                              task.name, task.pid)
+                    break
+
+                vad = run.data["vad"]
+                if not self._log(results, stop, "info",
+                                 "Scanning %s (%s) in: %s [%#x-%#x]",
+                                 task.name, task.pid, vad.filename or "",
+                                 vad.start, vad.end):
+                    return
+
+                run.data["comment"] = comment
+                run.data["task"] = task
+                for result in scan_run(run, deadline=deadline):
+                    if not self._put(results, result, stop):
+                        return
+
+        except Exception as e:
+            self._log(results, stop, "error", "Unable to scan %s (%s): %s",
+                      task.name, task.pid, e)
+
+        finally:
+            self._put(results, self._DONE, stop)
+
+    def scan_processes(self, scan_run):
+        """Scan processes in parallel, merging the results.
+
+        Args:
+          scan_run: A callable which receives a run and a deadline and yields
+            results. The first element of each result must be the run.
+
+        Yields the results of all the processes. The process context is
+        switched to the process which produced each result. Progress is
+        reported from here as the workers start scanning each run.
+        """
+        tasks = list(self.filter_processes())
+        results = queue.Queue(max(1, self.plugin_args.threads) * 10)
+        stop = threading.Event()
+        workers = pool.ThreadPool(max(1, self.plugin_args.threads))
+        try:
+            for task in tasks:
+                workers.apply_async(
+                    self._scan_process, (task, scan_run, results, stop))
+
+            with self.session.plugins.cc() as cc:
+                current_task = None
+                remaining = len(tasks)
+                while remaining:
+                    result = results.get()
+                    if result is self._DONE:
+                        remaining -= 1
+                        continue
+
+                    if result[0] is self._LOG:
+                        _, level, message, args = result
+                        getattr(self.session.logging, level)(message, *args)
+                        self.session.report_progress(message, *args)
+                        continue
+
+                    task = result[0].data["task"]
+                    if task is not current_task:
+                        cc.SwitchProcessContext(task)
+                        current_task = task
+
+                    yield result
+
+        finally:
+            stop.set()
+            workers.terminate()
+
     def generate_memory_ranges(self):
         with self.session.plugins.cc() as cc:
             for task in self.filter_processes():
@@ -268,3 +392,11 @@ class APIProcessScanner(APIProcessFilter):
 class ProcessYaraScanner(yarascanner.YaraScanMixin, APIProcessScanner):
     """Yara scan process memory using the ReadProcessMemory() API."""
     name = "yarascan"
+
+    # The hits are generated in worker threads, scan_processes() reports the
+    # progress instead.
+    report_progress = False
+
+    def generate_matches(self):
+        # Even with a single thread this applies the process_timeout.
+        return self.scan_processes(self.generate_run_hits)
@@ -25,10 +25,12 @@ from builtins import str
 from builtins import zip
 from past.builtins import basestring
 from builtins import object
+import array
 import binascii
 import capstone
 import re
 import struct
+import weakref
 
 from capstone import x86_const
 from rekall import addrspace
@@ -270,32 +272,205 @@ class CapstoneInstruction(Instruction):
 
 
 class Capstone(Disassembler):
+    # Capstone engines are expensive to create so we share them between all
+    # disassemblers of the same mode.
+    ENGINES = {}
+
     def __init__(self, mode, **kwargs):
         super(Capstone, self).__init__(mode, **kwargs)
-
-        if self.mode == "I386":
-            self.cs = capstone.Cs(capstone.CS_ARCH_X86, capstone.CS_MODE_32)
-        elif self.mode == "AMD64":
-            self.cs = capstone.Cs(capstone.CS_ARCH_X86, capstone.CS_MODE_64)
-        elif self.mode == "MIPS":
-            self.cs = capstone.Cs(capstone.CS_ARCH_MIPS, capstone.CS_MODE_32 +
-                                  capstone.CS_MODE_BIG_ENDIAN)
+        self.cs = self.ENGINES.get(self.mode)
+        if self.cs is None:
+            self.cs = self.ENGINES[self.mode] = self._make_engine(self.mode)
+
+    @staticmethod
+    def _make_engine(mode):
+        if mode == "I386":
+            cs = capstone.Cs(capstone.CS_ARCH_X86, capstone.CS_MODE_32)
+        elif mode == "AMD64":
+            cs = capstone.Cs(capstone.CS_ARCH_X86, capstone.CS_MODE_64)
+        elif mode == "MIPS":
+            cs = capstone.Cs(capstone.CS_ARCH_MIPS, capstone.CS_MODE_32 +
+                             capstone.CS_MODE_BIG_ENDIAN)
         # This is not really supported yet.
-        elif self.mode == "ARM":
-            self.cs = capstone.Cs(capstone.CS_ARCH_ARM, capstone.CS_MODE_ARM)
+        elif mode == "ARM":
+            cs = capstone.Cs(capstone.CS_ARCH_ARM, capstone.CS_MODE_ARM)
         else:
             raise NotImplementedError(
                 "No disassembler available for this arch.")
 
-        self.cs.detail = True
-        self.cs.skipdata_setup = ("db", None, None)
-        self.cs.skipdata = True
+        cs.detail = True
+        cs.skipdata_setup = ("db", None, None)
+        cs.skipdata = True
+        return cs
 
     def disassemble(self, data, offset):
         for insn in self.cs.disasm(data, int(offset)):
             yield CapstoneInstruction(insn, session=self.session,
                                       address_space=self.address_space)
 
+    def decode(self, data, offset, end):
+        """Decode all instructions starting before end into a DecodedPage.
+
+        This uses capstone's lite interface which does not build a python
+        object for each instruction, so it is much faster than disassemble()
+        when the operand details are not needed.
+        """
+        result = DecodedPage(offset)
+        for address, size, mnemonic, op_str in self.cs.disasm_lite(
+                data, int(offset)):
+            if address >= end:
+                break
+
+            result.append(address, size, mnemonic, op_str)
+
+        return result
+
+
+class DecodedPage(object):
+    """A compact table of the instructions decoded from a page of code."""
+
+    def __init__(self, start):
+        self.start = start
+        self.addresses = utils._UInt64Array()
+        self.sizes = array.array("B")
+        self.mnemonics = []
+        self.op_strs = []
+
+    def append(self, address, size, mnemonic, op_str):
+        self.addresses.append(address)
+        self.sizes.append(size)
+        self.mnemonics.append(mnemonic)
+        self.op_strs.append(op_str)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __iter__(self):
+        return zip(self.addresses, self.sizes, self.mnemonics, self.op_strs)
+
+    @utils.safe_property
+    def next_offset(self):
+        """Where a linear sweep continues after this page."""
+        if not self.addresses:
+            return self.start
+
+        return self.addresses[-1] + self.sizes[-1]
+
+
+# The longest valid x86 instruction.
+MAX_INSTRUCTION_LENGTH = 15
+
+# Memory operands of the form "dword ptr [0x1000400]" (absolute) or
+# "qword ptr [rip + 0x989d]" (RIP relative).
+INDIRECT_OPERAND = re.compile(
+    r"^(byte|word|dword|qword) ptr \[(?:(rip) ([+-]) )?(0x[0-9a-f]+|\d+)\]$")
+
+OPERAND_SIZES = dict(byte=1, word=2, dword=4, qword=8)
+
+
+def parse_indirect_operand(op_str, next_address):
+    """Parses a memory operand into its slot address and size.
+
+    Args:
+      op_str: The operand string from capstone.
+      next_address: The address of the next instruction, which RIP relative
+        operands are relative to.
+
+    Returns:
+      A tuple of (slot address, operand size), or None if op_str is not a
+      supported memory operand.
+    """
+    m = INDIRECT_OPERAND.match(op_str)
+    if not m:
+        return
+
+    operand_size, base, sign, disp = m.groups()
+    slot = int(disp, 0)
+    if base:
+        if sign == "-":
+            slot = -slot
+
+        slot += next_address
+
+    return slot & 0xffffffffffffffff, OPERAND_SIZES[operand_size]
+
+
+def decode_page(session, address_space, offset, mode):
+    """Returns the DecodedPage for code starting at offset.
+
+    We decode from offset to the end of its page in a single capstone call.
+    The last instruction may extend into the next page, so a linear sweep
+    continues from the page's next_offset. Decoded pages are cached in the
+    session by address space, start offset and mode.
+    """
+    key = (id(address_space), offset, mode)
+    decoded_page_cache = session.GetParameter(
+        "decoded_page_cache", utils.FastStore(1000))
+    try:
+        owner, result = decoded_page_cache.Get(key)
+
+        # The id of a freed address space may be reused by a new one.
+        if owner() is address_space:
+            return result
+    except KeyError:
+        pass
+
+    end = (offset | 0xfff) + 1
+    data = address_space.read(offset, end - offset + MAX_INSTRUCTION_LENGTH)
+    dis = Capstone(mode, session=session, address_space=address_space)
+    result = dis.decode(data, offset, end)
+
+    decoded_page_cache.Put(key, (weakref.ref(address_space), result))
+    session.SetCache("decoded_page_cache", decoded_page_cache)
+
+    return result
+
+
+def linear_sweep(session, address_space, start, end, mode):
+    """Yields DecodedPages covering all code between start and end."""
+    offset = start
+    while offset < end:
+        page = decode_page(session, address_space, offset, mode)
+        if not page:
+            break
+
+        yield page
+        offset = page.next_offset
+
+
+def find_indirect_branches(session, address_space, start, end, mode,
+                           mnemonics=("call", "jmp")):
+    """Finds calls and jumps through a memory slot (e.g. an IAT entry).
+
+    Yields:
+      A tuple of (instruction address, slot address, target) where target is
+      the pointer stored in the slot.
+    """
+    for page in linear_sweep(session, address_space, start, end, mode):
+        for address, size, mnemonic, op_str in page:
+            if address > end:
+                return
+
+            # Capstone includes prefixes in the mnemonic (e.g. "notrack call"
+            # or "bnd jmp").
+            if mnemonic.split()[-1] not in mnemonics:
+                continue
+
+            operand = parse_indirect_operand(op_str, address + size)
+            if operand is None:
+                continue
+
+            slot, operand_size = operand
+            data = address_space.read(slot, operand_size)
+            if operand_size == 8:
+                target = struct.unpack("<Q", data)[0]
+            elif operand_size == 4:
+                target = struct.unpack("<I", data)[0]
+            else:
+                continue
+
+            yield address, slot, target
+
 
 class Disassemble(plugin.TypedProfileCommand, plugin.Command):
     """Disassemble the given offset."""
@@ -0,0 +1,77 @@
+import struct
+
+import mock
+
+from rekall import addrspace
+from rekall import testlib
+from rekall.plugins.tools import disassembler
+
+
+class TestIndirectBranches(testlib.RekallBaseUnitTestCase):
+    """Test the parsing of indirect calls and jumps."""
+
+    def testParseIndirectOperand(self):
+        # Absolute slot.
+        self.assertEqual(
+            disassembler.parse_indirect_operand(
+                "dword ptr [0x1000400]", 0x401006),
+            (0x1000400, 4))
+
+        # RIP relative slots are relative to the next instruction.
+        self.assertEqual(
+            disassembler.parse_indirect_operand(
+                "qword ptr [rip + 0x989d]", 0x140001006),
+            (0x140001006 + 0x989d, 8))
+
+        self.assertEqual(
+            disassembler.parse_indirect_operand(
+                "qword ptr [rip - 0x10]", 0x140001006),
+            (0x140001006 - 0x10, 8))
+
+        # Registers are not slots.
+        self.assertEqual(
+            disassembler.parse_indirect_operand("rax", 0x140001006), None)
+        self.assertEqual(
+            disassembler.parse_indirect_operand(
+                "qword ptr [rax + 0x10]", 0x140001006), None)
+
+    def testPrefixedBranches(self):
+        slot = 0x1100
+        address_space = addrspace.BufferAddressSpace(
+            data=b"\x00" * slot + struct.pack("<Q", 0xfffff80000001000),
+            session=self.session)
+
+        page = [
+            (0x1000, 7, "notrack call", "qword ptr [rip + 0xf9]"),
+            (0x1007, 7, "bnd jmp", "qword ptr [rip + 0xf2]"),
+            (0x100e, 7, "mov", "rax, qword ptr [rip + 0xeb]"),
+        ]
+
+        with mock.patch.object(disassembler, "linear_sweep",
+                               return_value=[page]):
+            result = list(disassembler.find_indirect_branches(
+                self.session, address_space, 0x1000, 0x2000, "AMD64"))
+
+        self.assertEqual(result, [
+            (0x1000, slot, 0xfffff80000001000),
+            (0x1007, slot, 0xfffff80000001000)])
+
+
+    def testDecodePageCache(self):
+        # Two address spaces of the same class with different code.
+        nops = addrspace.BufferAddressSpace(
+            data=b"\x90" * 0x10, session=self.session)
+        rets = addrspace.BufferAddressSpace(
+            data=b"\xc3" * 0x10, session=self.session)
+
+        for address_space, mnemonic in ((nops, "nop"), (rets, "ret")):
+            page = disassembler.decode_page(
+                self.session, address_space, 0, "AMD64")
+            self.assertEqual(page.mnemonics[0], mnemonic)
+
+        # The second decode of the same page is cached.
+        self.assertIs(
+            disassembler.decode_page(self.session, rets, 0, "AMD64"), page)
+
+if __name__ == "__main__":
+    testlib.main()
@@ -103,6 +103,7 @@ from rekall import plugin
 from rekall import testlib
 
 from rekall.plugins.common import profile_index
+from rekall.plugins.linux import common as linux_common
 from rekall.plugins.overlays.linux import dwarfdump
 from rekall.plugins.overlays.linux import dwarfparser
 from rekall.plugins.windows import common
@@ -165,17 +166,9 @@ class LinuxConverter(ProfileConverter):
     BASE_PROFILE_CLASS = "Linux"
 
     def ParseSystemMap(self, system_map):
-        """Parse the system map and return a list of offset, symbol_name."""
-        sys_map = {}
-        # get the system map
-        for line in system_map.splitlines():
-            try:
-                (address, _, symbol) = line.strip().split()
-                sys_map[symbol] = int(address, 16) & 0xFFFFFFFFFFFF
-            except ValueError:
-                pass
-
-        return sys_map
+        """Parse the system map and return a dict of symbol_name: offset."""
+        return linux_common.SymbolTable.FromBuffer(
+            system_map, max_failures=2**32, max_fields=3).as_dict()
 
     def ParseConfigFile(self, config_file):
         """Parse the kernel .config file returning it as a dictionary."""
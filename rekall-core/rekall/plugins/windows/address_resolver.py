@@ -261,8 +261,10 @@ class WindowsAddressResolver(address_resolver.AddressResolverMixin,
 
     def render(self, _):
         if self.download_profile:
-            self.session.address_resolver.GetModuleByName(
+            resolver = self.session.address_resolver
+            resolver.GetModuleByName(
                 self.download_profile).load_profile(force=True)
+            resolver.InvalidateSymbolTable()
 
     @staticmethod
     def NormalizeModuleName(module_name):
@@ -295,6 +297,8 @@ class WindowsAddressResolver(address_resolver.AddressResolverMixin,
                         # reload a new profile.
                         module_obj.profile = None
 
+                self.InvalidateSymbolTable()
+
 
     def _EnsureInitialized(self):
         """Initialize the address resolver.
@@ -329,7 +333,8 @@ class WindowsAddressResolver(address_resolver.AddressResolverMixin,
             # Now use the vad.
             process_context = self.session.GetParameter("process_context")
             if process_context != None:
-                for vad in process_context.RealVadRoot.traverse():
+                for vad in common.VadIndex.get(
+                        self.session, process_context) or []:
                     self.AddModule(VadModule(vad=vad, session=self.session))
 
         finally:
@@ -24,8 +24,16 @@
 
 # pylint: disable=protected-access
 
+import array
+import base64
+import bisect
+import struct
+
+import acora
+
 from rekall import addrspace
 from rekall import args
+from rekall import config
 from rekall import scan
 from rekall import kb
 from rekall import plugin
@@ -36,6 +44,12 @@ from rekall_lib import registry
 from rekall_lib import utils
 
 
+config.DeclareOption(
+    "--no_pool_index", default=False, type="Boolean",
+    help="Pool scanners normally share a single index of pool allocations. "
+    "Set this to make each pool scanner scan the image itself.")
+
+
 # Windows kernel pdb filenames.
 KERNEL_NAMES = set(
     ["ntkrnlmp.pdb", "ntkrnlpa.pdb", "ntoskrnl.pdb",
@@ -270,6 +284,7 @@ class MultiPoolTagCheck(scan.MultiStringFinderCheck):
     """
     def __init__(self, tags=None, **kwargs):
         super(MultiPoolTagCheck, self).__init__(needles=tags, **kwargs)
+        self.tags = [utils.SmartStr(x) for x in tags]
 
         # The offset from the start of _POOL_HEADER to the tag.
         self.tag_offset = self.profile.get_obj_offset(
@@ -334,6 +349,259 @@ class CheckPoolIndex(scan.ScannerCheck):
         return pool_hdr.PoolIndex == self.value
 
 
+class _TagIndex(object):
+    """The allocations with a single tag, in compact arrays sorted by offset."""
+
+    def __init__(self):
+        # The ranges searched for this tag so far as sorted [start, end] pairs
+        # of tag offsets.
+        self.ranges = []
+        self.offsets = utils._UInt64Array()
+        self.sizes = array.array("H")
+        self.types = array.array("B")
+
+    def add(self, start, end, entries):
+        """Adds the entries found in start-end, which was not searched yet.
+
+        The ranges never overlap, so the new entries all go in one place.
+        """
+        if entries:
+            position = bisect.bisect_left(self.offsets, entries[0][0])
+            self._insert(position, entries)
+
+        ranges = []
+        for range_start, range_end in sorted(
+                [tuple(x) for x in self.ranges] + [(start, end)]):
+            if ranges and ranges[-1][1] >= range_start:
+                ranges[-1][1] = max(ranges[-1][1], range_end)
+            else:
+                ranges.append([range_start, range_end])
+
+        self.ranges = ranges
+
+    def _insert(self, position, entries):
+        self.offsets[position:position] = utils._UInt64Array(
+            [x[0] for x in entries])
+        self.sizes[position:position] = array.array(
+            "H", [x[1] for x in entries])
+        self.types[position:position] = array.array(
+            "B", [x[2] for x in entries])
+
+    def missing_ranges(self, start, end):
+        """Yields the parts of start-end which are not searched yet."""
+        for range_start, range_end in self.ranges:
+            if range_end <= start:
+                continue
+
+            if range_start >= end:
+                break
+
+            if range_start > start:
+                yield start, range_start
+
+            start = max(start, range_end)
+
+        if start < end:
+            yield start, end
+
+    def lookup(self, start, end):
+        """The (offset, size, type) of the allocations starting in start-end."""
+        lo = bisect.bisect_left(self.offsets, start)
+        hi = bisect.bisect_left(self.offsets, end, lo)
+        return zip(self.offsets[lo:hi], self.sizes[lo:hi], self.types[lo:hi])
+
+    def as_dict(self):
+        # The session cache is stored as JSON, so the arrays go in as base64
+        # text.
+        return dict(ranges=self.ranges,
+                    offsets=_array_to_base64(self.offsets),
+                    sizes=_array_to_base64(self.sizes),
+                    types=_array_to_base64(self.types))
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls()
+        result.ranges = data["ranges"]
+        for name in ("offsets", "sizes", "types"):
+            _array_from_bytes(getattr(result, name),
+                              base64.b64decode(utils.SmartStr(data[name])))
+
+        return result
+
+
+def _array_to_bytes(value):
+    try:
+        return value.tobytes()
+    except AttributeError:
+        # Python 2 only has tostring().
+        return value.tostring()
+
+
+def _array_to_base64(value):
+    return utils.SmartUnicode(base64.b64encode(_array_to_bytes(value)))
+
+
+def _array_from_bytes(value, data):
+    try:
+        value.frombytes(data)
+    except AttributeError:
+        # Python 2 only has fromstring().
+        value.fromstring(data)
+
+
+class PoolIndex(object):
+    """An index of the pool allocations with some tags in an address space.
+
+    Pool scanners often look for the same tags in the same ranges (e.g. the
+    psxview listings). The first time a tag is requested for a range we search
+    for it (together with the other requested tags) with acora and record the
+    offset, block size and pool type of every aligned _POOL_HEADER it is in.
+    The index is kept in the session cache so repeated scans for a tag are
+    answered from it. Note that scanners looking for different tags still
+    each make their own pass over the image.
+    """
+
+    # struct formats for the little endian fields of each size.
+    FIELD_FORMATS = {1: "<B", 2: "<H", 4: "<I", 8: "<Q"}
+
+    def __init__(self, session=None, address_space=None):
+        self.session = session
+        self.address_space = address_space
+        self.cache_key = "pool_index_%s_%s" % (
+            address_space.__class__.__name__, address_space.name)
+
+        profile = session.profile
+        self.pool_align = profile.get_constant("PoolAlignment")
+        self.tag_offset = profile.get_obj_offset("_POOL_HEADER", "PoolTag")
+        self.header_size = profile.get_obj_size("_POOL_HEADER")
+
+        # Work out where BlockSize and PoolType live in the header so we can
+        # decode them without instantiating a struct for each candidate.
+        prototype = profile._POOL_HEADER(vm=addrspace.BufferAddressSpace(
+            data=b"\x00" * self.header_size, session=session))
+        self.size_field = self._get_field(prototype, "BlockSize")
+        self.type_field = self._get_field(prototype, "PoolType")
+
+        # Maps tag values to their _TagIndex.
+        self.tags = {}
+
+    @classmethod
+    def get(cls, session, address_space):
+        """Returns the index for this address space."""
+        index = cls(session=session, address_space=address_space)
+        cached = session.GetParameter(index.cache_key)
+        if cached:
+            for tag, data in cached.items():
+                index.tags[int(tag)] = _TagIndex.from_dict(data)
+
+        return index
+
+    def _get_field(self, prototype, name):
+        member = prototype.m(name)
+        size = member.obj_size
+        start_bit = getattr(member, "start_bit", 0)
+        end_bit = getattr(member, "end_bit", size * 8)
+
+        return (member.obj_offset - prototype.obj_offset,
+                self.FIELD_FORMATS[size], start_bit,
+                (1 << (end_bit - start_bit)) - 1)
+
+    def _decode(self, header, field):
+        offset, fmt, start_bit, mask = field
+        return (struct.unpack_from(fmt, header, offset)[0] >> start_bit) & mask
+
+    @staticmethod
+    def tag_value(tag):
+        """The index key for a tag, or None if it can not be in the index."""
+        tag = utils.SmartStr(tag)
+        if len(tag) == 4:
+            return struct.unpack("<I", tag)[0]
+
+    def build(self, tags, start, end):
+        """Make sure the tags are indexed in the range start-end."""
+        # Search for the tags of the headers in the range. Tags missing the
+        # same ranges are searched for in the same pass.
+        pending = {}
+        for tag in set(utils.SmartStr(x) for x in tags):
+            tag_index = self.tags.setdefault(self.tag_value(tag), _TagIndex())
+            missing = tuple(tag_index.missing_ranges(
+                start + self.tag_offset, end + self.tag_offset))
+            if missing:
+                pending.setdefault(missing, []).append(tag)
+
+        if not pending:
+            return
+
+        for missing, needles in pending.items():
+            engine = acora.AcoraBuilder(*needles).build()
+            for range_start, range_end in missing:
+                entries = self._index_range(engine, range_start, range_end)
+                for tag in needles:
+                    self.tags[self.tag_value(tag)].add(
+                        range_start, range_end, entries.get(tag, []))
+
+        # The index can not change for an image, but live memory does.
+        self.session.SetCache(
+            self.cache_key,
+            dict((str(tag), tag_index.as_dict())
+                 for tag, tag_index in self.tags.items()),
+            volatile=self.address_space.volatile)
+
+    def _index_range(self, engine, start, end):
+        """Returns a dict of tag -> [entry] for the tags found in start-end.
+
+        The ranges are of tag offsets (rather than header offsets) so that
+        neighbouring ranges can never find the same allocation.
+        """
+        entries = {}
+        for buffer_as in scan.BufferASGenerator(
+                self.session, self.address_space, start, end):
+            self.session.report_progress(
+                "Indexing pool allocations %#x->%#x",
+                buffer_as.base_offset, buffer_as.end())
+
+            data = buffer_as.data
+            base_offset = buffer_as.base_offset
+            for tag, tag_offset in engine.finditer(data):
+                header_offset = tag_offset - self.tag_offset
+                if (base_offset + header_offset) % self.pool_align:
+                    continue
+
+                entry = self._get_entry(data, base_offset, header_offset)
+                if entry:
+                    entries.setdefault(tag, []).append(entry)
+
+        return entries
+
+    def _get_entry(self, data, base_offset, header_offset):
+        if header_offset >= 0:
+            header = data[header_offset:header_offset + self.header_size]
+        else:
+            # The header starts before this buffer.
+            header = self.address_space.read(
+                base_offset + header_offset, self.header_size)
+
+        if len(header) < self.header_size:
+            return
+
+        # There is no such thing as an empty allocation.
+        block_size = self._decode(header, self.size_field)
+        if block_size:
+            return (base_offset + header_offset,
+                    block_size,
+                    self._decode(header, self.type_field))
+
+    def lookup(self, tags, start, end):
+        """Yields (offset, block_size, pool_type) for tags in start-end."""
+        hits = []
+        for tag in set(utils.SmartStr(x) for x in tags):
+            tag_index = self.tags.get(self.tag_value(tag))
+            if tag_index is not None:
+                hits.extend(tag_index.lookup(start, end))
+
+        return sorted(hits)
+
+
 class PoolScanner(scan.BaseScanner):
     """A scanner for pool allocations."""
 
@@ -341,10 +609,57 @@ class PoolScanner(scan.BaseScanner):
         """Yields instances of _POOL_HEADER which potentially match."""
 
         maxlen = maxlen or self.session.profile.get_constant("MaxPointer")
-        for hit in super(PoolScanner, self).scan(offset=offset, maxlen=maxlen):
+        if self.constraints is None:
+            self.build_constraints()
+
+        tags = self._get_index_tags()
+        if tags and not self.session.GetParameter("no_pool_index"):
+            hits = self._scan_index(tags, offset, offset + maxlen)
+        else:
+            hits = super(PoolScanner, self).scan(offset=offset, maxlen=maxlen)
+
+        for hit in hits:
             yield self.session.profile._POOL_HEADER(
                 vm=self.address_space, offset=hit)
 
+    def _get_index_tags(self):
+        """The tags we are looking for, if we can answer from the index."""
+        for check in self.constraints:
+            if isinstance(check, PoolTagCheck):
+                tags = [check.needle]
+            elif isinstance(check, MultiPoolTagCheck):
+                tags = check.tags
+            else:
+                continue
+
+            if all(PoolIndex.tag_value(tag) is not None for tag in tags):
+                return tags
+
+    def _scan_index(self, tags, start, end):
+        index = PoolIndex.get(self.session, self.address_space)
+        index.build(tags, start, end)
+
+        # The tag and size checks are answered by the index itself. The
+        # remaining checks run on the header as usual.
+        size_checks = []
+        checks = []
+        for check in self.constraints:
+            if isinstance(check, CheckPoolSize):
+                size_checks.append(check)
+            elif not isinstance(check, (PoolTagCheck, MultiPoolTagCheck)):
+                checks.append(check)
+
+        for hit, block_size, _ in index.lookup(tags, start, end):
+            if not all(check.condition(block_size * check.pool_align)
+                       for check in size_checks):
+                continue
+
+            self.buffer_as.assign_buffer(
+                self.address_space.read(hit, self.overlap), base_offset=hit)
+
+            if all(check.check(self.buffer_as, hit) for check in checks):
+                yield hit
+
 
 class KDBGHook(AbstractWindowsParameterHook):
     """A Hook to calculate the KDBG when needed."""
@@ -738,3 +1053,107 @@ class PsListHandlesHook(AbstractWindowsParameterHook):
 
 
         return result
+
+
+def get_vad_filename(vad):
+    """Returns the name of the file mapped by the vad (or "")."""
+    filename = ""
+    try:
+        file_obj = vad.ControlArea.FilePointer
+        if file_obj:
+            filename = file_obj.FileName or "Pagefile-backed section"
+    except AttributeError:
+        pass
+
+    return utils.SmartUnicode(filename)
+
+
+class VadIndex(object):
+    """The VADs of a process as sorted start and end arrays.
+
+    Walking the VAD tree is slow and many plugins need it, so the tree of each
+    process is walked once and the result is kept in the session cache until the
+    image changes. Lookups by address use a binary search.
+    """
+
+    # Cache keys of the indexes currently being built. Building the index reads
+    # the VAD tree which may need to resolve VAD PTEs, which needs the index.
+    _building = set()
+
+    def __init__(self, session=None, task=None, data=None):
+        self.session = session
+        self.task = task
+        self.starts = data["starts"]
+        self.ends = data["ends"]
+        self.offsets = data["offsets"]
+        self.types = data["types"]
+        self.depths = data["depths"]
+        self.filenames = data["filenames"]
+        self.protections = data["protections"]
+
+    @classmethod
+    def get(cls, session, task):
+        """Returns the VadIndex for the task or None if it is being built."""
+        cache_key = "vad_index_%#x" % task.obj_offset
+        data = session.GetParameter(cache_key)
+        if data is None:
+            building_key = (id(session), cache_key)
+            if building_key in cls._building:
+                return
+
+            cls._building.add(building_key)
+            try:
+                data = cls._build(session, task)
+            finally:
+                cls._building.discard(building_key)
+
+            session.SetCache(cache_key, data)
+
+        return cls(session=session, task=task, data=data)
+
+    @staticmethod
+    def _build(session, task):
+        session.report_progress(
+            " Enumerating VADs in %s (%s)", task.name, task.pid)
+
+        rows = []
+        for vad in task.RealVadRoot.traverse():
+            rows.append((int(vad.Start), int(vad.End), vad.obj_offset,
+                         vad.obj_type,
+                         vad.obj_context.get("depth", 0),
+                         get_vad_filename(vad),
+                         utils.SmartUnicode(vad.u.VadFlags.ProtectionEnum)))
+
+        rows.sort()
+        names = ("starts", "ends", "offsets", "types", "depths", "filenames",
+                 "protections")
+
+        return dict((name, [row[i] for row in rows])
+                    for i, name in enumerate(names))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        """Yields the _MMVAD structs in order of start address."""
+        for i in range(len(self)):
+            yield self.get_vad(i)
+
+    def get_vad(self, i):
+        return self.task.obj_profile.Object(
+            self.types[i], offset=self.offsets[i], vm=self.task.obj_vm,
+            context=dict(depth=self.depths[i]))
+
+    def find(self, address):
+        """Returns the position of the vad containing address or None."""
+        i = bisect.bisect_right(self.starts, address) - 1
+        if i >= 0 and address < self.ends[i]:
+            return i
+
+    def get_containing_range(self, address):
+        """A drop in replacement for RangedCollection.get_containing_range."""
+        i = self.find(address)
+        if i is None:
+            return None, None, None
+
+        return self.starts[i], self.ends[i], self.get_vad(i)
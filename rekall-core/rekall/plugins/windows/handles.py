@@ -20,6 +20,7 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 #
 # pylint: disable=protected-access
+from rekall import addrspace
 from rekall import testlib
 
 from rekall.plugins.windows import common
@@ -56,46 +57,74 @@ class Handles(common.WinProcessFilter):
             obj_type="",
             details="")
 
+    def __init__(self, *args, **kwargs):
+        super(Handles, self).__init__(*args, **kwargs)
+
+        # Many processes hold handles to the same objects, so we remember the
+        # names of objects by their address.
+        self._name_cache = utils.FastStore(max_size=100000)
+
     def enumerate_handles(self, task):
-        if task.ObjectTable.HandleTableList:
-            for handle in task.ObjectTable.handles():
-                name = u""
-                object_type = handle.get_object_type(self.kernel_address_space)
-
-                if object_type == None:
-                    continue
-
-                if (self.plugin_args.object_types and
-                        object_type not in self.plugin_args.object_types):
-                    continue
-
-                elif object_type == "File":
-                    file_obj = handle.dereference_as("_FILE_OBJECT")
-                    name = file_obj.file_name_with_device()
-                elif object_type == "Key":
-                    key_obj = handle.dereference_as("_CM_KEY_BODY")
-                    name = key_obj.full_key_name()
-                elif object_type == "Process":
-                    proc_obj = handle.dereference_as("_EPROCESS")
-                    name = u"{0}({1})".format(
-                        utils.SmartUnicode(proc_obj.ImageFileName),
-                        proc_obj.UniqueProcessId)
-
-                elif object_type == "Thread":
-                    thrd_obj = handle.dereference_as("_ETHREAD")
-                    name = u"TID {0} PID {1}".format(
-                        thrd_obj.Cid.UniqueThread,
-                        thrd_obj.Cid.UniqueProcess)
-
-                elif handle.NameInfo.Name == None:
-                    name = u""
-                else:
-                    name = handle.NameInfo.Name
-
-                if not name and self.plugin_args.named_only:
-                    continue
-
-                yield handle, object_type, name
+        if not task.ObjectTable.HandleTableList:
+            return
+
+        for handle in task.ObjectTable.handles():
+            object_type = handle.get_object_type(self.kernel_address_space)
+
+            if object_type == None:
+                continue
+
+            if (self.plugin_args.object_types and
+                    object_type not in self.plugin_args.object_types):
+                continue
+
+            name = self._get_name(handle, object_type)
+            if not name and self.plugin_args.named_only:
+                continue
+
+            yield handle, object_type, name
+
+    def _get_name(self, handle, object_type):
+        key = (object_type, handle.obj_offset)
+        try:
+            return self._name_cache.Get(key)
+        except KeyError:
+            pass
+
+        name = u""
+        if object_type == "File":
+            file_obj = handle.dereference_as("_FILE_OBJECT")
+            name = file_obj.file_name_with_device()
+        elif object_type == "Key":
+            key_obj = handle.dereference_as("_CM_KEY_BODY")
+            name = key_obj.full_key_name()
+        elif object_type == "Process":
+            proc_obj = self._read_object(handle, "_EPROCESS")
+            name = u"{0}({1})".format(
+                utils.SmartUnicode(proc_obj.ImageFileName),
+                proc_obj.UniqueProcessId)
+
+        elif object_type == "Thread":
+            thrd_obj = self._read_object(handle, "_ETHREAD")
+            name = u"TID {0} PID {1}".format(
+                thrd_obj.Cid.UniqueThread,
+                thrd_obj.Cid.UniqueProcess)
+
+        elif handle.NameInfo.Name != None:
+            name = handle.NameInfo.Name
+
+        self._name_cache.Put(key, name)
+        return name
+
+    def _read_object(self, handle, type_name):
+        """Reads the whole object in one go to decode it from a buffer."""
+        offset = handle.Body.obj_offset
+        cached_vm = addrspace.BufferAddressSpace(
+            data=handle.obj_vm.read(
+                offset, self.profile.get_obj_size(type_name)),
+            base_offset=offset, session=self.session)
+
+        return self.profile.Object(type_name, offset=offset, vm=cached_vm)
 
     def collect(self):
         for task in self.filter_processes():
@@ -34,6 +34,9 @@ the RSDS GUID is not available or incorrect.
 from builtins import next
 __author__ = "Michael Cohen <scudette@google.com>"
 
+import collections
+import struct
+
 from rekall import obj
 from rekall import testlib
 from rekall.plugins.windows import common
@@ -76,6 +79,7 @@ class GuessGUID(common.WindowsCommandPlugin):
         except ValueError:
             return
 
+        threshold = self.session.GetParameter("autodetect_threshold")
         cc = self.session.plugins.cc()
         for session in self.session.plugins.sessions().session_spaces():
             # Switch the process context to this session so the address
@@ -87,8 +91,11 @@ class GuessGUID(common.WindowsCommandPlugin):
                 image_base = self.session.address_resolver.get_address_by_name(
                     self.plugin_args.module)
 
-                for profile, _ in index.LookupIndex(
+                for profile, match in index.LookupIndex(
                         image_base, minimal_match=self.plugin_args.minimal_match):
+                    if match >= threshold:
+                        self.confident = True
+
                     yield self.session.GetParameter("process_context"), profile
 
     def GuessProfiles(self):
@@ -96,9 +103,15 @@ class GuessGUID(common.WindowsCommandPlugin):
         # Usually this plugin is invoked from ParameterHooks which will take the
         # first hit. So we try to do the fast methods first, then fall back to
         # the slower methods.
+        self.confident = False
         for x in self.LookupIndex():
             yield x
 
+        # The index already identified the module with enough confidence, so
+        # there is no need to scan the entire image for RSDS signatures.
+        if self.confident:
+            return
+
         # Looking up the index failed because it was not there, or the index did
         # not contain the right profile - fall back to RSDS scanning.
         for x in self.ScanProfile():
@@ -137,6 +150,61 @@ class EProcessIndex(basic.ProfileLLP64):
             arch = metadata.get("arch", "AMD64")
             self.filename_to_dtb.add((relative_offset, arch))
 
+        # All the DTB candidates around a filename hit can be fetched with a
+        # single read spanning these relative offsets.
+        self.signatures = sorted(self.filename_to_dtb)
+        self.min_offset = min([x[0] for x in self.signatures] or [0])
+        self.max_offset = max([x[0] for x in self.signatures] or [0])
+        self.hit_counts = collections.Counter()
+
+    def PossibleDTBs(self, filename_offset, address_space):
+        """Yield candidate DTBs for an ImageFileName hit.
+
+        Rather than reading each signature's DTB field separately, we read the
+        whole span of relative offsets once and unpack every candidate from
+        it. Signatures which verified before are tried first.
+
+        Yields:
+          tuples of (dtb, arch, signature).
+        """
+        start = max(0, filename_offset - self.max_offset)
+        end = filename_offset - self.min_offset + 4
+        if end <= start:
+            return
+
+        data = address_space.read(start, end - start)
+        seen = set()
+        for signature in sorted(self.signatures,
+                                key=lambda x: -self.hit_counts[x]):
+            dtb_rel_offset, arch = signature
+            position = filename_offset - dtb_rel_offset - start
+            if position < 0 or position + 4 > len(data):
+                continue
+
+            possible_dtb = struct.unpack_from("<I", data, position)[0]
+
+            # Discard impossible DTB values immediately. On 64 bit
+            # architectures, the DTB must be page aligned, on 32 bit (PAE)
+            # it must be aligned to 0x20.
+            if not possible_dtb:
+                continue
+
+            if arch == "AMD64" and possible_dtb & 0xFFF:
+                continue
+
+            if arch == "I386" and possible_dtb & 0x1F:
+                continue
+
+            if (possible_dtb, arch) in seen:
+                continue
+
+            seen.add((possible_dtb, arch))
+            yield possible_dtb, arch, signature
+
+    def RecordHit(self, signature):
+        """Remember that signature produced a verified DTB."""
+        self.hit_counts[signature] += 1
+
 
 class TestGuessGUID(testlib.SortedComparison):
     PARAMETERS = dict(
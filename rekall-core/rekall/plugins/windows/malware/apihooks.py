@@ -29,10 +29,13 @@
 
 from builtins import hex
 from builtins import object
+import re
 import struct
 
+from rekall import addrspace
 from rekall import testlib
 
+from rekall.plugins.tools import disassembler
 from rekall.plugins.windows import common
 from rekall.plugins.overlays.windows import pe_vtypes
 from rekall_lib import utils
@@ -398,60 +401,167 @@ class CheckPEHooks(common.WindowsCommandPlugin):
                        target_func=self.session.profile.Function(
                            func_address))
 
-    def detect_inline_hooks(self):
+    # Opcode bytes which may start a call, jump, loop or return on x86. If
+    # none of these appear in a function's preamble the heuristic can not find
+    # a destination so there is no point in emulating it. Prefixes (e.g. bnd,
+    # notrack, rep) come before these bytes so they need not be listed.
+    BRANCH_OPCODES = re.compile(
+        b"[\x0f\x70-\x7f\x9a\xc2\xc3\xca\xcb\xe0-\xe3\xe8-\xeb\xff]")
+
+    # The size of the PFN database window we read at once.
+    PFN_WINDOW = 0x10000
+
+    def _get_physical_pages(self, address_space, addresses):
+        """Translate the pages of all addresses in bulk.
+
+        Rather than calling vtop() for each address we walk the page tables
+        once over each cluster of nearby pages.
+
+        Returns:
+          A dict of virtual page -> physical page for all mapped pages.
+        """
+        pages = sorted(set(x >> 12 for x in addresses))
+        result = {}
+
+        # Split the pages into clusters so we do not walk the page tables
+        # between widely separated addresses (e.g. EAT hooks).
+        clusters = []
+        for page in pages:
+            if clusters and page - clusters[-1][-1] < 0x200:
+                clusters[-1].append(page)
+            else:
+                clusters.append([page])
+
+        for cluster in clusters:
+            i = 0
+            for run in address_space.get_mappings(
+                    start=cluster[0] << 12, end=(cluster[-1] + 1) << 12):
+                # These pages are not mapped.
+                while i < len(cluster) and cluster[i] << 12 < run.start:
+                    i += 1
+
+                while i < len(cluster) and cluster[i] << 12 < run.end:
+                    result[cluster[i]] = (
+                        run.file_offset + (cluster[i] << 12) - run.start) >> 12
+                    i += 1
+
+                if i >= len(cluster):
+                    break
+
+        return result
+
+    def _get_prototype_pages(self, physical_pages):
+        """Returns the physical pages which are still file mappings.
+
+        We sweep the PFN database once in physical page order, reading a
+        window of PFN records at a time.
+        """
+        pfn_db = self.session.profile.get_constant_object("MmPfnDatabase")
+        pfn_size = self.session.profile.get_obj_size("_MMPFN")
+        window = self.PFN_WINDOW // pfn_size
+        pages = sorted(physical_pages)
+        result = set()
+
+        i = 0
+        while i < len(pages):
+            first = pages[i]
+            j = i
+            while j < len(pages) and pages[j] < first + window:
+                j += 1
+
+            start = pfn_db.v() + first * pfn_size
+            length = (pages[j - 1] - first + 1) * pfn_size
+            cached_vm = addrspace.BufferAddressSpace(
+                data=pfn_db.obj_vm.read(start, length),
+                base_offset=start, session=self.session)
+
+            for page in pages[i:j]:
+                pfn_obj = self.session.profile._MMPFN(
+                    offset=start + (page - first) * pfn_size, vm=cached_vm)
+
+                if pfn_obj.IsPrototype:
+                    result.add(page)
+
+            i = j
+
+        return result
+
+    def _may_branch(self, function, address, instructions):
+        """A quick check if the heuristic could find a destination.
+
+        This looks for branch opcodes in the preamble first, and only
+        decodes the preamble (without operand details) if there are any.
+        """
+        data = function.obj_vm.read(
+            address, (instructions + 1) * disassembler.MAX_INSTRUCTION_LENGTH)
+
+        if not self.BRANCH_OPCODES.search(data):
+            return False
+
+        decoded = function.deref().dis.decode(
+            data, address, address + len(data))
+
+        for mnemonic in decoded.mnemonics[:instructions + 1]:
+            # Ignore prefixes, e.g. "bnd jmp" or "rep ret".
+            mnemonic = mnemonic.split()[-1]
+            if (mnemonic == "call" or mnemonic.startswith("j") or
+                    mnemonic.startswith("ret") or
+                    mnemonic.startswith("loop")):
+                return True
+
+        return False
+
+    def detect_inline_hooks(self, instructions=3):
         """A Generator of hooked exported functions from this PE file.
 
         Yields:
           A tuple of (function, name, jump_destination)
         """
         # Inspect the export directory for inline hooks.
+        address_space = self.session.GetParameter("default_address_space")
         pe = pe_vtypes.PE(image_base=self.plugin_args.image_base,
-                          address_space=self.session.GetParameter(
-                              "default_address_space"),
+                          address_space=address_space,
                           session=self.session)
-        pfn_db = self.session.profile.get_constant_object("MmPfnDatabase")
         heuristic = HookHeuristic(session=self.session)
 
-        ok_pages = set()
-
-        for _, function, name, _ in pe.ExportDirectory():
-            # Dereference the function pointer.
-            function_address = function.deref().obj_offset
-
+        exports = [(function, name, function.v())
+                   for _, function, name, _ in pe.ExportDirectory()]
+
+        # Check if the pages are private or file mappings. Usually if a mapped
+        # page is modified it will be converted to a private page due to
+        # Windows copy on write semantics. We assume that hooks are only
+        # placed in memory, and therefore functions which are still mapped to
+        # disk files are not hooked and can be safely skipped.
+        if not self.plugin_args.thorough:
+            # These are the physical pages backing the function preambles.
+            physical_pages = self._get_physical_pages(
+                address_space, [x[2] for x in exports])
+
+            # The page is controlled by a prototype PTE which means it is
+            # still a file mapping. It has not been changed.
+            prototype_pages = self._get_prototype_pages(
+                set(physical_pages.values()))
+
+        for function, name, function_address in exports:
             self.session.report_progress(
                 "Checking function %#x (%s)", function, name)
 
-            # Check if the page is private or a file mapping. Usually if a
-            # mapped page is modified it will be converted to a private page due
-            # to Windows copy on write semantics. We assume that hooks are only
-            # placed in memory, and therefore functions which are still mapped
-            # to disk files are not hooked and can be safely skipped.
             if not self.plugin_args.thorough:
-                # We must do the vtop in the process address space. This is the
-                # physical page backing the function preamble.
-                phys_address = function.obj_vm.vtop(function_address)
+                phys_page = physical_pages.get(function_address >> 12)
 
                 # Page not mapped.
-                if phys_address == None:
+                if phys_page is None:
                     continue
 
-                phys_page = phys_address >> 12
-
-                # We determined this page is ok before - we can skip it.
-                if phys_page in ok_pages:
+                if phys_page in prototype_pages:
                     continue
 
-                # Get the PFN DB record.
-                pfn_obj = pfn_db[phys_page]
-
-                # The page is controlled by a prototype PTE which means it is
-                # still a file mapping. It has not been changed.
-                if pfn_obj.IsPrototype:
-                    ok_pages.add(phys_page)
-                    continue
+            if not self._may_branch(function, function_address, instructions):
+                continue
 
             # Try to detect an inline hook.
-            destination = heuristic.Inspect(function, instructions=3) or ""
+            destination = heuristic.Inspect(
+                function, instructions=instructions) or ""
 
             # If we did not detect a hook we skip this function.
             if destination:
@@ -1,5 +1,8 @@
+import mock
+
 from rekall import addrspace
 from rekall import testlib
+from rekall.plugins.tools import disassembler
 from rekall.plugins.windows.malware import apihooks
 
 
@@ -38,3 +41,30 @@ class TestHookHeuristics(testlib.RekallBaseUnitTestCase):
 
                 # All hooks in test cases go to the same target offset (0x100).
                 self.assertEqual(destination, target)
+
+
+class TestMayBranch(testlib.RekallBaseUnitTestCase):
+    """Test the quick check before emulating a function's preamble."""
+
+    def _may_branch(self, data):
+        function = mock.MagicMock()
+        function.obj_vm.read.return_value = data
+        function.deref().dis = disassembler.Capstone(
+            "AMD64", session=self.session)
+
+        hooks = object.__new__(apihooks.CheckPEHooks)
+        return hooks._may_branch(function, 0x1000, 3)
+
+    def testBranches(self):
+        # nop; bnd jmp qword ptr [rip]
+        self.assertTrue(self._may_branch(b"\x90\xf2\xff\x25\x00\x00\x00\x00"))
+
+        # nop; rep ret
+        self.assertTrue(self._may_branch(b"\x90\xf3\xc3"))
+
+        # nop; loop / loopne
+        self.assertTrue(self._may_branch(b"\x90\xe2\xfe"))
+        self.assertTrue(self._may_branch(b"\x90\xe0\xfe"))
+
+        # No branches at all.
+        self.assertFalse(self._may_branch(b"\x90" * 8))
@@ -23,6 +23,7 @@ from rekall import obj
 from rekall import testlib
 
 from rekall.plugins.overlays.windows import pe_vtypes
+from rekall.plugins.tools import disassembler
 from rekall.plugins.windows import common
 
 
@@ -173,11 +174,6 @@ class ImpScan(common.WinProcessFilter):
         else:
             return mod_name, func_name
 
-    CALL_RULE = {'mnemonic': 'CALL', 'operands': [
-        {'type': 'MEM', 'target': "$target", 'address': '$address'}]}
-    JMP_RULE = {'mnemonic': 'JMP', 'operands': [
-        {'type': 'MEM', 'target': "$target", 'address': '$address'}]}
-
     def call_scan(self, addr_space, base_address, size_to_read):
         """Locate calls in a block of code.
 
@@ -208,18 +204,12 @@ class ImpScan(common.WinProcessFilter):
         func_obj = self.profile.Function(vm=addr_space, offset=base_address)
         end_address = base_address + size_to_read
 
-        for instruction in func_obj.disassemble(2**32):
-            if instruction.address > end_address:
-                break
-
-            context = {}
-            if (instruction.match_rule(self.CALL_RULE, context) or
-                    instruction.match_rule(self.JMP_RULE, context)):
-                target = context.get("$target")
-                if target:
-                    yield (instruction.address,
-                           context.get("$address"),
-                           self.profile.Function(vm=addr_space, offset=target))
+        for address, slot, target in disassembler.find_indirect_branches(
+                self.session, addr_space, base_address, end_address,
+                func_obj.mode):
+            if target:
+                yield (address, slot,
+                       self.profile.Function(vm=addr_space, offset=target))
 
     def find_process_imports(self, task):
         task_space = task.get_process_address_space()
@@ -45,19 +45,8 @@ class Malfind(core.DirectoryDumperMixin, common.WinProcessFilter):
         @param vad: an MMVAD object in kernel AS
         @param address_space: the process address space
         """
-
-        PAGE_SIZE = 0x1000
-        all_zero_page = "\x00" * PAGE_SIZE
-
-        offset = 0
-        while offset < vad.Length:
-            next_addr = vad.Start + offset
-            if (address_space.is_valid_address(next_addr) and
-                    address_space.read(next_addr, PAGE_SIZE) != all_zero_page):
-                return False
-            offset += PAGE_SIZE
-
-        return True
+        return address_space.is_region_empty(
+            vad.Start, vad.Start + vad.Length)
 
     def _injection_filter(self, vad, task_as):
         """Detects injected vad regions.
@@ -104,7 +93,7 @@ class Malfind(core.DirectoryDumperMixin, common.WinProcessFilter):
 
             with cc:
                 cc.SwitchProcessContext(task)
-                for vad in task.RealVadRoot.traverse():
+                for vad in common.VadIndex.get(self.session, task) or []:
                     self.session.report_progress("Checking %r of pid %s",
                                                  vad, task.UniqueProcessId)
 
@@ -184,14 +173,14 @@ class LdrModules(common.WinProcessFilter):
         self.session.report_progress("Inspecting Pid %s",
                                      task.UniqueProcessId)
 
-        for vad in task.RealVadRoot.traverse():
-            try:
-                file_obj = vad.ControlArea.FilePointer
-                protect = str(vad.u.VadFlags.ProtectionEnum)
-                if "EXECUTE" in protect and "WRITE" in protect:
-                    yield vad, file_obj.FileName
-            except AttributeError:
-                pass
+        vads = common.VadIndex.get(self.session, task) or []
+        for i, vad in enumerate(vads):
+            protect = vads.protections[i]
+            if "EXECUTE" in protect and "WRITE" in protect:
+                try:
+                    yield vad, vad.ControlArea.FilePointer.FileName
+                except AttributeError:
+                    pass
 
 
     def collect(self):
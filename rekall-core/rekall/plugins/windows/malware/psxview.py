@@ -19,8 +19,96 @@
 
 # pylint: disable=protected-access
 
+from builtins import object
+
+from multiprocessing import pool
 
 from rekall.plugins.windows import common
+from rekall_lib import utils
+
+
+class CrossView(object):
+    """Joins the process listings of several enumeration methods.
+
+    The methods are independent so we run them concurrently. The session
+    serializes each parameter hook, so dependencies shared by several methods
+    are calculated once. Each listing is reduced to a sorted array of _EPROCESS
+    offsets and the arrays are merged in a single pass. The joined table is
+    kept in the session cache.
+    """
+
+    def __init__(self, session, methods, threads=4):
+        self.session = session
+        self.methods = list(methods)
+        self.threads = threads
+
+    def _enumerate(self, method):
+        return utils._UInt64Array(
+            sorted(self.session.GetParameter("pslist_%s" % method)))
+
+    def _enumerate_all(self):
+        # Some listings bounce off the active process list so we make sure it
+        # is available before they start.
+        self.session.GetParameter("pslist_PsActiveProcessHead")
+
+        if self.threads <= 1:
+            return [self._enumerate(method) for method in self.methods]
+
+        workers = pool.ThreadPool(self.threads)
+        try:
+            return workers.map(self._enumerate, self.methods)
+        finally:
+            workers.terminate()
+
+    @staticmethod
+    def merge_join(columns):
+        """Merges sorted offset arrays.
+
+        Returns:
+          A tuple of (offsets, flags). offsets is the sorted union of all
+          columns and bit j of flags[i] is set if offsets[i] is in columns[j].
+        """
+        offsets = utils._UInt64Array()
+        flags = []
+        positions = [0] * len(columns)
+
+        while True:
+            current = None
+            for j, column in enumerate(columns):
+                if positions[j] < len(column) and (
+                        current is None or column[positions[j]] < current):
+                    current = column[positions[j]]
+
+            if current is None:
+                break
+
+            mask = 0
+            for j, column in enumerate(columns):
+                if positions[j] < len(column) and (
+                        column[positions[j]] == current):
+                    mask |= 1 << j
+                    positions[j] += 1
+
+            offsets.append(current)
+            flags.append(mask)
+
+        return offsets, flags
+
+    def membership(self):
+        """Returns a dict of _EPROCESS offset -> list of booleans per method."""
+        cache_key = "psxview_%s" % ",".join(self.methods)
+        table = self.session.GetParameter(cache_key)
+        if not table:
+            offsets, flags = self.merge_join(self._enumerate_all())
+            table = dict(offsets=list(offsets), flags=flags)
+            self.session.SetCache(cache_key, table)
+
+        result = {}
+        for offset, mask in zip(table["offsets"], table["flags"]):
+            result[offset] = [bool(mask & (1 << j))
+                              for j in range(len(self.methods))]
+
+        return result
 
 
 class WindowsPsxView(common.WinProcessFilter):
@@ -35,6 +123,9 @@ class WindowsPsxView(common.WinProcessFilter):
         dict(name="method", choices=list(METHODS), type="ChoiceArray",
              default=list(METHODS), help="Method to list processes.",
              override=True),
+
+        dict(name="threads", default=4, type="IntParser",
+             help="Number of listing methods to run concurrently."),
     ]
 
     def render(self, renderer):
@@ -47,12 +138,16 @@ class WindowsPsxView(common.WinProcessFilter):
 
         renderer.table_header(headers)
 
+        membership = CrossView(
+            self.session, self.plugin_args.method,
+            threads=self.plugin_args.threads).membership()
+
         for eprocess in self.filter_processes():
             row = [eprocess]
+            row.extend(membership.get(
+                eprocess.obj_offset,
+                [False] * len(self.plugin_args.method)))
 
-            for method in self.plugin_args.method:
-                row.append(eprocess.obj_offset in
-                           self.session.GetParameter("pslist_%s" % method))
             renderer.table_row(*row)
 
 
@@ -391,7 +391,7 @@ class WindowsPagedMemoryMixin(object):
 
     @utils.safe_property
     def vad(self):
-        """Returns a cached RangedCollection() of vad ranges."""
+        """Returns the VadIndex of this process."""
 
         # If this dtb is the same as the kernel dtb - there are no vads.
         if self.dtb == self.session.GetParameter("dtb"):
@@ -419,10 +419,10 @@ class WindowsPagedMemoryMixin(object):
                 # for some of the address transition.
                 self.task = self.session.GetParameter("dtb2task").get(self.dtb)
 
-            self._vad = utils.RangedCollection()
             task = self.session.profile._EPROCESS(self.task)
-            for vad in task.RealVadRoot.traverse():
-                self._vad.insert(vad.Start, vad.End, vad)
+            self._vad = common.VadIndex.get(self.session, task)
+            if self._vad is None:
+                return obj.NoneObject("vads not available right now")
 
             return self._vad
         finally:
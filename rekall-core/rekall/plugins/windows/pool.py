@@ -21,43 +21,184 @@ __author__ = "Michael Cohen <scudette@google.com>"
 
 # pylint: disable=protected-access
 
+import bisect
+
+from rekall import addrspace
 from rekall import obj
 from rekall.plugins.windows import common
 from rekall_lib import utils
 
 
+def _strip_protected(tag):
+    """Older windows versions set the high bit of protected pool tags."""
+    tag = bytearray(utils.SmartStr(tag))
+    if tag:
+        tag[-1] &= 0x7f
+
+    return bytes(tag)
+
+
+class PoolBigPagesHook(common.AbstractWindowsParameterHook):
+    """Lists the big pool allocations from the PoolBigPageTable.
+
+    Returns a list of [start, end, tag] sorted by start.
+    """
+
+    name = "pool_big_pages"
+
+    def calculate(self):
+        profile = self.session.profile
+        table = profile.get_constant_object(
+            "PoolBigPageTable",
+            target="Pointer",
+            target_args=dict(
+                target="Array",
+                target_args=dict(
+                    count=profile.get_constant_object(
+                        "PoolBigPageTableSize", "unsigned int").v(),
+                    target="_POOL_TRACKER_BIG_PAGES",
+                    )
+                )
+            )
+
+        result = []
+        for entry in table:
+            # Free entries have the low bit of the address set.
+            start = entry.Va.v()
+            if not start or start & 1:
+                continue
+
+            size = entry.m("NumberOfBytes") or entry.m("NumberOfPages") * 0x1000
+            if size:
+                self.session.report_progress(
+                    "Reading big pool allocation %#x", start)
+                result.append([start, start + int(size),
+                               utils.SmartStr(entry.Key.cast(
+                                   "String", length=4))])
+
+        return sorted(result)
+
+
+class PoolAllocationResolver(object):
+    """Finds the pool allocation which contains an address.
+
+    Big allocations are looked up in the PoolBigPageTable. Small allocations are
+    found by following the chain of pool headers in their page, which must
+    exactly cover the page. Both are answered with a binary search.
+
+    Use get() to share a single resolver (and its caches) in the session.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.profile = session.profile
+        self.pool_align = self.profile.get_constant("PoolAlignment")
+        self.header_size = self.profile.get_obj_size("_POOL_HEADER")
+
+        self._pool_lookup = None
+        self._big_pages = None
+        self._big_page_starts = None
+
+        # Allocation chains for the small pool pages we have seen.
+        self._page_cache = utils.FastStore(max_size=1000)
+
+    @classmethod
+    def get(cls, session):
+        """Returns the resolver kept in the session."""
+        resolver = session.GetParameter("pool_allocation_resolver")
+        if resolver is None:
+            resolver = cls(session)
+            session.SetCache("pool_allocation_resolver", resolver)
+
+        return resolver
+
+    def get_pool(self, address):
+        """Returns start, end and descriptor of the pool containing address.
+
+        This only checks the ranges of the pool descriptors, so the address
+        need not be in an allocation we can resolve.
+        """
+        if self._pool_lookup is None:
+            pools = self.session.plugins.pools()
+            self._pool_lookup = utils.RangedCollection()
+            for descriptor in pools.find_all_pool_descriptors():
+                if descriptor.PoolStart is not None:
+                    self._pool_lookup.insert(descriptor.PoolStart,
+                                             descriptor.PoolEnd,
+                                             descriptor)
+
+        return self._pool_lookup.get_containing_range(address)
+
+    def _get_big_pages(self):
+        if self._big_pages is None:
+            self._big_pages = self.session.GetParameter("pool_big_pages") or []
+            self._big_page_starts = [x[0] for x in self._big_pages]
+
+        return self._big_pages
+
+    def _get_page_chain(self, page):
+        """Returns the sorted (start, end, tag) allocations in a pool page."""
+        try:
+            return self._page_cache.Get(page)
+        except KeyError:
+            pass
+
+        buffer_as = addrspace.BufferAddressSpace(
+            data=self.session.kernel_address_space.read(page, 0x1000),
+            base_offset=page, session=self.session)
+
+        result = []
+        offset = page
+        previous_size = 0
+        while offset + self.header_size <= page + 0x1000:
+            header = self.profile._POOL_HEADER(offset, vm=buffer_as)
+            size = header.BlockSize * self.pool_align
+
+            # Each header records the size of the one before it.
+            if (not size or
+                    header.PreviousSize * self.pool_align != previous_size):
+                break
+
+            result.append((offset, offset + size, utils.SmartStr(header.Tag)))
+            offset += size
+            previous_size = size
+
+        # This is not a small pool page unless the chain covers all of it.
+        if offset != page + 0x1000:
+            result = []
+
+        self._page_cache.Put(page, result)
+        return result
+
+    def get_allocation(self, address):
+        """Returns start, end and tag of the pool allocation containing address.
+
+        For small allocations start is the first byte after the _POOL_HEADER.
+        """
+        big_pages = self._get_big_pages()
+        i = bisect.bisect_right(self._big_page_starts, address) - 1
+        if i >= 0 and address < big_pages[i][1]:
+            return tuple(big_pages[i])
+
+        chain = self._get_page_chain(address & ~0xFFF)
+        i = bisect.bisect_right(chain, (address, 2**64)) - 1
+        if i >= 0 and address < chain[i][1]:
+            start, end, tag = chain[i]
+            return start + self.header_size, end, tag
+
+        return None, None, None
+
+
 # Some pool related utility functions.
 def find_pool_alloc_before(session, offset, pool_tag):
-    """Searches address_space for a pool allocation containing offset."""
-    # This method is only effective for small allocations right now because we
-    # need to find a pool tag (so allocation size is limited to one page).
-    # TODO: Extend this to big page pools.
-    base_offset = offset & ~0xFFF
-    data = session.kernel_address_space.read(base_offset, offset & 0xFFF)
-    buffer_offset = offset % 0x1000
-    pool_header_prototype = session.profile._POOL_HEADER()
-
-    while 1:
-        buffer_offset = data.rfind(pool_tag, 0, buffer_offset)
-        if buffer_offset == -1:
-            break
-
-        result = session.profile._POOL_HEADER(
-            (base_offset + buffer_offset -
-             pool_header_prototype.PoolTag.obj_offset),
-            vm=session.kernel_address_space)
-
-        end_of_allocation = result.obj_offset + result.size
-
-        # Allocation encompasses the required offset.
-        if end_of_allocation > offset:
-            yield result.obj_end
-
-    # After searching in small allocation, assume this is an allocation from
-    # Big Pool and go back several pages.
-    while base_offset > offset - 0x10000:
-        yield base_offset
-        base_offset -= 0x1000
+    """Yields the start of the pool allocation containing offset.
+
+    Nothing is yielded unless the allocation has the pool_tag.
+    """
+    start, _, tag = PoolAllocationResolver.get(session).get_allocation(offset)
+    if start is not None and (
+            _strip_protected(tag) == _strip_protected(pool_tag)):
+        yield start
 
 
 class Pools(common.WindowsCommandPlugin):
@@ -72,8 +213,6 @@ class Pools(common.WindowsCommandPlugin):
 
     name = "pools"
 
-    _pool_lookup = None
-
     table_header = [
         dict(name="descriptor", width=20, style="address"),
         dict(name="type", width=20),
@@ -269,14 +408,7 @@ class Pools(common.WindowsCommandPlugin):
         return descriptors
 
     def is_address_in_pool(self, address):
-        if self._pool_lookup is None:
-            self._pool_lookup = utils.RangedCollection()
-            for descriptor in self.find_all_pool_descriptors():
-                self._pool_lookup.insert(descriptor.PoolStart,
-                                         descriptor.PoolEnd,
-                                         descriptor)
-
-        return self._pool_lookup.get_containing_range(address)
+        return PoolAllocationResolver.get(self.session).get_pool(address)
 
     def collect(self):
         descriptors = self.find_all_pool_descriptors()
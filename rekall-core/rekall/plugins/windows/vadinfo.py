@@ -41,7 +41,6 @@ from rekall.plugins.common import pfn
 from rekall.plugins.windows import address_resolver
 from rekall.plugins.windows import common
 from rekall.plugins.windows import pagefile
-from rekall_lib import utils
 
 
 class VAD(common.WinProcessFilter):
@@ -74,10 +73,6 @@ class VAD(common.WinProcessFilter):
         dict(name='filename')
     ]
 
-    def __init__(self, *args, **kwargs):
-        super(VAD, self).__init__(*args, **kwargs)
-        self._cache = {}
-
     def column_types(self):
         return dict(
             _EPROCESS=self.session.profile._EPROCESS(),
@@ -98,60 +93,42 @@ class VAD(common.WinProcessFilter):
             yield self.find_file_in_task(addr, task)
 
     def find_file_in_task(self, addr, task):
-        resolver = self.GetVadsForProcess(task)
-        if resolver:
-            _, _, data = resolver.get_containing_range(addr)
-            return data
-
-    def _make_cache(self, task):
-        result = utils.RangedCollection()
-        self.session.report_progress(
-            " Enumerating VADs in %s (%s)", task.name, task.pid)
-
-        for vad in task.RealVadRoot.traverse():
-            result.insert(vad.Start, vad.End, (self._get_filename(vad), vad))
-
-        return result
+        vads = self.GetVadsForProcess(task)
+        if vads:
+            i = vads.find(addr)
+            if i is not None:
+                return vads.filenames[i], vads.get_vad(i)
 
     def GetVadsForProcess(self, task):
-        try:
-            resolver = self._cache[task]
-        except KeyError:
-            # Break the recursion by placing a None for the resolver. The
-            # self._make_cache() call will run the vad plugin which might
-            # resolve a VAD PTE, calling this code. This means that we can only
-            # use non-VAD PTEs to read the VAD itself.
-            self._cache[task] = None
-            resolver = self._cache[task] = self._make_cache(task)
-
-        return resolver
+        """Returns the VadIndex for the task.
 
-    def _get_filename(self, vad):
-        filename = ""
-        try:
-            file_obj = vad.ControlArea.FilePointer
-            if file_obj:
-                filename = file_obj.FileName or "Pagefile-backed section"
-        except AttributeError:
-            pass
+        This is None while the index is being built, since reading the VAD tree
+        might resolve a VAD PTE, calling this code.
+        """
+        return common.VadIndex.get(self.session, task)
 
-        return str(filename)
+    def _get_filename(self, vad):
+        return common.get_vad_filename(vad)
 
-    def collect_vadroot(self, vad_root, task):
+    def collect_vads(self, task):
         task_as = task.get_process_address_space()
         result = []
-        for vad in vad_root.traverse():
+        vads = self.GetVadsForProcess(task) or []
+        for i, vad in enumerate(vads):
+            filename = vads.filenames[i]
+
             # Apply filters if needed.
             if self.plugin_args.regex and not re.search(
-                    self.plugin_args.regex, self._get_filename(vad)):
+                    self.plugin_args.regex, filename):
                 continue
 
             if (self.plugin_args.offset is not None and
-                    not vad.Start <= self.plugin_args.offset <= vad.End):
+                    not vads.starts[i] <= self.plugin_args.offset <=
+                    vads.ends[i]):
                 continue
 
             exe = ""
-            if "EXECUTE" in str(vad.u.VadFlags.ProtectionEnum):
+            if "EXECUTE" in vads.protections[i]:
                 exe = "Exe"
 
             result.append(dict(
@@ -165,17 +142,15 @@ class VAD(common.WinProcessFilter):
                 type="Private" if vad.u.VadFlags.PrivateMemory > 0 else "Mapped",
                 exe=exe,
                 protect=vad.u.VadFlags.ProtectionEnum,
-                filename=self._get_filename(vad)))
+                filename=filename))
 
-        # Sort by start range.
-        result.sort(key=lambda x: x["start"].v())
         return result
 
     def collect(self):
         for task in self.filter_processes():
             yield dict(_EPROCESS=task, divider=task)
 
-            for row in self.collect_vadroot(task.RealVadRoot, task):
+            for row in self.collect_vads(task):
                 row["_EPROCESS"] = task
                 yield row
 
@@ -304,7 +279,7 @@ class VADDump(core.DirectoryDumperMixin, VAD):
             with self.session.plugins.cc() as cc:
                 cc.SwitchProcessContext(task)
 
-                for vad in task.RealVadRoot.traverse():
+                for vad in common.VadIndex.get(self.session, task) or []:
                     # Find the start and end range
                     start = vad.Start
                     end = vad.End
@@ -351,7 +326,7 @@ class VadScanner(scan.BaseScanner):
     def scan(self, offset=0, maxlen=None):
         maxlen = maxlen or self.profile.get_constant("MaxPointer")
 
-        for vad in self.task.RealVadRoot.traverse():
+        for vad in common.VadIndex.get(self.session, self.task) or []:
             # Only scan the VAD region.
             for match in super(VadScanner, self).scan(vad.Start, vad.Length):
                 yield match
@@ -21,6 +21,8 @@
 
 """A Rekall Memory Forensics scanner which uses yara."""
 from builtins import object
+import time
+
 import yara
 
 from rekall import scan
@@ -80,6 +82,9 @@ class YaraScanMixin(object):
         scan_physical=True
     )
 
+    # Set to False when the hits are generated outside the main thread.
+    report_progress = True
+
     def __init__(self, *args, **kwargs):
         """Scan using yara signatures."""
         super(YaraScanMixin, self).__init__(*args, **kwargs)
@@ -114,50 +119,70 @@ class YaraScanMixin(object):
             raise plugin.PluginError(
                 "Failed to compile yara expression: %s" % e)
 
-    def generate_hits(self, run):
+    def generate_hits(self, run, deadline=None):
+        """Yields (match, offset) for all hits in the run.
+
+        If deadline is given we stop scanning once it passes.
+        """
         for buffer_as in scan.BufferASGenerator(
                 self.session, run.address_space, run.start, run.end):
-            self.session.report_progress(
-                "Scanning buffer %#x->%#x (length %#x)",
-                buffer_as.base_offset, buffer_as.end(),
-                buffer_as.end() - buffer_as.base_offset)
+            if deadline is not None and time.time() > deadline:
+                return
+
+            if self.report_progress:
+                self.session.report_progress(
+                    "Scanning buffer %#x->%#x (length %#x)",
+                    buffer_as.base_offset, buffer_as.end(),
+                    buffer_as.end() - buffer_as.base_offset)
 
             for match in self.rules.match(data=buffer_as.data):
                 for buffer_offset, name, value in match.strings:
                     hit_offset = buffer_offset + buffer_as.base_offset
                     yield match, hit_offset
 
+    def read_context(self, run, address):
+        """Read the data around the hit for the hexdump."""
+        return run.address_space.read(
+            address - self.plugin_args.pre_context,
+            self.plugin_args.context + self.plugin_args.pre_context)
+
+    def generate_run_hits(self, run, deadline=None):
+        """Yields (run, match, address, context data) for hits in the run."""
+        for match, address in self.generate_hits(run, deadline=deadline):
+            yield run, match, address, self.read_context(run, address)
+
+    def generate_matches(self):
+        """Yields (run, match, address, context data) for all hits."""
+        for run in self.generate_memory_ranges():
+            for result in self.generate_run_hits(run):
+                yield result
+
     def collect(self):
         """Render output."""
         count = 0
-        for run in self.generate_memory_ranges():
-            for match, address in self.generate_hits(run):
-                count += 1
-                if count >= self.plugin_args.hits:
-                    break
-
-                # Result hit the physical memory - Get some context on this hit.
-                if run.data.get("type") == "PhysicalAS":
-                    symbol = pfn.PhysicalAddressContext(self.session, address)
-                else:
-                    symbol = utils.FormattedAddress(
-                        self.session.address_resolver, address,
-                        max_distance=2**64)
-
-                yield dict(
-                    Owner=run.data.get("task") or run.data.get("type"),
-                    Match=match,
-                    Rule=match.rule,
-                    Offset=address,
-                    hexdump=utils.HexDumpedString(
-                        run.address_space.read(
-                            address - self.plugin_args.pre_context,
-                            self.plugin_args.context +
-                            self.plugin_args.pre_context)),
-                    Context=symbol,
-                    # Provide the address space where the hit is reported.
-                    address_space=run.address_space,
-                    run=run)
+        for run, match, address, data in self.generate_matches():
+            count += 1
+            if count >= self.plugin_args.hits:
+                break
+
+            # Result hit the physical memory - Get some context on this hit.
+            if run.data.get("type") == "PhysicalAS":
+                symbol = pfn.PhysicalAddressContext(self.session, address)
+            else:
+                symbol = utils.FormattedAddress(
+                    self.session.address_resolver, address,
+                    max_distance=2**64)
+
+            yield dict(
+                Owner=run.data.get("task") or run.data.get("type"),
+                Match=match,
+                Rule=match.rule,
+                Offset=address,
+                hexdump=utils.HexDumpedString(data),
+                Context=symbol,
+                # Provide the address space where the hit is reported.
+                address_space=run.address_space,
+                run=run)
 
 
 class SimpleYaraScan(YaraScanMixin, plugin.TypedProfileCommand,
@@ -358,6 +358,10 @@ class BaseScanner(with_metaclass(registry.MetaclassRegistry, object)):
 
     progress_message = "Scanning 0x%(offset)08X with %(name)s"
 
+    # Scanners running outside the main thread must leave progress reporting
+    # to their caller.
+    report_progress = True
+
     checks = ()
 
     def __init__(self, profile=None, address_space=None, window_size=8,
@@ -465,10 +469,11 @@ class BaseScanner(with_metaclass(registry.MetaclassRegistry, object)):
 
         for buffer_as in BufferASGenerator(
                 self.session, self.address_space, offset, end):
-            self.session.report_progress(
-                "Scanning buffer %#x->%#x (%#x)",
-                buffer_as.base_offset, buffer_as.end(),
-                buffer_as.end() - buffer_as.base_offset)
+            if self.report_progress:
+                self.session.report_progress(
+                    "Scanning buffer %#x->%#x (%#x)",
+                    buffer_as.base_offset, buffer_as.end(),
+                    buffer_as.end() - buffer_as.base_offset)
 
             # Now scan within the received buffer.
             scan_offset = buffer_as.base_offset
@@ -34,6 +34,7 @@ import logging
 import os
 import pdb
 import sys
+import threading
 import time
 import traceback
 import weakref
@@ -583,8 +584,12 @@ class Session(with_metaclass(registry.MetaclassRegistry, object)):
         # At the start we haven't run any plugin.
         self.last = None
 
-        # Locks for running hooks.
-        self._hook_locks = set()
+        # Locks for running hooks. Each hook has its own lock so that threads
+        # calculate it only once, and each thread keeps track of the hooks it
+        # is running to detect recursion.
+        self._hook_locks = {}
+        self._hook_locks_lock = threading.Lock()
+        self._running_hooks = threading.local()
 
         # Hooks that will be called when we get flushed.
         self._flush_hooks = []
@@ -791,21 +796,38 @@ class Session(with_metaclass(registry.MetaclassRegistry, object)):
         """Launches the registered parameter hook for name."""
         for cls in list(kb.ParameterHook.classes.values()):
             if cls.name == name and cls.is_active(self):
-                if name in self._hook_locks:
+                running = getattr(self._running_hooks, "names", None)
+                if running is None:
+                    running = self._running_hooks.names = set()
+
+                if name in running:
                     # This should never happen! If it does then this will block
                     # in a loop so we fail hard.
                     raise RecursiveHookException(
                         "Trying to invoke hook %s recursively!" % name)
 
+                with self._hook_locks_lock:
+                    lock = self._hook_locks.setdefault(name, threading.Lock())
+
+                if not lock.acquire(False):
+                    # Another thread is calculating this hook - wait for it
+                    # and use its result.
+                    lock.acquire()
+                    result = self.cache.Get(name)
+                    if result is not None:
+                        lock.release()
+                        return result
+
                 try:
-                    self._hook_locks.add(name)
+                    running.add(name)
                     hook = cls(session=self)
                     result = hook.calculate()
 
                     # Cache the output from the hook directly.
                     self.SetCache(name, result, volatile=hook.volatile)
                 finally:
-                    self._hook_locks.remove(name)
+                    running.remove(name)
+                    lock.release()
 
                 return result
 
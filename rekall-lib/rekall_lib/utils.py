@@ -32,6 +32,8 @@ from builtins import range
 
 from past.builtins import basestring
 from builtins import object
+import array
+import bisect
 import builtins
 import pickle
 import io
@@ -822,6 +824,95 @@ class SortedCollection(sortedcontainers.SortedDict):
 
 
 
+def _UInt64Array(values=()):
+    """An array of unsigned 64 bit integers."""
+    try:
+        return array.array("Q", values)
+    except ValueError:
+        # Python 2 does not support the Q typecode.
+        return array.array("L", values)
+
+
+class AddressTable(object):
+    """A sorted map of addresses to names optimized for lookups.
+
+    Names are added into a staging dict. On the first lookup the table is
+    frozen into a sorted array of 64 bit addresses and a parallel list of
+    names, which are then searched with bisect. This is much more compact and
+    faster than a SortedDict of Python objects for the large, rarely modified
+    symbol tables held by profiles.
+    """
+
+    def __init__(self, data=None):
+        self._staging = dict(data or {})
+        self._addresses = None
+        self._names = None
+
+    def _freeze(self):
+        if self._addresses is None:
+            keys = sorted(self._staging)
+            self._addresses = _UInt64Array(keys)
+            self._names = [self._staging[x] for x in keys]
+
+    def _thaw(self):
+        self._addresses = self._names = None
+
+    def __len__(self):
+        return len(self._staging)
+
+    def __contains__(self, address):
+        return address in self._staging
+
+    def __getitem__(self, address):
+        return self._staging[address]
+
+    def __setitem__(self, address, name):
+        self._staging[address] = name
+        self._thaw()
+
+    def __iter__(self):
+        # Like SortedCollection, iterate over the names in address order.
+        self._freeze()
+        return iter(self._names)
+
+    def get(self, address, default=None):
+        return self._staging.get(address, default)
+
+    def update(self, other):
+        if other:
+            self._staging.update(other)
+            self._thaw()
+
+    def items(self):
+        self._freeze()
+        return list(zip(self._addresses, self._names))
+
+    def copy(self):
+        result = self.__class__()
+        result._staging = self._staging.copy()
+        result._addresses = self._addresses
+        result._names = self._names
+        return result
+
+    def get_value_smaller_than(self, address):
+        """Returns (address, name) for the largest address <= address."""
+        self._freeze()
+        idx = bisect.bisect_right(self._addresses, address)
+        if idx == 0:
+            return None, None
+
+        return self._addresses[idx - 1], self._names[idx - 1]
+
+    def get_value_larger_than(self, address):
+        """Returns (address, name) for the smallest address >= address."""
+        self._freeze()
+        idx = bisect.bisect_left(self._addresses, address)
+        if idx == len(self._addresses):
+            return None, None
+
+        return self._addresses[idx], self._names[idx]
+
+
 class RangedCollection(object):
     """A convenience wrapper around SortedCollection for ranges."""
 
@@ -0,0 +1,59 @@
+from rekall import testlib
+from rekall_lib import utils
+
+
+class TestAddressTable(testlib.RekallBaseUnitTestCase):
+    """Test the compact address -> name table used by profiles."""
+
+    def testUInt64Array(self):
+        values = [0, 0xffffffff, 0xfffff80000000000, 2**64 - 1]
+        array = utils._UInt64Array(values)
+        self.assertEqual(list(array), values)
+        self.assertEqual(array.itemsize, 8)
+
+        self.assertEqual(len(utils._UInt64Array()), 0)
+        with self.assertRaises(OverflowError):
+            utils._UInt64Array([2**64])
+
+    def testLookups(self):
+        table = utils.AddressTable({0x2000: "b", 0x1000: "a"})
+        table[0xfffff80000001000] = "kernel"
+
+        self.assertEqual(len(table), 3)
+        self.assertTrue(0x1000 in table)
+        self.assertEqual(table[0x2000], "b")
+        self.assertEqual(list(table), ["a", "b", "kernel"])
+
+        self.assertEqual(table.get_value_smaller_than(0x1fff), (0x1000, "a"))
+        self.assertEqual(table.get_value_smaller_than(0x2000), (0x2000, "b"))
+        self.assertEqual(table.get_value_larger_than(0x1001), (0x2000, "b"))
+        self.assertEqual(table.get_value_smaller_than(2**64 - 1),
+                         (0xfffff80000001000, "kernel"))
+
+        # Below the first and above the last address.
+        self.assertEqual(table.get_value_smaller_than(0xfff), (None, None))
+        self.assertEqual(table.get_value_larger_than(2**64 - 1),
+                         (None, None))
+
+    def testUpdates(self):
+        table = utils.AddressTable({0x1000: "a"})
+        self.assertEqual(table.get_value_smaller_than(0x1800), (0x1000, "a"))
+
+        # Changes after a lookup are seen by the next lookup, and the last
+        # name set for an address wins.
+        table[0x1000] = "first"
+        table.update({0x1400: "c", 0x1000: "last"})
+        self.assertEqual(table.get_value_smaller_than(0x1200),
+                         (0x1000, "last"))
+        self.assertEqual(table.get_value_smaller_than(0x1800), (0x1400, "c"))
+
+        # Copies do not share their updates.
+        copy = table.copy()
+        copy[0x1800] = "d"
+        self.assertEqual(table.get_value_smaller_than(0x1800), (0x1400, "c"))
+        self.assertEqual(copy.get_value_smaller_than(0x1800), (0x1800, "d"))
+        self.assertEqual(table.items(), [(0x1000, "last"), (0x1400, "c")])
+
+
+if __name__ == "__main__":
+    testlib.main()